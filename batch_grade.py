@@ -0,0 +1,393 @@
+"""
+Grades a whole class's submissions locally, e.g. to regrade everyone after a
+test was changed mid-semester.
+
+Takes the directory of a Gradescope submission export (one folder per
+submission) and grades each submission with the tests in this autograder.
+Every submission gets its own copy of the autograder in a separate workspace,
+so several can be graded at once in separate processes.
+
+Writes one results.json (and the TA print output) per submission to the output
+directory, along with a summary.csv of everyone's scores. Every test's result
+is also appended to the results_store directory, which
+tests/utils/runnables/query_results.py summarizes (pass rates, slowest tests,
+and the score distribution). Every submission's test durations go into one
+shared test_history.json there too, so run_tests.py can run the quick tests
+first. Test results are cached in result_cache there, so grading the same
+output directory again only runs the test classes that changed.
+
+Like the autograder itself, this must be run as root inside the autograder's
+docker image (or a machine set up by setup.sh) so the student's code can be
+run as the "student" user.
+
+Usage: python3 batch_grade.py <export_dir> <output_dir> [--jobs N] [--no-cache]
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+AUTOGRADER_DIR = os.path.dirname(os.path.abspath(__file__))
+# For importing the tests' utils, e.g. utils.result_store
+TESTS_DIR = os.path.join(AUTOGRADER_DIR, "tests")
+if TESTS_DIR not in sys.path:
+    sys.path.insert(0, TESTS_DIR)
+RESULT_STORE = "results_store"
+# Shared by every submission's run_tests.py, see its HISTORY_PATH
+TEST_HISTORY = "test_history.json"
+# Test results reused when grading the same submission again with test
+# classes that haven't changed, see utils/result_cache.py
+RESULT_CACHE = "result_cache"
+
+SUMMARY_FIELDS = [
+    "submission",
+    "status",
+    "score",
+    "max_score",
+    "tests",
+    "tests_failed",
+    "duration",
+]
+
+
+def find_submissions(export_dir: str) -> list[str]:
+    """
+    Returns the paths of the submission folders in a Gradescope export
+    """
+    return sorted(
+        os.path.join(export_dir, name)
+        for name in os.listdir(export_dir)
+        if os.path.isdir(os.path.join(export_dir, name))
+    )
+
+
+def make_workspace(workspace: str, submission_dir: str) -> None:
+    """
+    Lays out a workspace the same way Gradescope lays out /autograder, with
+    the same permissions that setup.sh gives the student user
+    """
+    source = os.path.join(workspace, "source")
+    shutil.copytree(
+        os.path.join(AUTOGRADER_DIR, "tests"),
+        os.path.join(source, "tests"),
+        ignore=shutil.ignore_patterns("__pycache__", "ta_print.txt"),
+    )
+    shutil.copy(os.path.join(AUTOGRADER_DIR, "run_tests.py"), source)
+    shutil.copytree(submission_dir, os.path.join(workspace, "submission"))
+    os.makedirs(os.path.join(workspace, "results"))
+
+    # The student user can get to the source directory, but can't read the
+    # tests or the other directories
+    os.chmod(workspace, 0o711)
+    for entry in os.listdir(os.path.join(source, "tests")):
+        path = os.path.join(source, "tests", entry)
+        os.chmod(path, os.stat(path).st_mode & 0o770)
+    os.chmod(source, 0o777)
+
+
+def run_submission(
+    submission_dir: str,
+    work_dir: str,
+    timeout: float,
+    history_path: str,
+    name: str = None,
+    cache_dir: str = "",
+) -> tuple[dict, bytes, bytes]:
+    """
+    Runs the tests on one submission in its own workspace. Returns its
+    summary row (with its status and duration), the TA print output, and
+    the contents of its results.json (None if there isn't one).
+
+    name - The submission's name. Default is the folder's name
+    cache_dir - Where test results are cached. "" doesn't cache them
+    """
+    name = name or os.path.basename(os.path.normpath(submission_dir))
+    workspace = tempfile.mkdtemp(prefix=name + "-", dir=work_dir)
+    make_workspace(workspace, submission_dir)
+
+    env = dict(os.environ)
+    env["AUTOGRADER_SOURCE_DIR"] = os.path.join(workspace, "source")
+    env["AUTOGRADER_SUBMISSION_DIR"] = os.path.join(workspace, "submission")
+    env["AUTOGRADER_RESULTS_DIR"] = os.path.join(workspace, "results")
+    env["AUTOGRADER_TEST_HISTORY"] = history_path
+    env["AUTOGRADER_RESULT_CACHE"] = cache_dir
+
+    row = {"submission": name, "status": "ok"}
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(
+            [sys.executable, "run_tests.py"],
+            cwd=env["AUTOGRADER_SOURCE_DIR"],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=timeout,
+        )
+        log = process.stdout
+    except subprocess.TimeoutExpired as e:
+        row["status"] = "timeout"
+        log = e.stdout or b""
+    row["duration"] = round(time.perf_counter() - start, 2)
+
+    results_path = os.path.join(env["AUTOGRADER_RESULTS_DIR"], "results.json")
+    try:
+        with open(results_path, "rb") as f:
+            results = f.read()
+    except FileNotFoundError:
+        results = None
+    return row, log, results
+
+
+def save_submission(
+    output_dir: str, row: dict, log: bytes, results: bytes
+) -> dict:
+    """
+    Writes a graded submission's TA print output and results.json to the
+    output directory, adds them to the result store, and returns its
+    summary row with the score filled in
+    """
+    name = row["submission"]
+    student_output_dir = os.path.join(output_dir, name)
+    os.makedirs(student_output_dir, exist_ok=True)
+    with open(os.path.join(student_output_dir, "ta_print.txt"), "wb") as f:
+        f.write(log)
+
+    try:
+        if results is None:
+            raise FileNotFoundError
+        parsed = json.loads(results)
+        with open(os.path.join(student_output_dir, "results.json"), "wb") as f:
+            f.write(results)
+        row["score"] = parsed.get("score", 0)
+        row["max_score"] = sum(
+            test.get("max_score", 0) for test in parsed["tests"]
+        )
+        row["tests"] = len(parsed["tests"])
+        row["tests_failed"] = sum(
+            test.get("status") == "failed" for test in parsed["tests"]
+        )
+        store_results(output_dir, name, parsed)
+    except (FileNotFoundError, json.JSONDecodeError):
+        if row["status"] == "ok":
+            row["status"] = "error"
+    except Exception as error:
+        # e.g. a test without a number or name, which shouldn't stop the
+        # rest of the submissions from being graded
+        print(f"{name}: couldn't save the results: {error!r}", file=sys.stderr)
+        row["status"] = "error"
+
+    return row
+
+
+def grade_submission(
+    submission_dir: str,
+    output_dir: str,
+    work_dir: str,
+    timeout: float,
+    use_cache: bool = True,
+) -> dict:
+    """
+    Grades one submission in its own workspace and returns its summary row
+    """
+    row, log, results = run_submission(
+        submission_dir,
+        work_dir,
+        timeout,
+        os.path.join(output_dir, TEST_HISTORY),
+        cache_dir=os.path.join(output_dir, RESULT_CACHE) if use_cache else "",
+    )
+    return save_submission(output_dir, row, log, results)
+
+
+def seed_history(history_path: str) -> None:
+    """
+    Starts the test history from the image's, if there is one
+    """
+    shipped_history = os.path.join(AUTOGRADER_DIR, "tests", TEST_HISTORY)
+    if not os.path.exists(history_path) and os.path.isfile(shipped_history):
+        shutil.copy(shipped_history, history_path)
+
+
+def store_results(output_dir: str, name: str, results: dict) -> None:
+    """
+    Appends the submission's test results to the output's result store
+    """
+    # Imported here so the tests' utils are only loaded when grading
+    import utils.result_store as result_store
+
+    result_store.append_results(
+        os.path.join(output_dir, RESULT_STORE), name, results
+    )
+
+
+def batch_grade(
+    export_dir: str,
+    output_dir: str,
+    jobs: int = None,
+    timeout: float = None,
+    keep_workspaces: bool = False,
+    use_cache: bool = True,
+) -> list[dict]:
+    """
+    Grades every submission in the export directory, jobs at a time, and
+    returns the summary rows
+
+    use_cache - Reuse the results of test classes that haven't changed since
+                the submission was last graded into this output directory
+    """
+    submissions = find_submissions(export_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    seed_history(os.path.join(output_dir, TEST_HISTORY))
+    work_dir = tempfile.mkdtemp(prefix="batch-grade-")
+    os.chmod(work_dir, 0o711)
+
+    jobs = jobs or len(os.sched_getaffinity(0))
+    rows = []
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    grade_submission,
+                    submission,
+                    output_dir,
+                    work_dir,
+                    timeout,
+                    use_cache,
+                )
+                for submission in submissions
+            ]
+            for future in as_completed(futures):
+                rows.append(future.result())
+                print_progress(rows, len(submissions))
+    finally:
+        if keep_workspaces:
+            print("Workspaces kept in " + work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+
+    write_summary(output_dir, rows, elapsed, f"{jobs} workers")
+    return rows
+
+
+def print_progress(rows: list[dict], total: int) -> None:
+    """
+    Prints the last graded submission's score
+    """
+    row = rows[-1]
+    print(
+        f"[{len(rows)}/{total}] {row['submission']}: "
+        f"{row.get('score', '-')}/{row.get('max_score', '-')} "
+        f"({row['status']}, {row['duration']}s)",
+        flush=True,
+    )
+
+
+def write_summary(
+    output_dir: str, rows: list[dict], elapsed: float, workers: str
+) -> None:
+    """
+    Writes summary.csv and prints the throughput
+    """
+    rows.sort(key=lambda row: row["submission"])
+    with open(os.path.join(output_dir, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    per_minute = len(rows) / elapsed * 60 if elapsed > 0 else 0
+    print(
+        f"Graded {len(rows)} submissions in {elapsed:.1f}s with {workers} "
+        f"({per_minute:.1f} submissions/minute)"
+    )
+
+
+def check_similarity(
+    export_dir: str, output_dir: str, base_dir: str = None
+) -> None:
+    """
+    Writes similarity.csv, listing functions that are similar across
+    submissions, as a first pass when checking for plagiarism
+    """
+    # Imported here so grading doesn't need libclang unless this is used
+    import utils.similarity as similarity
+
+    submission_dirs = {
+        os.path.basename(path): path for path in find_submissions(export_dir)
+    }
+    matches = similarity.similarity_report(submission_dirs, base_dir)
+    similarity.write_csv(matches, os.path.join(output_dir, "similarity.csv"))
+    pairs = similarity.group_by_pair(matches)
+    print(
+        f"{len(pairs)} pairs of submissions have similar functions "
+        "(see similarity.csv)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Grade every submission in a Gradescope export"
+    )
+    parser.add_argument(
+        "export_dir", help="Directory with one folder per submission"
+    )
+    parser.add_argument(
+        "output_dir", help="Where the results and summary.csv are written"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="How many submissions to grade at once (default: one per core)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds before grading a single submission is stopped",
+    )
+    parser.add_argument(
+        "--keep-workspaces",
+        action="store_true",
+        help="Keep each submission's workspace for debugging",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Run every test, even ones whose results are cached from the "
+        "last time this output directory was graded",
+    )
+    parser.add_argument(
+        "--similarity",
+        action="store_true",
+        help="Also write similarity.csv of functions that are similar "
+        "across submissions",
+    )
+    parser.add_argument(
+        "--starter-code",
+        default=None,
+        help="Directory of starter code to ignore with --similarity",
+    )
+    args = parser.parse_args()
+
+    if os.geteuid() != 0:
+        sys.exit("batch_grade.py must be run as root, like the autograder")
+
+    batch_grade(
+        args.export_dir,
+        args.output_dir,
+        args.jobs,
+        args.timeout,
+        args.keep_workspaces,
+        not args.no_cache,
+    )
+    if args.similarity:
+        check_similarity(args.export_dir, args.output_dir, args.starter_code)
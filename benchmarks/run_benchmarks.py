@@ -0,0 +1,368 @@
+"""
+Benchmarks for the framework's own hot paths, to catch changes that make
+grading slower.
+
+Runs offline against the example_sample_code submission and synthetic inputs
+(large outputs, big C++ files, wide submission trees). Each benchmark is
+timed several times and the fastest run is kept, since slower runs are
+usually noise from other processes.
+
+Results are compared with a JSON baseline, and the script exits with an error
+if any benchmark got slower than the baseline by more than the threshold.
+Baselines depend on the machine, so save one on the machine you compare on:
+
+    python3 benchmarks/run_benchmarks.py --save     # Record the baseline
+    python3 benchmarks/run_benchmarks.py            # Compare against it
+
+Benchmarks that need something missing (libclang, root and the "student"
+user, a C compiler) are skipped.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "tests"))
+
+import utils  # noqa: E402
+import utils.common as common  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+SAMPLE_CODE_ZIP = os.path.join(
+    REPO_DIR, "example_sample_code", "samplecode.zip"
+)
+# A benchmark fails if it's this much slower than the baseline (0.25 = 25%)
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_REPEATS = 5
+
+_benchmarks = {}
+
+
+class SkipBenchmark(Exception):
+    """
+    Raised by a benchmark's setup when it can't be run on this machine
+    """
+
+
+def benchmark(name: str):
+    """
+    Registers a benchmark. The decorated function does the setup and returns
+    a function with no arguments, which is what gets timed.
+    """
+
+    def register(setup):
+        _benchmarks[name] = setup
+        return setup
+
+    return register
+
+
+def best_time(run, repeats: int) -> float:
+    """
+    Returns the fastest of repeats runs in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def synthetic_output(lines: int) -> str:
+    return "".join(
+        f"Case {i}: {i} + {i * 3} = {i * 4} pass\n" for i in range(lines)
+    )
+
+
+def synthetic_cpp(functions: int) -> str:
+    # Each function calls the one before it, so extracting the last one with
+    # its calls pulls in the whole file
+    return (
+        "#include <iostream>\n#include <vector>\n"
+        + "".join(
+            f"int f{i}(int x) {{ return x + f{max(i - 1, 0)}(x - 1); }}\n"
+            for i in range(functions)
+        )
+        + "int main() { std::cout << f5(1) << std::endl; return 0; }\n"
+    )
+
+
+@benchmark("phrases_out_of_order_200k_lines")
+def bench_phrases_out_of_order(work_dir):
+    output = synthetic_output(200_000)
+    expected = [f"Case {i}: " for i in range(0, 200_000, 1000)]
+    return lambda: utils.phrases_out_of_order(expected, output)
+
+
+@benchmark("check_phrases_200k_lines_missing")
+def bench_check_phrases(work_dir):
+    output = synthetic_output(200_000)
+    # Missing phrases make check_phrases build its hint
+    expected = [f"Case {i}: " for i in range(0, 200_000, 1000)] + ["absent"]
+
+    def run():
+        try:
+            utils.check_phrases(expected, output)
+        except AssertionError:
+            pass
+
+    return run
+
+
+@benchmark("check_phrases_typos_30k_chars")
+def bench_check_phrases_typos(work_dir):
+    output = synthetic_output(1_000)[:30_000]
+    # Half of the phrases have a typo and half aren't there at all
+    lines = output.splitlines()[::4]
+    expected = [line[:4] + "x" + line[5:] for line in lines[:100]]
+    expected += [f"Not printed {i}" for i in range(100)]
+
+    def run():
+        utils.check_phrases(expected, output, 2, max_edits=2)
+
+    return run
+
+
+@benchmark("check_phrases_typos_short_phrases")
+def bench_check_phrases_short_typos(work_dir):
+    output = synthetic_output(1_000)[:30_000]
+    # Short phrases that aren't there allow the fewest edits per piece
+    expected = [f"Gone {i:03d}" for i in range(200)]
+
+    def run():
+        utils.check_phrases(expected, output, 2, max_edits=2)
+
+    return run
+
+
+@benchmark("phrases_out_of_order_large_output_50mb")
+def bench_large_output(work_dir):
+    path = os.path.join(work_dir, "large_output.txt")
+    with open(path, "w") as f:
+        for _ in range(50):
+            f.write(synthetic_output(25_000))
+    output = utils.LargeOutput.from_file(path)
+    # The missing phrase at the end makes it search the whole file
+    expected = [f"Case {i}: " for i in range(0, 25_000, 250)] * 3
+    expected.append("absent")
+    return lambda: utils.phrases_out_of_order(expected, output)
+
+
+def _parsing():
+    try:
+        import utils.parsing as parsing
+        from clang.cindex import Index
+
+        Index.create()
+    except Exception as e:
+        raise SkipBenchmark(f"libclang isn't usable ({e})")
+    return parsing
+
+
+@benchmark("remove_functions_2000_functions")
+def bench_remove_functions(work_dir):
+    parsing = _parsing()
+    source = os.path.join(work_dir, "big.cpp")
+    with open(source, "w") as f:
+        f.write(synthetic_cpp(2000))
+    output = os.path.join(work_dir, "big_no_main.cpp")
+    return lambda: parsing.remove_functions(source, output, "main")
+
+
+@benchmark("extract_functions_2000_functions")
+def bench_extract_functions(work_dir):
+    parsing = _parsing()
+    source = os.path.join(work_dir, "big.cpp")
+    with open(source, "w") as f:
+        f.write(synthetic_cpp(2000))
+    output = os.path.join(work_dir, "big_extracted.cpp")
+    return lambda: parsing.extract_functions(
+        source, output, True, True, "f1999"
+    )
+
+
+@benchmark("remove_main_sample_code")
+def bench_remove_main_sample(work_dir):
+    parsing = _parsing()
+    with zipfile.ZipFile(SAMPLE_CODE_ZIP) as sample:
+        sample.extract("studentMain.cpp", work_dir)
+    source = os.path.join(work_dir, "studentMain.cpp")
+    output = os.path.join(work_dir, "studentMainNoMain.cpp")
+    return lambda: parsing.remove_functions(source, output, "main")
+
+
+@benchmark("check_and_get_files_wide_tree")
+def bench_check_and_get_files(work_dir):
+    submission = os.path.join(work_dir, "submission")
+    with zipfile.ZipFile(SAMPLE_CODE_ZIP) as sample:
+        sample.extractall(submission)
+    # A submission with the project folder, build output, and editor files
+    # students sometimes upload along with their code
+    for folder in range(50):
+        folder_path = os.path.join(submission, f"folder{folder}")
+        os.makedirs(folder_path)
+        for file in range(40):
+            with open(os.path.join(folder_path, f"notes{file}.txt"), "w") as f:
+                f.write("x" * 100)
+    destination = os.path.join(work_dir, "source")
+    os.makedirs(destination)
+    required = ["studentMain.cpp", "studentFuncs.cpp", "studentFuncs.h"]
+    optional = ["makefile"]
+
+    def run():
+        previous = common.SUBMISSION_DIR, common.WORK_DIR
+        common.SUBMISSION_DIR, common.WORK_DIR = submission, destination
+        try:
+            utils.setup.check_and_get_files(
+                required, optional, files_must_be_expected=False
+            )
+        finally:
+            common.SUBMISSION_DIR, common.WORK_DIR = previous
+
+    return run
+
+
+@benchmark("run_program_per_call")
+def bench_run_program(work_dir):
+    if os.geteuid() != 0:
+        raise SkipBenchmark("must be run as root to run as the student user")
+    try:
+        subprocess.run(["id", "student"], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        raise SkipBenchmark('the "student" user doesn\'t exist')
+    compiler = shutil.which("gcc") or shutil.which("cc")
+    if compiler is None:
+        raise SkipBenchmark("no C compiler found")
+
+    source = os.path.join(work_dir, "hello.c")
+    executable = os.path.join(work_dir, "hello.out")
+    with open(source, "w") as f:
+        f.write('#include <stdio.h>\nint main(){puts("hello");return 0;}\n')
+    subprocess.run([compiler, source, "-o", executable], check=True)
+    os.chmod(work_dir, 0o755)
+    os.chmod(executable, 0o755)
+    return lambda: utils.run_program(executable, txt_contents="")
+
+
+def run_benchmarks(names: list[str], repeats: int) -> dict:
+    """
+    Runs the named benchmarks and returns their best times in seconds.
+    Skipped benchmarks are left out.
+    """
+    results = {}
+    for name in names:
+        work_dir = tempfile.mkdtemp(prefix="benchmark-")
+        try:
+            run = _benchmarks[name](work_dir)
+            results[name] = best_time(run, repeats)
+            print(f"{name:45} {results[name] * 1000:10.1f} ms")
+        except SkipBenchmark as e:
+            print(f"{name:45} {'skipped':>13} ({e})")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Returns a message for every benchmark slower than its baseline by more
+    than the threshold
+    """
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        change = seconds / baseline[name] - 1
+        if change > threshold:
+            regressions.append(
+                f"{name}: {seconds * 1000:.1f} ms vs "
+                f"{baseline[name] * 1000:.1f} ms baseline "
+                f"({change:+.0%}, threshold {threshold:+.0%})"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the autograder framework"
+    )
+    parser.add_argument(
+        "names",
+        nargs="*",
+        help="Benchmarks to run (default: all of them)",
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_PATH,
+        help="Path of the baseline JSON file",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Allowed slowdown before failing, e.g. 0.25 for 25%%",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=DEFAULT_REPEATS,
+        help="How many times each benchmark is timed",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="List the benchmarks and exit"
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(_benchmarks))
+        sys.exit(0)
+
+    unknown = [name for name in args.names if name not in _benchmarks]
+    if unknown:
+        sys.exit("Unknown benchmarks: " + " ".join(unknown))
+
+    # ta_print output from the benchmarks shouldn't end up in the tests
+    descriptor, common.TA_PRINT_FILE = tempfile.mkstemp(suffix=".txt")
+    os.close(descriptor)
+    atexit.register(os.remove, common.TA_PRINT_FILE)
+
+    results = run_benchmarks(args.names or list(_benchmarks), args.repeats)
+
+    if args.save:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Saved the baseline to " + args.baseline)
+        sys.exit(0)
+
+    if not os.path.isfile(args.baseline):
+        print("No baseline to compare with. Save one with --save")
+        sys.exit(0)
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\nSlower than the baseline:")
+        print("\n".join(regressions))
+        sys.exit(1)
+    print("\nNo regressions")
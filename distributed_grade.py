@@ -0,0 +1,548 @@
+"""
+Grades a Gradescope export with several machines, e.g. to regrade a few large
+courses at the end of the semester.
+
+A coordinator hands out the submissions over a TCP (host:port) or Unix
+(unix:/path) socket. Workers on any number of machines connect to it, grade
+one submission at a time per job with batch_grade.py's run_submission (each
+in its own workspace), and send back its results.json and TA print output.
+The coordinator writes them to the output directory like batch_grade.py does:
+one folder per submission, the result store, and summary.csv.
+
+If a worker disconnects or doesn't send a result in time, its submission is
+given to another worker. Every worker must have the same autograder (this
+directory, set up with setup.sh) and, like batch_grade.py, run as root.
+
+Usage:
+    python3 distributed_grade.py coordinator <export_dir> <output_dir>
+        [--listen HOST:PORT | --listen unix:PATH] [--timeout SECONDS]
+    python3 distributed_grade.py worker <coordinator address> [--jobs N]
+
+e.g. to try it on one machine with two workers:
+    python3 distributed_grade.py coordinator export out --listen unix:/tmp/g
+    python3 distributed_grade.py worker unix:/tmp/g --jobs 2
+
+The coordinator serves the students' code to anyone with the token, so give
+the coordinator and workers the same --token (or $BATCH_GRADE_TOKEN), which
+is required for TCP, and only listen on a trusted network. By default it
+only listens on this machine (127.0.0.1).
+"""
+
+import argparse
+import collections
+import hashlib
+import hmac
+import io
+import json
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import batch_grade
+
+DEFAULT_ADDRESS = "127.0.0.1:7777"
+# Longest a worker can take to send back a submission it was given, when the
+# coordinator has no --timeout. Then it's given to another worker
+DEFAULT_LEASE = 30 * 60
+# Extra seconds a worker gets on top of the timeout to send back its result
+LEASE_MARGIN = 60
+# How long a worker waits before asking again when every remaining
+# submission is already being graded
+WAIT_SECONDS = 1
+# Longest message header (a line of JSON)
+MAX_HEADER = 1024 * 1024
+
+
+# Protocol. Every message is a line of JSON with its "type" and the "size" of
+# the bytes that follow it (e.g. a submission or results.json)
+
+
+def send_message(stream, header: dict, payload: bytes = b"") -> None:
+    """
+    Writes a message to a socket's file
+    """
+    header = dict(header, size=len(payload))
+    stream.write(json.dumps(header).encode("utf-8") + b"\n" + payload)
+    stream.flush()
+
+
+def receive_message(stream) -> tuple[dict, bytes]:
+    """
+    Reads the next message from a socket's file. Raises a ConnectionError if
+    the connection closed.
+    """
+    line = stream.readline(MAX_HEADER)
+    if not line.endswith(b"\n"):
+        raise ConnectionError("The connection closed")
+    header = json.loads(line)
+    payload = stream.read(header.get("size", 0))
+    if len(payload) != header.get("size", 0):
+        raise ConnectionError("The connection closed")
+    return header, payload
+
+
+def parse_address(address: str) -> tuple[int, object]:
+    """
+    Returns the socket family and address of "host:port" or "unix:path"
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:") :]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def check_token(address: str, token: str) -> None:
+    """
+    Raises a ValueError if the coordinator would listen on TCP without a
+    token, which would let anyone who can reach it download the submissions
+    """
+    if parse_address(address)[0] != socket.AF_UNIX and not token:
+        raise ValueError(
+            "A --token (or $BATCH_GRADE_TOKEN) is required to listen on TCP"
+        )
+
+
+def autograder_digest() -> str:
+    """
+    Returns a hash of run_tests.py and the tests directory, so workers with
+    a different version of the autograder can be turned away
+    """
+    hasher = hashlib.sha256()
+    paths = [os.path.join(batch_grade.AUTOGRADER_DIR, "run_tests.py")]
+    tests_dir = os.path.join(batch_grade.AUTOGRADER_DIR, "tests")
+    for root, directories, files in os.walk(tests_dir):
+        directories[:] = sorted(d for d in directories if d != "__pycache__")
+        for file in sorted(files):
+            if file not in ("ta_print.txt", batch_grade.TEST_HISTORY):
+                paths.append(os.path.join(root, file))
+    for path in paths:
+        hasher.update(
+            os.path.relpath(path, batch_grade.AUTOGRADER_DIR).encode()
+        )
+        with open(path, "rb") as f:
+            hasher.update(hashlib.sha256(f.read()).digest())
+    return hasher.hexdigest()
+
+
+def pack_directory(directory: str) -> bytes:
+    """
+    Returns the directory's files as a gzipped tar
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        tar.add(directory, arcname=".")
+    return buffer.getvalue()
+
+
+def unpack_directory(data: bytes, directory: str) -> None:
+    """
+    Extracts a tar from pack_directory into the directory
+    """
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(directory, filter="data")
+        else:
+            # Checking by hand that nothing ends up outside the directory
+            root = os.path.realpath(directory)
+            for member in tar.getmembers():
+                path = os.path.realpath(os.path.join(root, member.name))
+                if os.path.commonpath([root, path]) != root:
+                    raise ValueError(f"Unsafe path in submission: {path}")
+            tar.extractall(directory)
+
+
+class JobQueue:
+    """
+    The submissions that still need to be graded. Each one is leased to a
+    worker until it's finished, and put back if the worker is lost or its
+    lease runs out.
+
+    submissions - dict of each submission's name to its directory
+    lease_seconds - how long a worker has to finish a submission
+    rows - the summary row of each finished submission, in order
+    """
+
+    submissions: dict[str, str]
+    lease_seconds: float
+    rows: list[dict]
+
+    def __init__(self, submissions: dict[str, str], lease_seconds: float):
+        self.submissions = submissions
+        self.lease_seconds = lease_seconds
+        self.rows = []
+        self._pending = collections.deque(submissions)
+        # Each leased submission's deadline and who it's leased to
+        self._leases = {}
+        self._finished = set()
+        self._condition = threading.Condition()
+
+    def _expire_leases(self) -> None:
+        now = time.monotonic()
+        for name, (deadline, _) in list(self._leases.items()):
+            if now >= deadline:
+                print(f"{name} took too long, giving it to another worker")
+                del self._leases[name]
+                self._pending.appendleft(name)
+
+    def take(self, worker) -> tuple[str, str]:
+        """
+        Returns ("job", name) with the next submission for the worker to
+        grade, ("wait", None) if every remaining submission is being graded,
+        or ("done", None) when everything is finished
+        """
+        with self._condition:
+            self._expire_leases()
+            if self._pending:
+                name = self._pending.popleft()
+                deadline = time.monotonic() + self.lease_seconds
+                self._leases[name] = (deadline, worker)
+                return "job", name
+            if self._leases:
+                return "wait", None
+            return "done", None
+
+    def release(self, name: str, worker) -> None:
+        """
+        Puts a submission leased to the worker back at the front of the
+        queue, e.g. when the worker disconnected
+        """
+        with self._condition:
+            lease = self._leases.get(name)
+            if lease is not None and lease[1] is worker:
+                del self._leases[name]
+                print(f"Lost the worker grading {name}, requeueing it")
+                self._pending.appendleft(name)
+
+    def finish(self, name: str, save) -> bool:
+        """
+        Marks the submission as finished and adds save()'s summary row.
+        Returns False if it was already finished (e.g. by a worker whose
+        lease ran out), in which case save isn't called.
+        """
+        with self._condition:
+            if name in self._finished or name not in self.submissions:
+                return False
+            self._finished.add(name)
+            self._leases.pop(name, None)
+            if name in self._pending:
+                self._pending.remove(name)
+            self.rows.append(save())
+            batch_grade.print_progress(self.rows, len(self.submissions))
+            self._condition.notify_all()
+            return True
+
+    def wait(self) -> None:
+        """
+        Waits until every submission is finished
+        """
+        with self._condition:
+            while len(self._finished) < len(self.submissions):
+                self._condition.wait(WAIT_SECONDS)
+                self._expire_leases()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Talks to one worker connection (a worker opens one per job)
+    """
+
+    def handle(self):
+        server = self.server
+        leased = None
+        try:
+            header, _ = receive_message(self.rfile)
+            # Compared in constant time, so the token can't be guessed from
+            # how long the comparison takes
+            token = str(header.get("token", "")).encode("utf-8")
+            if header.get("type") != "hello" or not hmac.compare_digest(
+                token, server.token.encode("utf-8")
+            ):
+                send_message(self.wfile, {"type": "error", "error": "token"})
+                return
+            send_message(
+                self.wfile,
+                {
+                    "type": "welcome",
+                    "autograder": server.digest,
+                    "timeout": server.timeout,
+                },
+            )
+
+            while True:
+                header, payload = receive_message(self.rfile)
+                if header["type"] == "request":
+                    status, name = server.queue.take(self)
+                    if status == "job":
+                        leased = name
+                        send_message(
+                            self.wfile,
+                            {"type": "job", "name": name},
+                            pack_directory(server.queue.submissions[name]),
+                        )
+                    elif status == "wait":
+                        send_message(
+                            self.wfile,
+                            {"type": "wait", "seconds": WAIT_SECONDS},
+                        )
+                    else:
+                        send_message(self.wfile, {"type": "done"})
+                        return
+                elif header["type"] == "result":
+                    split = header["results_size"]
+                    results = payload[:split] if split >= 0 else None
+                    row = dict(header["row"], submission=header["name"])
+                    server.queue.finish(
+                        header["name"],
+                        lambda: batch_grade.save_submission(
+                            server.output_dir,
+                            row,
+                            payload[max(split, 0) :],
+                            results,
+                        ),
+                    )
+                    leased = None
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            if leased is not None:
+                server.queue.release(leased, self)
+
+
+def _make_server(address: str, handler):
+    family, location = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(location):
+            os.remove(location)
+        server_class = socketserver.ThreadingUnixStreamServer
+    else:
+        server_class = socketserver.ThreadingTCPServer
+        server_class.allow_reuse_address = True
+    server = server_class(location, handler)
+    server.daemon_threads = True
+    if family == socket.AF_UNIX:
+        # Only root (which the workers run as) can connect
+        os.chmod(location, 0o600)
+    return server
+
+
+def coordinate(
+    export_dir: str,
+    output_dir: str,
+    address: str = DEFAULT_ADDRESS,
+    timeout: float = None,
+    token: str = "",
+) -> list[dict]:
+    """
+    Serves every submission in the export directory to workers until all of
+    them are graded, writes the results like batch_grade, and returns the
+    summary rows. Raises a ValueError if the address is TCP and there's no
+    token.
+    """
+    check_token(address, token)
+    submissions = {
+        os.path.basename(path): path
+        for path in batch_grade.find_submissions(export_dir)
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    lease = DEFAULT_LEASE if timeout is None else timeout + LEASE_MARGIN
+
+    server = _make_server(address, _Handler)
+    server.queue = JobQueue(submissions, lease)
+    server.output_dir = output_dir
+    server.timeout = timeout
+    server.token = token
+    server.digest = autograder_digest()
+
+    print(f"Serving {len(submissions)} submissions on {address}", flush=True)
+    start = time.perf_counter()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        server.queue.wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+    elapsed = time.perf_counter() - start
+
+    rows = server.queue.rows
+    batch_grade.write_summary(output_dir, rows, elapsed, "remote workers")
+    return rows
+
+
+def _connect(address: str) -> socket.socket:
+    family, location = parse_address(address)
+    if family == socket.AF_INET:
+        return socket.create_connection(location)
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(location)
+    return connection
+
+
+def _work(address: str, work_dir: str, history: str, token: str) -> int:
+    """
+    Grades submissions from the coordinator until there are none left, and
+    returns how many it graded
+    """
+    graded = 0
+    with _connect(address) as connection:
+        stream = connection.makefile("rwb")
+        send_message(stream, {"type": "hello", "token": token})
+        welcome, _ = receive_message(stream)
+        if welcome.get("type") != "welcome":
+            print("The coordinator refused the connection (wrong --token)")
+            return graded
+        if welcome["autograder"] != autograder_digest():
+            print(
+                "This worker's autograder is different from the "
+                "coordinator's, so it won't grade anything"
+            )
+            return graded
+
+        while True:
+            send_message(stream, {"type": "request"})
+            header, payload = receive_message(stream)
+            if header["type"] == "done":
+                return graded
+            if header["type"] == "wait":
+                time.sleep(header["seconds"])
+                continue
+
+            name = header["name"]
+            submission_dir = tempfile.mkdtemp(prefix="job-", dir=work_dir)
+            try:
+                unpack_directory(payload, submission_dir)
+                row, log, results = batch_grade.run_submission(
+                    submission_dir, work_dir, welcome["timeout"], history, name
+                )
+            finally:
+                shutil.rmtree(submission_dir, ignore_errors=True)
+            send_message(
+                stream,
+                {
+                    "type": "result",
+                    "name": name,
+                    "row": row,
+                    "results_size": -1 if results is None else len(results),
+                },
+                (results or b"") + log,
+            )
+            graded += 1
+
+
+def work(
+    address: str,
+    jobs: int = None,
+    token: str = "",
+    keep_workspaces: bool = False,
+) -> int:
+    """
+    Grades submissions from the coordinator at the address, jobs at a time,
+    until there are none left. Returns how many were graded.
+    """
+    work_dir = tempfile.mkdtemp(prefix="batch-grade-")
+    os.chmod(work_dir, 0o711)
+    # This machine's test history, shared by its jobs
+    history = os.path.join(work_dir, batch_grade.TEST_HISTORY)
+    batch_grade.seed_history(history)
+
+    jobs = jobs or len(os.sched_getaffinity(0))
+    counts = [0] * jobs
+
+    def run(index: int) -> None:
+        try:
+            counts[index] = _work(address, work_dir, history, token)
+        except (OSError, ValueError) as e:
+            print(f"Lost the coordinator: {e}")
+
+    try:
+        threads = [
+            threading.Thread(target=run, args=(index,))
+            for index in range(jobs)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if keep_workspaces:
+            print("Workspaces kept in " + work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"Graded {sum(counts)} submissions")
+    return sum(counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Grade a Gradescope export with several machines"
+    )
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("BATCH_GRADE_TOKEN", ""),
+        help="Shared secret the workers must give the coordinator",
+    )
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    coordinator = modes.add_parser(
+        "coordinator", help="Hand out the submissions and save the results"
+    )
+    coordinator.add_argument(
+        "export_dir", help="Directory with one folder per submission"
+    )
+    coordinator.add_argument(
+        "output_dir", help="Where the results and summary.csv are written"
+    )
+    coordinator.add_argument(
+        "--listen",
+        default=DEFAULT_ADDRESS,
+        help="host:port or unix:path to listen on "
+        f"(default {DEFAULT_ADDRESS})",
+    )
+    coordinator.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds before grading a single submission is stopped",
+    )
+
+    worker = modes.add_parser("worker", help="Grade submissions")
+    worker.add_argument(
+        "address", help="The coordinator's host:port or unix:path"
+    )
+    worker.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="How many submissions to grade at once (default: one per core)",
+    )
+    worker.add_argument(
+        "--keep-workspaces",
+        action="store_true",
+        help="Keep each submission's workspace for debugging",
+    )
+    args = parser.parse_args()
+
+    if os.geteuid() != 0:
+        sys.exit(
+            "distributed_grade.py must be run as root, like the autograder"
+        )
+
+    if args.mode == "coordinator":
+        try:
+            check_token(args.listen, args.token)
+        except ValueError as error:
+            sys.exit(str(error))
+        coordinate(
+            args.export_dir,
+            args.output_dir,
+            args.listen,
+            args.timeout,
+            args.token,
+        )
+    else:
+        work(args.address, args.jobs, args.token, args.keep_workspaces)
@@ -0,0 +1,23 @@
+"""
+Sets up the imports for the framework's tests. Import this before utils.
+
+The tests run the utils against a temporary source directory, so ta_print
+and the caches don't touch this checkout's tests directory.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = tempfile.mkdtemp(prefix="framework-tests-")
+os.makedirs(os.path.join(SOURCE_DIR, "tests"))
+atexit.register(shutil.rmtree, SOURCE_DIR, ignore_errors=True)
+
+os.environ.setdefault("AUTOGRADER_SOURCE_DIR", SOURCE_DIR)
+os.environ.setdefault(
+    "AUTOGRADER_SUBMISSION_DIR", os.path.join(SOURCE_DIR, "submission")
+)
+sys.path.insert(0, os.path.join(REPO_DIR, "tests"))
@@ -0,0 +1,33 @@
+"""
+Tests for running programs and reading their output in utils.common
+"""
+
+import unittest
+import support  # noqa: F401
+import utils.common as common
+
+
+class TestSubprocessRun(unittest.TestCase):
+    def test_output(self):
+        stdout, stderr = common.subprocess_run(["echo", "hello"], "root")
+        self.assertEqual(stdout, "hello\n")
+        self.assertEqual(stderr, "")
+
+    def test_invalid_utf8(self):
+        with self.assertRaisesRegex(AssertionError, "decode your output"):
+            common.subprocess_run(["printf", r"\xff\xfe"], "root")
+        with open(common.TA_PRINT_FILE, "r") as f:
+            self.assertIn(r"stdout: b'\xff\xfe'", f.read())
+
+    def test_output_limit(self):
+        limit = common.MAX_OUTPUT_BYTES
+        common.MAX_OUTPUT_BYTES = 1024 * 1024
+        try:
+            with self.assertRaisesRegex(AssertionError, "infinite loop"):
+                common.subprocess_run(["yes"], "root", timeout=5)
+        finally:
+            common.MAX_OUTPUT_BYTES = limit
+
+
+if __name__ == "__main__":
+    unittest.main()
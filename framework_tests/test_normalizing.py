@@ -0,0 +1,64 @@
+"""
+Tests for cleaning up output with utils.normalizing
+"""
+
+import tempfile
+import unittest
+import support  # noqa: F401
+import utils.normalizing as normalizing
+import utils.stdout_checking as stdout_checking
+from utils.large_output import LargeOutput
+
+# Over large_output.MEMORY_THRESHOLD, so it's memory mapped
+TEXT = (
+    "\n".join(
+        f"Enter: \x1b[31mValue  {i}\x1b[0m   IS  {i * 2}" for i in range(60000)
+    )
+    + "\nEnter: \n  Done\n"
+)
+
+PIPELINE = normalizing.Pipeline(
+    normalizing.strip_ansi,
+    normalizing.drop_prompts("Enter: "),
+    normalizing.collapse_whitespace,
+    normalizing.casefold,
+)
+
+
+class TestLargeOutput(unittest.TestCase):
+    def setUp(self):
+        file = tempfile.TemporaryFile()
+        file.write(TEXT.encode("utf-8"))
+        self.output = LargeOutput.from_file(file)
+        self.addCleanup(self.output.close)
+
+    def test_same_as_string(self):
+        normalized = PIPELINE(self.output)
+        self.addCleanup(normalized.close)
+        self.assertIsInstance(normalized, LargeOutput)
+        self.assertEqual(str(normalized), str(PIPELINE(TEXT)))
+
+    def test_original_lines(self):
+        normalized = PIPELINE(self.output)
+        self.addCleanup(normalized.close)
+        loc = normalized.find("value 50000 is 100000")
+        self.assertEqual(normalized.line_number(loc), 50001)
+        self.assertEqual(
+            normalized.original_text(loc, loc + 5),
+            "Enter: \x1b[31mValue  50000\x1b[0m   IS  100000",
+        )
+
+    def test_check_phrases(self):
+        phrases = ["VALUE 5 is 10", "value 59999 is 119998", "Dnoe"]
+        self.assertEqual(
+            stdout_checking.check_phrases(
+                phrases, self.output, 2, PIPELINE, max_edits=2
+            ),
+            stdout_checking.check_phrases(
+                phrases, TEXT, 2, PIPELINE, max_edits=2
+            ),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
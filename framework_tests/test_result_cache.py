@@ -0,0 +1,122 @@
+"""
+Tests for the keys of utils.result_cache
+"""
+
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import textwrap
+import unittest
+import support
+import utils.common as common
+import utils.result_cache as result_cache
+
+sys.path.insert(0, support.REPO_DIR)
+import run_tests  # noqa: E402
+
+TEST_FILE = os.path.join(support.SOURCE_DIR, "tests", "test_cached.py")
+
+SOURCE = """
+import unittest
+
+
+class Base(unittest.TestCase):
+    limit = {limit}
+
+
+class Test01Setup(unittest.TestCase):
+    def test_setup(self):
+        pass
+
+
+class Test02Sub(Base):
+    def test_sub(self):
+        pass
+
+
+class Test03Other(unittest.TestCase):
+    def test_other(self):
+        self.assertEqual({other}, {other})
+"""
+
+
+def _keys(limit: int = 1, other: int = 1) -> dict[str, str]:
+    """
+    Writes the test file and returns the keys of its test classes
+    """
+    with open(TEST_FILE, "w") as f:
+        f.write(textwrap.dedent(SOURCE.format(limit=limit, other=other)))
+    spec = importlib.util.spec_from_file_location("test_cached", TEST_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["test_cached"] = module
+    spec.loader.exec_module(module)
+    tests = [
+        module.Test01Setup("test_setup"),
+        module.Test02Sub("test_sub"),
+        module.Test03Other("test_other"),
+    ]
+    return result_cache.ResultCache.for_tests(tests, "Test01Setup").keys
+
+
+class TestKeys(unittest.TestCase):
+    def test_same_source(self):
+        self.assertEqual(_keys(), _keys())
+
+    def test_base_class_changed(self):
+        before, after = _keys(limit=1), _keys(limit=2)
+        self.assertNotEqual(
+            before["test_cached.Test02Sub"], after["test_cached.Test02Sub"]
+        )
+        self.assertEqual(
+            before["test_cached.Test03Other"], after["test_cached.Test03Other"]
+        )
+
+    def test_unrelated_class_changed(self):
+        before, after = _keys(other=1), _keys(other=2)
+        self.assertEqual(
+            before["test_cached.Test02Sub"], after["test_cached.Test02Sub"]
+        )
+        self.assertNotEqual(
+            before["test_cached.Test03Other"], after["test_cached.Test03Other"]
+        )
+
+
+class QuickClass(unittest.TestCase):
+    def test_make(self):
+        common.subprocess_run(["true"], "root", timeout=5)
+
+
+class SlowClass(unittest.TestCase):
+    def test_make(self):
+        # e.g. make taking too long because the machine is busy
+        common.subprocess_run(["sleep", "5"], "root", timeout=0.2)
+
+
+class TestTimeouts(unittest.TestCase):
+    def test_timed_out_class_not_saved(self):
+        results = []
+        result = run_tests.TimedJSONTestResult(
+            io.StringIO(), True, 1, results, [], ""
+        )
+        for test_class in (QuickClass, SlowClass):
+            test_class("test_make").run(result)
+        self.assertEqual(
+            [r["extra_data"]["timed_out"] for r in results], [False, True]
+        )
+
+        directory = tempfile.mkdtemp(dir=support.SOURCE_DIR)
+        cache = result_cache.ResultCache(
+            directory,
+            {
+                "test_result_cache.QuickClass": "quick",
+                "test_result_cache.SlowClass": "slow",
+            },
+        )
+        cache.save_results(list(zip(result.test_ids, results)))
+        self.assertEqual(os.listdir(directory), ["quick.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Tests for appending to and loading utils.result_store
+"""
+
+import os
+import tempfile
+import unittest
+import support  # noqa: F401
+import utils.result_store as result_store
+
+
+def _results(*scores):
+    return {
+        "tests": [
+            {"number": str(number), "score": score, "max_score": 1}
+            for number, score in enumerate(scores, 1)
+        ]
+    }
+
+
+class TestAppend(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.store = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_load(self):
+        result_store.append_results(self.store, "a", _results(1, 0))
+        result_store.append_results(self.store, "b", _results(0.5))
+        table = result_store.load(self.store, latest=False)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table["score"]), [1, 0, 0.5])
+        self.assertEqual(table.submissions, ["a", "b"])
+
+    def test_cut_short_append(self):
+        result_store.append_results(self.store, "a", _results(1, 0))
+        # An append that only wrote some of its columns
+        for name in ["submission", "test", "score"]:
+            path = os.path.join(self.store, name + ".bin")
+            with open(path, "ab") as f:
+                f.write(bytes(result_store.COLUMNS[name](0).nbytes))
+        self.assertEqual(len(result_store.load(self.store, latest=False)), 2)
+
+        result_store.append_results(self.store, "b", _results(0.5, 0.25))
+        table = result_store.load(self.store, latest=False)
+        self.assertEqual(list(table["score"]), [1, 0, 0.5, 0.25])
+        self.assertEqual(list(table["max_score"]), [1, 1, 1, 1])
+        self.assertEqual(list(table["submission"]), [0, 0, 1, 1])
+        self.assertEqual(list(table["test"]), [0, 1, 0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+Tests for giving test classes their own working directory with
+utils.snapshot. Needs root, like the autograder.
+"""
+
+import os
+import tempfile
+import unittest
+import support
+import utils.common as common
+import utils.snapshot as snapshot
+
+
+@unittest.skipUnless(os.geteuid() == 0, "needs root")
+class TestLinkViews(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(dir=support.SOURCE_DIR)
+        with open(os.path.join(self.work_dir, "input.txt"), "w") as f:
+            f.write("original")
+        self.addCleanup(os.chdir, os.getcwd())
+        self.addCleanup(setattr, common, "WORK_DIR", common.WORK_DIR)
+        common.WORK_DIR = self.work_dir
+
+        self.snapshot = snapshot.capture(exclude=())
+        self.addCleanup(self.snapshot.delete)
+        self.addCleanup(setattr, snapshot, "_snapshot", None)
+        # Views made the way they are when overlayfs can't be mounted
+        self.snapshot.method = "link"
+
+    def test_writing_a_file_in_place(self):
+        self.snapshot.restore()
+        with open("input.txt", "w") as f:
+            f.write("changed by class A")
+        self.snapshot.restore()
+        with open("input.txt", "r") as f:
+            self.assertEqual(f.read(), "original")
+
+    def test_new_files_are_gone(self):
+        self.snapshot.restore()
+        with open("output.txt", "w") as f:
+            f.write("left behind")
+        view = self.snapshot.restore()
+        self.assertEqual(view, os.getcwd())
+        self.assertEqual(os.listdir(view), ["input.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
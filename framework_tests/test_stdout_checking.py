@@ -0,0 +1,77 @@
+"""
+Tests for finding phrases with typos in utils.stdout_checking
+"""
+
+import tempfile
+import unittest
+import support  # noqa: F401
+import utils.stdout_checking as stdout_checking
+from utils.large_output import LargeOutput
+
+TEXT = "Welcome!\nResult: the answer is 42\nGoodbye\n"
+
+
+class TestFindApproximate(unittest.TestCase):
+    def find(self, phrase, max_edits=2, start=0):
+        return stdout_checking.find_approximate(phrase, TEXT, max_edits, start)
+
+    def test_exact(self):
+        self.assertEqual(self.find("the answer is 42"), (17, 16, 0))
+
+    def test_inserted(self):
+        self.assertEqual(self.find("the answeer is 42"), (17, 16, 1))
+
+    def test_deleted(self):
+        self.assertEqual(self.find("the answr is 42"), (17, 16, 1))
+
+    def test_substituted(self):
+        self.assertEqual(self.find("the answer iz 42"), (17, 16, 1))
+
+    def test_too_many_edits(self):
+        self.assertIsNone(self.find("teh answr iz 42"))
+
+    def test_start(self):
+        self.assertEqual(self.find("Goodbye", start=17), (34, 7, 0))
+        self.assertIsNone(self.find("Result", start=17))
+
+    def test_edits_cap(self):
+        # 8 characters allow 1 edit, no matter what max_edits is
+        self.assertEqual(self.find("Resalt: ", max_edits=5), (9, 8, 1))
+        self.assertIsNone(self.find("Rasalt: ", max_edits=5))
+        # and 5 characters have to be exact
+        self.assertEqual(self.find("Resul", max_edits=5), (9, 5, 0))
+        self.assertIsNone(self.find("Rexul", max_edits=5))
+
+
+class TestLargeOutput(unittest.TestCase):
+    def setUp(self):
+        # Over large_output.MEMORY_THRESHOLD, with multibyte characters
+        # before the phrase
+        self.text = "é" * 10 + "\n" + "x" * 300000 + " Café total: 42\n"
+        file = tempfile.TemporaryFile()
+        file.write(self.text.encode("utf-8"))
+        self.output = LargeOutput.from_file(file)
+        self.addCleanup(self.output.close)
+
+    def test_offsets(self):
+        # LargeOutput offsets are in bytes
+        loc, length, edits = stdout_checking.find_approximate(
+            "Cafe total: 42", self.output, 2
+        )
+        self.assertEqual(edits, 1)
+        self.assertEqual(self.output[loc : loc + length], "Café total: 42")
+        self.assertEqual(
+            stdout_checking.find_approximate("Cafe total: 42", self.text, 2),
+            (self.text.index("Café"), 14, 1),
+        )
+
+    def test_exact(self):
+        loc = self.output.find("Café")
+        self.assertEqual(
+            stdout_checking.find_approximate("Café total: 42", self.output, 2),
+            (loc, 15, 0),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,14 +6,236 @@ to score the student.
 It will also read the ta_print.txt file and print it out to the console
 such that only TAs and instructors will be able to see the output on
 Gradescope
+
+Each test's duration and whether it failed are saved to a history file. When
+there is history, the test classes after Test01Setup are run cheapest first,
+so a slow test running out of time can't take the quick tests' results with
+it. results.json still lists the tests in their usual order.
+
+When results are cached (see utils/result_cache.py), test classes whose
+code, dependencies, and submission haven't changed since they last ran
+aren't run again, and their previous results are used.
 """
 
+import fcntl
+import json
+import math
+import os
+import sys
+import time
 import unittest
-from gradescope_utils.autograder_utils.json_test_runner import JSONTestRunner
+from gradescope_utils.autograder_utils.json_test_runner import (
+    JSONTestResult,
+    JSONTestRunner,
+)
 
 
 SETUP_CLASS_NAME = "Test01Setup"
 
+# batch_grade.py changes these to grade many submissions at once
+SOURCE_DIR = os.environ.get("AUTOGRADER_SOURCE_DIR", "/autograder/source")
+RESULTS_DIR = os.environ.get("AUTOGRADER_RESULTS_DIR", "/autograder/results")
+# Where each test's duration and failure rate are kept between runs. Commit
+# tests/test_history.json to ship it in the image, and batch_grade.py keeps
+# one for the whole batch
+HISTORY_PATH = os.environ.get(
+    "AUTOGRADER_TEST_HISTORY",
+    os.path.join(SOURCE_DIR, "tests", "test_history.json"),
+)
+# Only this many recent runs of a test count towards its history
+HISTORY_RUNS = 50
+# Classes whose expected durations are within this factor of each other are
+# considered the same cost, and the one more likely to fail runs first
+SIMILAR_COST = 2
+
+
+class TimedJSONTestResult(JSONTestResult):
+    """
+    Adds each test's duration, whether any program it ran timed out, and
+    the size of its output to the test's extra_data in results.json, for
+    utils.result_store
+
+    After each test, any of the student's processes that are still running
+    are killed and listed in ta_print.txt, so they can't slow down the
+    tests after it
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The id of the test each entry in results was made for
+        self.test_ids = []
+
+    def startTest(self, test):
+        self._start = time.perf_counter()
+        self._timed_out_runs = self._count_timed_out_runs()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        self._sweep_processes(test)
+
+    def _count_timed_out_runs(self) -> int:
+        # utils is only loaded if the tests used it
+        process_monitoring = sys.modules.get("utils.process_monitoring")
+        return process_monitoring.timed_out_runs if process_monitoring else 0
+
+    def _sweep_processes(self, test):
+        process_monitoring = sys.modules.get("utils.process_monitoring")
+        if process_monitoring is None:
+            return
+        # batch_grade.py grades other submissions as the student at the same
+        # time, so only this workspace's processes are killed
+        environment = None
+        if "AUTOGRADER_SOURCE_DIR" in os.environ:
+            environment = (
+                "AUTOGRADER_SOURCE_DIR=" + os.environ["AUTOGRADER_SOURCE_DIR"]
+            )
+        killed = process_monitoring.sweep_user_processes(
+            environment=environment
+        )
+        if killed:
+            sys.modules["utils.common"].ta_print(
+                f"Killed {len(killed)} process(es) still running after "
+                f"{test.id()}: " + ", ".join(killed)
+            )
+
+    def processResult(self, test, err=None):
+        super().processResult(test, err)
+        if not self.getLeaderboardData(test)[0]:
+            self.test_ids.append(test.id())
+
+    def buildResult(self, test, err=None):
+        result = super().buildResult(test, err)
+        result["extra_data"] = {
+            "duration": round(time.perf_counter() - self._start, 4),
+            "timed_out": self._count_timed_out_runs() > self._timed_out_runs,
+            "output_size": len(result.get("output", "")),
+        }
+        return result
+
+
+class TimedJSONTestRunner(JSONTestRunner):
+    """
+    Saves each test's duration and status to the history, and lists the
+    tests in results.json in display_order (a dict of test ids to their
+    positions) no matter what order they ran in
+    """
+
+    resultclass = TimedJSONTestResult
+
+    def __init__(
+        self,
+        display_order=None,
+        history_path=None,
+        cache=None,
+        cached_results=(),
+        **kwargs,
+    ):
+        super().__init__(post_processor=self._post_process, **kwargs)
+        self.display_order = display_order or {}
+        self.history_path = history_path
+        # The utils.result_cache.ResultCache this run's results are saved
+        # to, and the (test id, result) of the tests that weren't run
+        # because their results were cached
+        self.cache = cache
+        self.cached_results = list(cached_results)
+
+    def _makeResult(self):
+        self._result = super()._makeResult()
+        return self._result
+
+    def _post_process(self, json_data):
+        tests = list(zip(self._result.test_ids, json_data["tests"]))
+        if self.history_path is not None:
+            update_history(self.history_path, tests)
+        if self.cache is not None:
+            self.cache.save_results(tests)
+        tests += self.cached_results
+        last = len(self.display_order)
+        tests.sort(key=lambda test: self.display_order.get(test[0], last))
+        json_data["tests"] = [result for _, result in tests]
+        json_data["score"] = sum(
+            result.get("score", 0.0) for result in json_data["tests"]
+        )
+
+
+def _lock(history_file):
+    # batch_grade.py grades several submissions at once with one history
+    fcntl.flock(history_file, fcntl.LOCK_EX)
+    history_file.seek(0)
+    try:
+        return json.load(history_file)
+    except json.JSONDecodeError:
+        return {}
+
+
+def load_history(path: str) -> dict:
+    """
+    Returns a dict of each test's id to its "runs", mean "duration", and
+    "failures" (fraction of its runs that failed)
+    """
+    try:
+        with open(path, "r") as f:
+            return _lock(f)
+    except FileNotFoundError:
+        return {}
+
+
+def update_history(path: str, tests: list) -> None:
+    """
+    Adds the (test id, result) pairs from this run to the history
+    """
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(descriptor, "r+") as f:
+        history = _lock(f)
+        for test_id, result in tests:
+            duration = result.get("extra_data", {}).get("duration")
+            if duration is None:
+                continue
+            entry = history.setdefault(
+                test_id, {"runs": 0, "duration": 0.0, "failures": 0.0}
+            )
+            # Running means over the last HISTORY_RUNS runs (about), so the
+            # history follows changes to the tests
+            runs = min(entry["runs"] + 1, HISTORY_RUNS)
+            failed = result.get("status") == "failed"
+            entry["runs"] = runs
+            entry["duration"] += (duration - entry["duration"]) / runs
+            entry["failures"] += (failed - entry["failures"]) / runs
+        f.seek(0)
+        f.truncate()
+        json.dump(history, f, indent=2, sort_keys=True)
+
+
+def _order_by_history(tests: list, history: dict) -> list:
+    """
+    Orders the tests so the cheapest classes run first, and of classes that
+    cost about the same, the ones more likely to fail. The tests in a class
+    stay together and in order, so setUpClass still runs once per class.
+    Without any history, the order is unchanged.
+    """
+    known = [history[test.id()] for test in tests if test.id() in history]
+    if not known:
+        return tests
+    # Tests that haven't run before are assumed to take the median time
+    durations = sorted(entry["duration"] for entry in known)
+    typical = {"duration": durations[len(durations) // 2], "failures": 0}
+
+    classes = {}
+    for test in tests:
+        classes.setdefault(test.__class__, []).append(test)
+
+    def expected_cost(item):
+        position, class_tests = item
+        entries = [history.get(test.id(), typical) for test in class_tests]
+        duration = sum(entry["duration"] for entry in entries)
+        failures = max(entry["failures"] for entry in entries)
+        cost = math.floor(math.log(max(duration, 0.01), SIMILAR_COST))
+        return cost, -failures, position
+
+    ordered = sorted(enumerate(classes.values()), key=expected_cost)
+    return [test for _, class_tests in ordered for test in class_tests]
+
 
 def _iter_test_cases(suite):
     """Yield concrete test cases from a potentially nested suite."""
@@ -24,10 +246,11 @@ def _iter_test_cases(suite):
             yield test
 
 
-def _prioritize_setup_suite(discovered_suite):
+def _prioritize_setup_suite(discovered_suite, history=None):
     """
     Move tests from Test01Setup to the front while preserving
-    relative order for all tests.
+    relative order for all tests. If there's history, the rest of the tests
+    are ordered by it.
     """
     setup_tests = []
     other_tests = []
@@ -38,6 +261,9 @@ def _prioritize_setup_suite(discovered_suite):
         else:
             other_tests.append(test)
 
+    if history:
+        other_tests = _order_by_history(other_tests, history)
+
     ordered_suite = unittest.TestSuite()
     ordered_suite.addTests(setup_tests)
     ordered_suite.addTests(other_tests)
@@ -47,15 +273,52 @@ def _prioritize_setup_suite(discovered_suite):
 # This will run any testing scripts it can find and then writes all the results
 # to the results.json
 if __name__ == "__main__":
+    # Emptying ta_print.txt before the tests are loaded, since test classes
+    # can already use ta_print while they're being defined
+    sys.path.insert(0, os.path.abspath("tests"))
+    from utils.common import start_session
+    import utils.result_cache as result_cache
+
+    start_session()
+
     discovered_suite = unittest.defaultTestLoader.discover("tests")
-    suite = _prioritize_setup_suite(discovered_suite)
-    with open("/autograder/results/results.json", "w", encoding="utf-8") as f:
-        JSONTestRunner(visibility="visible", stream=f).run(suite)
+    # results.json lists the tests in the usual order, even if they ran in
+    # a different one
+    display_order = {
+        test.id(): position
+        for position, test in enumerate(
+            _prioritize_setup_suite(discovered_suite)
+        )
+    }
+    suite = _prioritize_setup_suite(
+        discovered_suite, load_history(HISTORY_PATH)
+    )
+
+    # Test classes whose code, dependencies, and submission haven't changed
+    # since they last ran reuse their results
+    cache, cached_results = None, []
+    if result_cache.enabled():
+        tests = list(suite)
+        cache = result_cache.ResultCache.for_tests(tests, SETUP_CLASS_NAME)
+        tests, cached_results = result_cache.split_cached(
+            tests, cache, SETUP_CLASS_NAME
+        )
+        suite = unittest.TestSuite(tests)
+
+    results_path = os.path.join(RESULTS_DIR, "results.json")
+    with open(results_path, "w", encoding="utf-8") as f:
+        TimedJSONTestRunner(
+            display_order,
+            HISTORY_PATH,
+            cache,
+            cached_results,
+            visibility="visible",
+            stream=f,
+        ).run(suite)
 
     # Sending all of the ta_print information out
-    with open(
-        "/autograder/source/tests/ta_print.txt", "r", encoding="utf-8"
-    ) as f:
+    ta_print_path = os.path.join(SOURCE_DIR, "tests", "ta_print.txt")
+    with open(ta_print_path, "r", encoding="utf-8") as f:
         if f.read() != "":
             print("TA Print:")
             f.seek(0)
@@ -6,12 +6,22 @@ apt-get install -y python3 python3-pip python3-dev
 # gdb can be used to debug over ssh
 apt-get install -y gdb
 
+# valgrind is needed for utils.profiling.measure_heap and count_instructions
+# apt-get install -y valgrind
+
+# A JDK is needed for utils.java_running (13 or newer for its class archive)
+# apt-get install -y default-jdk-headless
+
 # Installs some English dictionaries 
 # These are needed for the "words" file to exist 
 # apt-get install -y wamerican wbritish
 
 pip3 install -r /autograder/source/requirements.txt
 
+# Modules preloaded by utils.python_server must be installed for the system's
+# python3, which is what the student runs
+# pip3 install numpy pandas
+
 # Locking down parts of the Autograder to the student user
 
 # Creating a student user who will have minimal permissions 
@@ -23,6 +33,25 @@ chmod o= /autograder/source/tests/*  # So they can't see the test cases
 # they still won't be able to access them. 
 chmod go=rwx /autograder/source  # So they can create files when compiling
 
+# Precompiling the drivers and common headers so each submission only has to
+# compile the student's code and link. They are stored where only root can
+# read them. Drivers that need the student's files to compile are skipped and
+# compiled as usual during testing. Add flags after the script's name
+# (e.g. -std=c++17) if your compile_and_run calls use them.
+PYTHONPATH=/autograder/source/tests python3 \
+	/autograder/source/tests/utils/runnables/precompile_drivers.py
+
+# Timing the reference solution on the inputs registered in test.py, so tests
+# can use timeouts based on it, and saving its outputs for the tests to
+# compare against (see utils.reference and utils.golden in the utils README).
+# Only done if there's a reference solution in tests/reference.
+if [ -d /autograder/source/tests/reference ]; then
+	PYTHONPATH=/autograder/source/tests python3 \
+		/autograder/source/tests/utils/runnables/calibrate_timeouts.py
+	PYTHONPATH=/autograder/source/tests python3 \
+		/autograder/source/tests/utils/runnables/build_golden.py
+fi
+
 # create temp file to download harness to
 TMP_HARNESS="$(mktemp)"
 curl -f 'https://s3-us-west-2.amazonaws.com/gradescope-static-assets/autograder/python3/harness.py' -o "$TMP_HARNESS" || 
@@ -54,6 +54,11 @@ class Test01Setup(unittest.TestCase):
     # This helps reduce the number of extra files submitted by the student,
     # making it easier for the TAs to grade the correct files later
 
+    # Optional: compile and run everything in a RAM-backed (tmpfs) directory
+    # instead of the source directory on disk. Falls back to the source
+    # directory when no tmpfs is available. See the utils README.
+    # utils.workspace.enter()
+
     # Grabbing all the drivers and io_files and moving them into the source
     # directory where the student's code can interact with them
     utils.setup.move_drivers_to_source()
@@ -124,6 +129,13 @@ class Test01Setup(unittest.TestCase):
         if not_found_message != "":
             raise AssertionError(not_found_message)
 
+    @classmethod
+    def tearDownClass(cls):
+        # Saving the working directory as it is after setup, so test classes
+        # that extend utils.SnapshotTestCase (like Test04 below) each start
+        # from it. See the utils README
+        utils.snapshot.capture()
+
 
 # TODO: Delete all the example test cases below and replace them with your own
 
@@ -338,12 +350,15 @@ class Test03DirectFunctionExample(unittest.TestCase):
             )
 
 
-class Test04UsingFileExample(unittest.TestCase):
+class Test04UsingFileExample(utils.SnapshotTestCase):
     """
     Example of how to test the student's code when they must read from
     a file and also write to a file
     Must put the input file you want them to use in the io_files folder
 
+    It runs in its own copy of the working directory, so the output.txt the
+    student's code writes isn't there for the other test classes
+
     This example uses the `exampleInputFile.txt` in the io_files folder
     """
 
@@ -393,14 +408,21 @@ class Test04UsingFileExample(unittest.TestCase):
         # the student's code
 
         # Opening the file and checking the contents
+        # LargeOutput searches the file without reading all of it into
+        # memory, so this works for large files too. To compare against a
+        # whole expected file, use utils.check_file (see the utils README)
         expected_output = "7\n5\n15"
         try:
-            with open("output.txt", "r") as f:
-                output = f.read()
-                if expected_output not in output:
-                    raise AssertionError(
-                        "output.txt did not contain the expected "
-                        " values. It contained: " + output
-                    )
+            output = utils.LargeOutput.from_file("output.txt")
         except FileNotFoundError:
             raise AssertionError("output.txt was not created")
+
+        # Closing it releases the file and its memory map
+        try:
+            if expected_output not in output:
+                raise AssertionError(
+                    "output.txt did not contain the expected "
+                    " values. It contained: " + output[:1000]
+                )
+        finally:
+            output.close()
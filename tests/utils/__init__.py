@@ -3,20 +3,66 @@ This utility module contains functions that can be used to help check if the
 proper files are present, run drivers on the student's code, and get the
 results of the drivers
 
-The below import statements are used to expose the functions in this module to
-the rest of the tests
+The functions and modules listed below are exposed to the rest of the tests.
+Everything is loaded the first time it's used instead of when utils is
+imported, so the autograder starts quickly and only pays for what the tests
+use (e.g. libclang is only loaded once remove_main is called).
 """
 
+import importlib
 
-# flake8: noqa F401
-from . import setup
-from .driver_running import (
-    run_program,
-    Submission,
-    compile_and_run,
-    remove_main,
-)
-from .stdout_checking import phrases_out_of_order, check_phrases
+# Modules that can be used as utils.<name>
+_SUBMODULES = {
+    "setup",
+    "workspace",
+    "profiling",
+    "reference",
+    "golden",
+    "python_server",
+    "result_store",
+    "normalizing",
+    "snapshot",
+}
 
+# Functions and classes that can be used as utils.<name>, and the module each
+# one is in
+_EXPORTS = {
+    "run_program": "driver_running",
+    "Submission": "driver_running",
+    "compile_and_run": "driver_running",
+    "compile_program": "driver_running",
+    "compile_many": "driver_running",
+    "make_command": "driver_running",
+    "remove_main": "driver_running",
+    "run_python": "python_server",
+    "compile_java": "java_running",
+    "phrases_out_of_order": "stdout_checking",
+    "check_phrases": "stdout_checking",
+    "parse_numbers": "numeric_checking",
+    "check_numbers": "numeric_checking",
+    "check_file": "file_checking",
+    "subprocess_run": "common",
+    "ta_print": "common",
+    "LargeOutput": "large_output",
+    "SnapshotTestCase": "snapshot",
+}
 
-from .common import subprocess_run, ta_print
+__all__ = sorted(_SUBMODULES | set(_EXPORTS))
+
+
+def __getattr__(name: str):
+    if name in _EXPORTS:
+        module = importlib.import_module("." + _EXPORTS[name], __name__)
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module("." + name, __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    # Saved so the next use doesn't come through here again
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return __all__
@@ -3,24 +3,75 @@ This file contains functions and global constants used across multiple of
 the utility modules
 """
 
+import codecs
 import subprocess
 import os
+import tempfile
+import utils.process_monitoring as process_monitoring
+from utils.large_output import LargeOutput
+
+# These can be changed with environment variables so that batch_grade.py can
+# grade many submissions at once, each in its own directory
+# This is also the cwd for the autograder
+SOURCE_DIR = os.environ.get("AUTOGRADER_SOURCE_DIR", "/autograder/source")
+SUBMISSION_DIR = os.environ.get(
+    "AUTOGRADER_SUBMISSION_DIR", "/autograder/submission"
+)
+TESTS_DIR = SOURCE_DIR + "/tests"
+# Where the student's code is compiled and run. This is the source directory
+# unless utils.workspace moved it somewhere faster, like a tmpfs
+WORK_DIR = SOURCE_DIR
+TA_PRINT_FILE = TESTS_DIR + "/ta_print.txt"
+# Where setup.sh stores the precompiled drivers, only readable by root
+PRECOMPILED_DIR = "/autograder/precompiled"
+# Outputs longer than this are truncated, unless large_output is used
+MAX_CHARS = 30000  # You can change this number
+# Programs are stopped once their stdout or stderr reaches this many bytes.
+# Their output is kept in temporary files, which can be in memory (see
+# utils.workspace), so printing in an infinite loop would otherwise fill it.
+# It's checked every process_monitoring.POLL_INTERVAL, so a fast program can
+# go a little past it
+MAX_OUTPUT_BYTES = 256 * 1024 * 1024  # You can change this number
+
+_session_started = False
+
+
+def start_session() -> None:
+    """
+    Empties ta_print.txt and makes it readable only by root. run_tests.py
+    calls this before loading the tests, otherwise it's called the first time
+    ta_print is used. Only the first call in a process does anything, so
+    messages printed earlier in the same run are kept.
+    """
+    global _session_started
 
-SOURCE_DIR = "/autograder/source"  # This is also the cwd for the autograder
-SUBMISSION_DIR = "/autograder/submission"
+    if _session_started:
+        return
+    _session_started = True
+
+    try:
+        # Creating an empty ta_print.txt file
+        with open(TA_PRINT_FILE, "w") as ta_print_file:
+            ta_print_file.write("")
 
-try:
-    # Creating an empty ta_print.txt file
-    with open("/autograder/source/tests/ta_print.txt", "w") as ta_print_file:
-        ta_print_file.write("")
+        # Removing read access from non-root users to ta_print.txt
+        os.chmod(TA_PRINT_FILE, 0o600)
 
-    # Removing read access from non-root users to ta_print.txt
-    os.chmod("/autograder/source/tests/ta_print.txt", 0o600)
+    except FileNotFoundError:
+        # If the file is not found, then the directory is not mounted
+        # This is fine because the file is only used for debugging
+        pass
 
-except FileNotFoundError:
-    # If the file is not found, then the directory is not mounted
-    # This is fine because the file is only used for debugging
-    pass
+
+def available_cores() -> int:
+    """
+    Returns how many CPU cores this process is allowed to use
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is not available on every platform
+        return os.cpu_count() or 1
 
 
 def ta_print(*args) -> None:
@@ -34,16 +85,84 @@ def ta_print(*args) -> None:
     This output will be shown only to TAs and instructors; not to students
     """
 
+    start_session()
+
     message = ""
     for arg in args:
         message += str(arg) + " "
 
-    with open("/autograder/source/tests/ta_print.txt", "a") as ta_print_file:
+    with open(TA_PRINT_FILE, "a") as ta_print_file:
         ta_print_file.write(message + "\n")
 
 
+def read_output(file, large_output=False):
+    """
+    Reads a program's output from the temporary binary file it was written to.
+    The caller closes the file, so it can still be read if this raises.
+
+    Unless large_output is True, the output is decoded to a string and
+    truncated to MAX_CHARS characters. Only the start of the file is read.
+
+    If large_output is True, the whole output is returned as a LargeOutput,
+    which is kept on disk when it's big and is never truncated.
+
+    Raises a UnicodeDecodeError if the output isn't valid utf-8
+    """
+
+    # If unexpected input is piped to program, stdout can often contain
+    # information in memory that goes past the bounds of the file. To filter
+    # this out, we split the bytes string based on the location of ELF,
+    # and only keep everything that was before ELF. This should result in
+    # only the submission's actual output being displayed.
+    if large_output:
+        return LargeOutput.from_file(file, cut_at=b"\x7fELF")
+
+    # A utf-8 character is at most 4 bytes, so this is always enough to tell
+    # if there are more than MAX_CHARS characters
+    file.seek(0)
+    raw = file.read(4 * (MAX_CHARS + 1))
+    read_everything = file.read(1) == b""
+
+    # If only part of the file was read, the last character may have been cut
+    # in half, which is fine because that part will be truncated anyway
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    output = decoder.decode(raw.split(b"\x7fELF")[0], final=read_everything)
+
+    # If the output is longer than MAX_CHARS, truncate it
+    truncation_message = (
+        f"\n\n** The output exceeded {MAX_CHARS} characters, so it was "
+        + "truncated **"
+    )
+    if len(output) > MAX_CHARS:
+        output = output[:MAX_CHARS] + truncation_message
+
+    return output
+
+
+def check_output_size(*files) -> None:
+    """
+    Raises an AssertionError if a program's output in any of the temporary
+    files reached MAX_OUTPUT_BYTES, which is when it was stopped
+    """
+    if process_monitoring.output_exceeded(files, MAX_OUTPUT_BYTES):
+        ta_print(f"Output reached the limit of {MAX_OUTPUT_BYTES} bytes")
+        raise AssertionError(
+            f"Your program printed more than {MAX_OUTPUT_BYTES} bytes, "
+            "so it was stopped.\n"
+            "Make sure it doesn't print in an infinite loop."
+        )
+
+
+def _peek(file, size=1000) -> bytes:
+    """
+    Returns the first bytes of a temporary output file
+    """
+    file.seek(0)
+    return file.read(size)
+
+
 def subprocess_run(
-    args: list[str], user: str, timeout=None
+    args: list[str], user: str, timeout=None, large_output=False
 ) -> tuple[str, str]:
     """
     Runs the given arguments in a subprocess and returns the output and errors
@@ -62,61 +181,47 @@ def subprocess_run(
             Use "student" if you are running any code or file written
             by the students. Use "root" only when compiling drivers.
     timeout - How long the program can run for in seconds
+    large_output -  If True, the output is returned as a LargeOutput that
+                    holds all of it instead of being truncated
 
     """
-    try:
-        process = subprocess.run(
-            args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            user=user,
-            timeout=timeout,
-        )
-    except subprocess.TimeoutExpired as e:
-        process = e
-        return "", "Timeout expired"
-
-    # If unexpected input is piped to program, stdout can often contain
-    # information in memory that goes past the bounds of the file. To filter
-    # this out, we split the bytes string based on the location of ELF,
-    # and only keep everything that was before ELF. This should result in
-    # only the submission's actual output being displayed. This is not an
-    # issue with stderr.
-    try:
-        stdout = (
-            ""
-            if process.stdout is None
-            else process.stdout.split(b"\x7fELF")[0].decode("utf-8")
-        )
-        if process.stderr is None:
-            stderr = ""
-        else:
-            stderr = process.stderr.decode("utf-8")
-
-    # Sometimes students will output non-utf-8 characters often because of
-    # going out of bounds in c-strings
-    # This will catch that and given a somewhat helpful error message
-    except UnicodeDecodeError:
-        # Giving all the details to the TAs
-        ta_print(
-            "Trouble decoding output\n"
-            f"stdout: {process.stdout}\n"
-            f"stderr: {process.stderr}"
-        )
-        # Giving a more helpful message to the students
-        raise AssertionError(
-            "Could not decode your output to utf-8.\n"
-            "Make sure you don't output any invalid characters."
-        )
-    max_chars = 30000  # You can change this number
-    # If the standard output or error are longer than max_chars, truncate them
-    truncation_message = (
-        f"\n\n** The output exceeded {max_chars} characters, so it was "
-        + "truncated **"
+    # The output is written to temporary files instead of pipes, so it
+    # doesn't have to be held in memory
+    stdout_file = tempfile.TemporaryFile()
+    stderr_file = tempfile.TemporaryFile()
+    # In its own session, so anything it leaves running is killed with it
+    process = subprocess.Popen(
+        args,
+        stdout=stdout_file,
+        stderr=stderr_file,
+        user=user,
+        start_new_session=True,
     )
-    if len(stdout) > max_chars:
-        stdout = stdout[:max_chars] + truncation_message
-    if len(stderr) > max_chars:
-        stderr = stderr[:max_chars] + truncation_message
+    with stdout_file, stderr_file:
+        timed_out = process_monitoring.wait_and_kill_group(
+            process, timeout, (stdout_file, stderr_file), MAX_OUTPUT_BYTES
+        )
+        check_output_size(stdout_file, stderr_file)
+        if timed_out:
+            return "", "Timeout expired"
+
+        # Sometimes students will output non-utf-8 characters often because
+        # of going out of bounds in c-strings
+        # This will catch that and given a somewhat helpful error message
+        try:
+            stderr = read_output(stderr_file)
+            stdout = read_output(stdout_file, large_output)
+        except UnicodeDecodeError:
+            # Giving all the details to the TAs
+            ta_print(
+                "Trouble decoding output\n"
+                f"stdout: {_peek(stdout_file)}\n"
+                f"stderr: {_peek(stderr_file)}"
+            )
+            # Giving a more helpful message to the students
+            raise AssertionError(
+                "Could not decode your output to utf-8.\n"
+                "Make sure you don't output any invalid characters."
+            )
 
     return stdout, stderr
@@ -3,30 +3,214 @@ This file contains functions used to run a student's code
 and return the results
 """
 
+import atexit
+import shutil
 import subprocess
+import sys
+import tempfile
 import time
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 import utils.common as common
-import utils.parsing as parsing
+import utils.precompiling as precompiling
+import utils.process_monitoring as process_monitoring
+
+
+# How often, in seconds, a running program is checked on
+POLL_INTERVAL = process_monitoring.POLL_INTERVAL
+
+# Runs the student's program and reports the program's peak memory and CPU
+# time back through a pipe. The program can't be started directly from the
+# autograder for this: a process's peak memory (ru_maxrss) carries over when
+# it runs another program, so the memory of whatever forked the program would
+# be counted too. The launcher is a small C program, compiled the first time
+# it's needed, so the process it forks only uses a few kilobytes.
+_MEMORY_LAUNCHER_C = r"""
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+int main(int argc, char **argv) {
+    int report = atoi(argv[1]);
+    pid_t pid = fork();
+    if (pid == 0) {
+        close(report);
+        execv(argv[2], argv + 2);
+        _exit(127);
+    }
+    int status;
+    struct rusage usage;
+    if (pid < 0 || wait4(pid, &status, 0, &usage) < 0) {
+        return 127;
+    }
+    dprintf(report, "%ld %f", usage.ru_maxrss,
+            usage.ru_utime.tv_sec + usage.ru_stime.tv_sec
+                + (usage.ru_utime.tv_usec + usage.ru_stime.tv_usec) / 1e6);
+    if (WIFSIGNALED(status)) {
+        return (-WTERMSIG(status)) & 0xFF;
+    }
+    return WEXITSTATUS(status);
+}
+"""
+# Used when there's no C compiler. Everything it runs is measured as using at
+# least the memory of a forked Python (about 5 MB)
+_MEMORY_LAUNCHER = """
+import os, sys
+report = int(sys.argv[1])
+pid = os.fork()
+if pid == 0:
+    os.close(report)
+    try:
+        os.execv(sys.argv[2], sys.argv[2:])
+    except OSError:
+        os._exit(127)
+_, status, usage = os.wait4(pid, 0)
+os.write(report, b"%d %f" % (usage.ru_maxrss, usage.ru_utime + usage.ru_stime))
+os._exit(os.waitstatus_to_exitcode(status) & 0xFF)
+"""
+# The launcher runs as the student, who may not be allowed to run a Python
+# installed for root (e.g. in a virtual environment), so the system's Python
+# is used when there is one
+_LAUNCHER_PYTHON = (
+    "/usr/bin/python3"
+    if os.path.isfile("/usr/bin/python3")
+    else sys.executable
+)
+# Path of the compiled launcher, or "" if it couldn't be compiled
+_memory_launcher_path = None
 
 
 # Class used to represent the result of a student's submission
 class Submission:
     """
-    output - string containing the program's output (stdout)
+    output - string containing the program's output (stdout), or a
+             LargeOutput if run_program was called with large_output=True
     errors - string containing the program's errors (stderr)
     timed_out -  True if the submission timed out during execution,
                 False otherwise
+    cpu_time - seconds of CPU time the program used, or None if unknown
+    peak_memory_kb - the program's peak memory use (maximum resident set
+                     size) in kilobytes, or None if it wasn't measured. It
+                     isn't measured for runs that timed out or were stopped
+                     for being stuck, since the launcher is killed too
+    hang_reason - why the program was stopped early for being stuck (e.g.
+                  "the program was waiting for input that was never given"),
+                  or None. timed_out is also True when it's set
     """
 
     output: str
     errors: str
     timed_out: bool
+    cpu_time: float
+    peak_memory_kb: int
+    hang_reason: str
 
-    def __init__(self, output: str, errors: str, timed_out: bool):
+    def __init__(
+        self,
+        output: str,
+        errors: str,
+        timed_out: bool,
+        cpu_time: float = None,
+        peak_memory_kb: int = None,
+        hang_reason: str = None,
+    ):
         self.output = output
         self.errors = errors
         self.timed_out = timed_out
+        self.cpu_time = cpu_time
+        self.peak_memory_kb = peak_memory_kb
+        self.hang_reason = hang_reason
+
+
+def _memory_launcher() -> list[str]:
+    """
+    Returns the command that starts the memory launcher, compiling the C one
+    the first time
+    """
+    global _memory_launcher_path
+
+    if _memory_launcher_path is None:
+        _memory_launcher_path = ""
+        # Next to the working directory, so the student can run it
+        directory = tempfile.mkdtemp(
+            prefix="memory-launcher-", dir=os.path.dirname(common.WORK_DIR)
+        )
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        os.chmod(directory, 0o755)
+        source = os.path.join(directory, "launcher.c")
+        launcher = os.path.join(directory, "launcher")
+        with open(source, "w") as f:
+            f.write(_MEMORY_LAUNCHER_C)
+        # Linked statically when it can be, so it uses even less memory
+        for flags in (["-static"], []):
+            try:
+                compiled = subprocess.run(
+                    ["cc", "-O2"] + flags + [source, "-o", launcher],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            except OSError:
+                break
+            if compiled.returncode == 0:
+                os.chmod(launcher, 0o755)
+                _memory_launcher_path = launcher
+                break
+        if not _memory_launcher_path:
+            common.ta_print(
+                "The memory launcher couldn't be compiled, so peak memory "
+                "includes a forked Python's (about 5 MB)"
+            )
+
+    if _memory_launcher_path:
+        return [_memory_launcher_path]
+    return [_LAUNCHER_PYTHON, "-I", "-S", "-c", _MEMORY_LAUNCHER]
+
+
+def _wait(
+    process: subprocess.Popen,
+    timeout: float,
+    hang_grace: float,
+    output_file=None,
+) -> tuple[int, object, bool, str]:
+    """
+    Waits for the process to finish, killing it if it runs past the timeout
+    or is stuck for hang_grace seconds. Anything left in its process group
+    is killed either way. Returns its wait status, resource usage, whether
+    it was killed, and why it was stuck (or None).
+
+    output_file - the file its stdout goes to. It's also killed (without
+                  counting as timed out) once that reaches
+                  common.MAX_OUTPUT_BYTES
+    """
+    output_files = () if output_file is None else (output_file,)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    detector = None
+    if hang_grace is not None:
+        detector = process_monitoring.HangDetector(process.pid, hang_grace)
+
+    killed, hang_reason = False, None
+    # The process isn't reaped until its group is killed, so the group's id
+    # can't be given to another process first
+    while not process_monitoring.has_exited(process.pid):
+        if deadline is not None and time.monotonic() >= deadline:
+            killed = True
+            break
+        if detector is not None:
+            hang_reason = detector.check()
+            if hang_reason is not None:
+                killed = True
+                break
+        if process_monitoring.output_exceeded(
+            output_files, common.MAX_OUTPUT_BYTES
+        ):
+            break
+        time.sleep(POLL_INTERVAL)
+
+    process_monitoring.kill_group(process.pid)
+    _, status, usage = os.wait4(process.pid, 0)
+    return status, usage, killed, hang_reason
 
 
 def run_program(
@@ -34,10 +218,15 @@ def run_program(
     input_file: str = None,
     txt_contents: str = None,
     timeout: float = 5,
+    large_output: bool = False,
+    measure_memory: bool = False,
+    hang_grace: float = process_monitoring.DEFAULT_GRACE,
+    user: str = "student",
+    args: list[str] = (),
 ) -> Submission:
     """
-    Run the specified executable as the student user with given input and
-    return its output
+    Run the specified executable as the student user (by default) with given
+    input and return its output
 
     executable - string containing the name or path of the executable to run.
                  E.g. "Program.out"
@@ -48,80 +237,99 @@ def run_program(
                     Default is `None`.
     timeout -   float specifying how many seconds to wait before terminating
                 the program. Default is None
+    large_output -  If True, the submission's output is a LargeOutput that
+                    holds all of the output (kept on disk when it's big)
+                    instead of a string truncated to common.MAX_CHARS
+    measure_memory -    If True, the program's peak memory use is measured
+                        and saved in the submission's peak_memory_kb
+    hang_grace -    If the program is stuck (e.g. waiting for input that never
+                    comes) without using any CPU time for this many seconds,
+                    it's stopped right away instead of at the timeout.
+                    None turns this off
+    user -  The user to run the program as. Only use "root" for programs
+            the instructor wrote, like a reference solution
+    args -  Command line arguments given to the program
     """
+    # The output is written to a temporary file instead of a pipe, so it
+    # doesn't have to be held in memory
+    stdout_file = tempfile.TemporaryFile()
+    stdin_file = None
 
-    try:
-        # Get user input as a stream of bytes, either from file specified by
-        # `inputFile` or from `txtContents`
-        if input_file:
-            with open(input_file, "r") as f:
-                txt_contents = bytes(f.read(), "ascii")
-        elif txt_contents:
-            txt_contents = bytes(txt_contents, "ascii")
-
-        time.sleep(1)  # Sometimes, not having this would result in test
-        # cases being unable to access the executable,
-        # presumably because another test case was still running.
-
-        # If the executable has no path and doesn't have a ./, then add it
-        if "/" not in executable and not executable.startswith("./"):
-            executable = "./" + executable
-
-        # Run the code submission, use txtContents to serve as user input,
-        # and timeout after `timeout` seconds 1subprocess.run()` returns a
-        # `CompletedProcess` object which contains the stdout and stderr
-        results = subprocess.run(
-            [executable],
-            stdout=subprocess.PIPE,
-            timeout=timeout,
-            input=txt_contents,
-            user="student",
-        )
-        timedout = False
-
-    # If submission times out, the TimeoutExpired object still contains the
-    # stdout and stederr, so we can simply use the exception object as we
-    # would the CompletedProcess object
-    except subprocess.TimeoutExpired as e:
-        results = e
-        timedout = True
-
-    # If unexpected input is piped to program, stdout can often contain
-    # information in memory that goes past the bounds of the file. To filter
-    # this out, we split the bytes string based on the location of ELF,
-    # and only keep everything that was before ELF. This should result in
-    # only the submission's actual output being displayed. This is not an
-    # issue with stderr.
-    try:
-        stdout = (
-            ""
-            if results.stdout is None
-            else results.stdout.split(b"\x7fELF")[0].decode("utf-8")
-        )
-        if results.stderr is None:
-            stderr = ""
-        else:
-            stderr = results.stderr.decode("utf-8")
-
-    except UnicodeDecodeError:
-        raise AssertionError(
-            "Could not decode your output to utf-8.\n"
-            "Make sure you don't output any invalid characters."
-        )
-    max_chars = 30000
-    # If the standard output or error are longer than max_chars, truncate them
-    truncation_message = (
-        f"\n\n** The output exceeded {max_chars} characters, so it was "
-        + "truncated **"
+    # Get user input as a stream of bytes, either from file specified by
+    # `inputFile` or from `txtContents`
+    if input_file:
+        with open(input_file, "r") as f:
+            txt_contents = f.read()
+    if txt_contents is not None:
+        stdin_file = tempfile.TemporaryFile()
+        stdin_file.write(bytes(txt_contents, "ascii"))
+        stdin_file.seek(0)
+
+    time.sleep(1)  # Sometimes, not having this would result in test
+    # cases being unable to access the executable,
+    # presumably because another test case was still running.
+
+    # If the executable has no path and doesn't have a ./, then add it
+    if "/" not in executable and not executable.startswith("./"):
+        executable = "./" + executable
+
+    command = [executable] + list(args)
+    report_read, report_write = None, None
+    if measure_memory:
+        report_read, report_write = os.pipe()
+        command = _memory_launcher() + [str(report_write)] + command
+
+    # Run the code submission, use txtContents to serve as user input,
+    # and timeout after `timeout` seconds. It gets its own session, so
+    # anything it starts can be killed along with it
+    process = subprocess.Popen(
+        command,
+        stdin=stdin_file,
+        stdout=stdout_file,
+        user=user,
+        start_new_session=True,
+        pass_fds=(report_write,) if measure_memory else (),
     )
-    if len(stdout) > max_chars:
-        stdout = stdout[:max_chars] + truncation_message
-    if len(stderr) > max_chars:
-        stderr = stderr[:max_chars] + truncation_message
+    if report_write is not None:
+        os.close(report_write)
+
+    # If submission times out or is stuck, everything it printed before being
+    # stopped is still in the output file
+    # wait4 gives the resources the program used along with its exit status
+    status, usage, timedout, hang_reason = _wait(
+        process, timeout, hang_grace, stdout_file
+    )
+    if timedout:
+        process_monitoring.timed_out_runs += 1
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if stdin_file is not None:
+        stdin_file.close()
+
+    cpu_time = usage.ru_utime + usage.ru_stime
+    peak_memory_kb = None
+    if measure_memory:
+        # The launcher reports on the program itself
+        with os.fdopen(report_read, "rb") as report:
+            measurements = report.read().split()
+        if len(measurements) == 2:
+            peak_memory_kb = int(measurements[0])
+            cpu_time = float(measurements[1])
+
+    with stdout_file:
+        common.check_output_size(stdout_file)
+        try:
+            stdout = common.read_output(stdout_file, large_output)
+        except UnicodeDecodeError:
+            raise AssertionError(
+                "Could not decode your output to utf-8.\n"
+                "Make sure you don't output any invalid characters."
+            )
 
     # Create a `Submission` object containing the results of the program's
     # execution and return it
-    submission = Submission(stdout, stderr, timedout)
+    submission = Submission(
+        stdout, "", timedout, cpu_time, peak_memory_kb, hang_reason
+    )
     return submission
 
 
@@ -132,43 +340,160 @@ def remove_main(input_filename, output_filename):
     This can be used to later test individual functions without dealing with
     multiple definitions of main.
     """
+    # Imported here because loading libclang is slow, so it's only loaded
+    # when it's needed
+    import utils.parsing as parsing
+
     parsing.remove_functions(input_filename, output_filename, "main")
 
 
+class Compilation:
+    """
+    args -  list of strings that were used to compile
+    executable_name - name of the executable the compilation should create
+    errors - string containing the compiler's errors (stderr)
+    duration - how many seconds the compilation took
+    """
+
+    args: list[str]
+    executable_name: str
+    errors: str
+    duration: float
+
+    def __init__(
+        self,
+        args: list[str],
+        executable_name: str,
+        errors: str,
+        duration: float,
+    ):
+        self.args = args
+        self.executable_name = executable_name
+        self.errors = errors
+        self.duration = duration
+
+
+def compile_program(
+    compilation_args, executable_name=None, use_precompiled=True
+) -> Compilation:
+    """
+    Compiles a program and returns the Compilation, which holds the errors
+    and how long it took
+
+    compilation_args -  List of strings to use to compile
+                        e.g. ["g++", "formattingTest.cpp", "studentCode.cpp",
+                              "-Wall", "-o", "formattingTest.out"]
+    executable_name -   Name of the executable file that should be created
+                        e.g. "formattingTest.out"
+    use_precompiled -   Whether to link against the drivers and headers
+                        precompiled by setup.sh when they are available
+    """
+
+    if use_precompiled:
+        compilation_args = precompiling.use_precompiled(compilation_args)
+
+    # The errors go to a file instead of a pipe, so a job the build left
+    # running in the background can't keep the compile from finishing
+    stderr_file = tempfile.TemporaryFile()
+    start = time.perf_counter()
+    compiler = subprocess.Popen(
+        compilation_args,
+        stdout=subprocess.DEVNULL,
+        stderr=stderr_file,
+        start_new_session=True,
+    )
+    process_monitoring.wait_and_kill_group(compiler)
+    duration = time.perf_counter() - start
+
+    stderr_file.seek(0)
+    compilation_errors = stderr_file.read().strip().decode("utf-8")
+    stderr_file.close()
+    return Compilation(
+        compilation_args, executable_name, compilation_errors, duration
+    )
+
+
+def compile_many(jobs, max_workers=None, use_precompiled=True) -> list:
+    """
+    Starts compiling all the jobs at the same time and returns a list of
+    futures, one for each job in the same order. Call `.result()` on a future
+    to wait for its Compilation, or give the future to compile_and_run in
+    place of the compilation arguments.
+
+    Best used at the start of a test class (e.g. in setUpClass) so the
+    drivers are compiled while other tests are running.
+
+    jobs -  List of (compilation_args, executable_name) tuples
+            e.g. [(["g++", "exampleDriver.cpp", "studentFuncs.cpp",
+                    "-o", "exampleDriver.out"], "exampleDriver.out")]
+    max_workers -   How many compilations can run at once.
+                    Default is the number of available cores
+    use_precompiled -   Whether to link against the drivers and headers
+                        precompiled by setup.sh when they are available
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers or common.available_cores()
+    )
+    futures = [
+        executor.submit(
+            compile_program, compilation_args, executable_name, use_precompiled
+        )
+        for compilation_args, executable_name in jobs
+    ]
+    # Lets the running compilations finish without blocking
+    executor.shutdown(wait=False)
+    return futures
+
+
+def make_command(*targets: str, parallel=True) -> list[str]:
+    """
+    Returns the arguments to run make on the given targets, e.g.
+    utils.subprocess_run(utils.make_command(), "student")
+
+    parallel -  Whether make should run as many jobs as there are
+                available cores (-j)
+    """
+    args = ["make"]
+    if parallel:
+        args.append(f"-j{common.available_cores()}")
+    return args + list(targets)
+
+
 def compile_and_run(
-    compilation_args, executable_name, timeout=0.1
+    compilation_args, executable_name, timeout=0.1, use_precompiled=True
 ) -> tuple[str, Submission]:
     """
     Returns the compilation errors and then the submission
     If there are compilation errors then the submission will be None
-    The executable_name file must be in the source directory
+    The executable_name file must be in the working directory (usually the
+    source directory)
 
     compilation_args -  List of strings to use to compile
                         e.g. ["g++", "formattingTest.cpp", "studentCode.cpp",
                               "-Wall", "-o", "formattingTest.out"]
+                        or a future returned by compile_many, in which case
+                        this waits for that compilation to finish
     executable_name -   Name of the executable file to run
                         e.g. "formattingTest.out"
     timeout         -   How long the program can run for
+    use_precompiled -   Whether to link against the drivers and headers
+                        precompiled by setup.sh when they are available
     """
 
-    compiler = subprocess.Popen(
-        compilation_args,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    compilation_errors = compiler.stderr.read().strip().decode("utf-8")
-    compiler.stdout.close()
-    compiler.stderr.close()
-    compiler.kill()
-    compiler.terminate()
+    if isinstance(compilation_args, Future):
+        compilation = compilation_args.result()
+    else:
+        compilation = compile_program(
+            compilation_args, executable_name, use_precompiled
+        )
 
     # If compilation failed,
     # then the executable file will not be present in the source folder
-    if os.path.isfile(common.SOURCE_DIR + "/" + executable_name):
-        executable_path = common.SOURCE_DIR + "/" + executable_name
+    if os.path.isfile(common.WORK_DIR + "/" + executable_name):
+        executable_path = common.WORK_DIR + "/" + executable_name
         submission = run_program(executable=executable_path, timeout=timeout)
     else:
         # No executable file was created
         submission = None
 
-    return compilation_errors, submission
+    return compilation.errors, submission
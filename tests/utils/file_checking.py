@@ -0,0 +1,358 @@
+"""
+This file contains functions for comparing files written by the student's
+program with the expected files, without reading either file into memory.
+
+Files are compared a chunk at a time, so a 100 MB output is no harder to
+check than a small one. Only a short part of the difference (at most
+max_echo characters) is put in the message.
+"""
+
+import hashlib
+import itertools
+import os
+
+# How many bytes are read from each file at a time
+CHUNK_SIZE = 1024 * 1024
+# Longest part of a line shown in a message
+MAX_ECHO = 200
+# Prefix for giving check_file the hash of the expected file instead of
+# the file itself, e.g. "sha256:9f86d08..."
+HASH_PREFIX = "sha256:"
+
+
+class FileDifference:
+    """
+    line - 1-based line of the first difference
+    column - 1-based column (byte in the line) of the first difference, or
+             None if the lines were normalized first
+    expected - the expected text around the difference (None if the
+               expected file ended)
+    actual - the actual text around the difference (None if the actual file
+             ended)
+    line_offset - byte offset where the line starts in both files
+    """
+
+    line: int
+    column: int
+    expected: str
+    actual: str
+    line_offset: int
+
+    def __init__(
+        self,
+        line: int,
+        column: int,
+        expected: str,
+        actual: str,
+        line_offset: int = None,
+    ):
+        self.line = line
+        self.column = column
+        self.expected = expected
+        self.actual = actual
+        self.line_offset = line_offset
+
+    def __str__(self) -> str:
+        if self.actual is None:
+            return f"ended at line {self.line}, but more was expected"
+        if self.expected is None:
+            return f"has more than expected, starting at line {self.line}"
+        if self.column is None:
+            return f"differs at line {self.line}"
+        return f"differs at line {self.line}, column {self.column}"
+
+
+def file_digest(path: str) -> str:
+    """
+    Returns the "sha256:<hex>" hash of a file, read a chunk at a time. The
+    result can be given to check_file in place of the expected file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return HASH_PREFIX + digest.hexdigest()
+
+
+def _excerpt(data: bytes, index: int, max_echo: int) -> str:
+    """
+    Returns up to max_echo characters of the line in data around the index,
+    without the line ending
+    """
+    line_start = data.rfind(b"\n", 0, index) + 1
+    start = max(line_start, index - max_echo // 2)
+    text = data[start : start + max_echo].split(b"\n")[0].rstrip(b"\r")
+    prefix = "..." if start > line_start else ""
+    return prefix + text.decode("utf-8", errors="replace")
+
+
+def _mismatch(first: bytes, second: bytes) -> int:
+    """
+    Returns the first index where the two byte strings differ
+    """
+    length = min(len(first), len(second))
+    low, high = 0, length
+    # Binary search on equal prefixes, since comparing slices is much faster
+    # than comparing one byte at a time in Python
+    while low < high:
+        middle = (low + high) // 2
+        if first[low : middle + 1] == second[low : middle + 1]:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _first_byte_difference(
+    expected_file, actual_file, chunk_size: int, max_echo: int
+) -> FileDifference:
+    line, line_start = 1, 0
+    offset = 0
+    while True:
+        expected = expected_file.read(chunk_size)
+        actual = actual_file.read(chunk_size)
+        if expected == actual:
+            if not expected:
+                return None
+            newline = expected.rfind(b"\n")
+            if newline != -1:
+                line += expected.count(b"\n")
+                line_start = offset + newline + 1
+            offset += len(expected)
+            continue
+
+        index = _mismatch(expected, actual)
+        newline = expected.rfind(b"\n", 0, index)
+        if newline != -1:
+            line += expected.count(b"\n", 0, index)
+            line_start = offset + newline + 1
+        column = offset + index - line_start + 1
+        return FileDifference(
+            line,
+            column,
+            _excerpt(expected, index, max_echo)
+            if index < len(expected)
+            else None,
+            _excerpt(actual, index, max_echo) if index < len(actual) else None,
+            line_start,
+        )
+
+
+def _normalize(segment: bytes, ignore_trailing_whitespace: bool) -> bytes:
+    # Only called with whole lines, so the line ending can be removed
+    segment = segment.rstrip(b"\n").rstrip(b"\r")
+    if ignore_trailing_whitespace:
+        segment = segment.rstrip()
+    return segment
+
+
+def _first_line_difference(
+    expected_file,
+    actual_file,
+    chunk_size: int,
+    max_echo: int,
+    ignore_trailing_whitespace: bool,
+    line: int = 1,
+) -> FileDifference:
+    column = 1
+    while True:
+        # Reading at most chunk_size bytes, so a file without newlines
+        # doesn't have to fit in memory. Long lines are compared in pieces.
+        expected = expected_file.readline(chunk_size)
+        actual = actual_file.readline(chunk_size)
+
+        if not expected and not actual:
+            return None
+        if not expected or not actual:
+            # Blank lines at the end don't count when whitespace is ignored
+            rest = expected or actual
+            remaining = expected_file if expected else actual_file
+            while ignore_trailing_whitespace and rest and not rest.strip():
+                rest = remaining.readline(chunk_size)
+            if not rest:
+                return None
+            excerpt = _excerpt(rest, 0, max_echo)
+            return FileDifference(
+                line,
+                column,
+                excerpt if expected else None,
+                excerpt if actual else None,
+            )
+
+        # A piece is a whole line if it has a newline or the file ended
+        ends_line = all(
+            piece.endswith(b"\n") or len(piece) < chunk_size
+            for piece in (expected, actual)
+        )
+        if ends_line:
+            if _normalize(expected, ignore_trailing_whitespace) == _normalize(
+                actual, ignore_trailing_whitespace
+            ):
+                line, column = line + 1, 1
+                continue
+        elif expected == actual:
+            column += len(expected)
+            continue
+
+        index = _mismatch(expected, actual)
+        return FileDifference(
+            line,
+            column + index,
+            _excerpt(expected, index, max_echo),
+            _excerpt(actual, index, max_echo),
+        )
+
+
+def _first_normalized_difference(
+    expected_file, actual_file, normalize, max_echo: int
+) -> FileDifference:
+    # The lines that are left out by normalize don't count, so the line
+    # numbers are the actual file's
+    last_line = 0
+    for expected, actual in itertools.zip_longest(
+        normalize.lines(expected_file), normalize.lines(actual_file)
+    ):
+        if actual is None:
+            return FileDifference(
+                last_line + 1, None, expected[1][:max_echo], None
+            )
+        if expected is None:
+            return FileDifference(
+                actual[0] + 1, None, None, actual[1][:max_echo]
+            )
+        if expected[2] != actual[2]:
+            return FileDifference(
+                actual[0] + 1,
+                None,
+                expected[1][:max_echo],
+                actual[1][:max_echo],
+            )
+        last_line = actual[0] + 1
+    return None
+
+
+def first_difference(
+    expected_path: str,
+    actual_path: str,
+    line_mode: bool = True,
+    ignore_trailing_whitespace: bool = True,
+    chunk_size: int = CHUNK_SIZE,
+    max_echo: int = MAX_ECHO,
+    normalize=None,
+) -> FileDifference:
+    """
+    Returns where the actual file first differs from the expected file, or
+    None if they match
+
+    line_mode - Compare line by line, ignoring \\r\\n vs \\n line endings.
+                Otherwise the files must match byte for byte
+    ignore_trailing_whitespace - In line mode, ignore whitespace at the end
+                                 of lines and blank lines at the end
+    normalize - A utils.normalizing.Pipeline that both files' lines are
+                cleaned with before they're compared (instead of line_mode)
+    """
+    if normalize is not None:
+        with open(expected_path, "r", errors="replace") as expected_file:
+            with open(actual_path, "r", errors="replace") as actual_file:
+                return _first_normalized_difference(
+                    expected_file, actual_file, normalize, max_echo
+                )
+
+    with open(expected_path, "rb") as expected_file, open(
+        actual_path, "rb"
+    ) as actual_file:
+        # Comparing whole chunks is much faster than going line by line, so
+        # line mode only starts at the first line with a different byte
+        difference = _first_byte_difference(
+            expected_file, actual_file, chunk_size, max_echo
+        )
+        if difference is None or not line_mode:
+            return difference
+
+        expected_file.seek(difference.line_offset)
+        actual_file.seek(difference.line_offset)
+        return _first_line_difference(
+            expected_file,
+            actual_file,
+            chunk_size,
+            max_echo,
+            ignore_trailing_whitespace,
+            difference.line,
+        )
+
+
+def check_file(
+    expected: str,
+    actual_path: str,
+    line_mode: bool = True,
+    ignore_trailing_whitespace: bool = True,
+    hint_level: int = 1,
+    max_echo: int = MAX_ECHO,
+    normalize=None,
+) -> str:
+    """
+    Checks that a file the student's program wrote matches the expected file
+
+    :param expected         Path of the expected file, or its hash from
+                            file_digest ("sha256:..."). With a hash, only
+                            exact matches pass and no location is given
+
+    :param actual_path      Path of the file written by the student's program
+
+    :param line_mode        Compare line by line, ignoring \\r\\n vs \\n.
+                            Otherwise the files must match byte for byte
+
+    :param ignore_trailing_whitespace   In line mode, ignore whitespace at the
+                                        end of lines and blank lines at the
+                                        end of the file
+
+    :param hint_level       How much of a hint should be given in the error
+                            message
+                            0 = Only the word "fail" will be returned if
+                                the files don't match
+                            1 = Will tell the line and column of the first
+                                difference
+                            2 = Will also show the student's line there
+                            3 = Will also show the expected line there
+                                WARNING - will reveal the expected output
+
+    :param max_echo         The most characters of a line to show
+
+    :param normalize        A utils.normalizing.Pipeline to clean up both
+                            files' lines with before comparing them. The
+                            hints still show the lines as they were written
+
+    :returns                An empty string if the files match, and an error
+                            message otherwise.
+                            This error message should be raised as an
+                            AssertionError in your unit testing script if
+                            it's not empty
+    """
+    name = os.path.basename(actual_path)
+    if not os.path.isfile(actual_path):
+        return "Fail" if hint_level == 0 else f"{name} was not created"
+
+    if expected.startswith(HASH_PREFIX):
+        if file_digest(actual_path) == expected:
+            return ""
+        return "Fail" if hint_level == 0 else f"{name} is not correct"
+
+    difference = first_difference(
+        expected,
+        actual_path,
+        line_mode,
+        ignore_trailing_whitespace,
+        max_echo=max_echo,
+        normalize=normalize,
+    )
+    if difference is None:
+        return ""
+    if hint_level == 0:
+        return "Fail"
+
+    msg = f"{name} {difference}"
+    if hint_level >= 2 and difference.actual is not None:
+        msg += f"\n\nYour line:\n{difference.actual}"
+    if hint_level >= 3 and difference.expected is not None:
+        msg += f"\n\nExpected line:\n{difference.expected}"
+    return msg
@@ -0,0 +1,220 @@
+"""
+This file contains functions for storing the expected output of each test
+case, made by running the instructor's reference solution, instead of
+pasting it into test.py.
+
+Register each input in test.py with utils.reference.register_case. When the
+docker image is built (see setup.sh), the reference solution is run on every
+registered input and the outputs are saved, compressed, in golden.pack in the
+tests directory. golden.json indexes them by the hash of their contents, so
+cases with the same output share one copy.
+
+Tests get an output with expected_output. The pack is memory mapped the
+first time it's needed, and only the outputs that are asked for are
+decompressed, once each.
+"""
+
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import tempfile
+import utils.common as common
+import utils.driver_running as driver_running
+import utils.file_checking as file_checking
+import utils.reference as reference
+
+GOLDEN_PACK = os.path.join(common.TESTS_DIR, "golden.pack")
+GOLDEN_INDEX = os.path.join(common.TESTS_DIR, "golden.json")
+
+# lzma compression level. Higher is smaller but slower to build, and
+# decompressing is fast at any level
+DEFAULT_PRESET = 6
+
+_index = None
+_pack = None
+_outputs = {}
+_paths = {}
+
+
+def _load_index(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _open_pack(path: str):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        # The map stays valid after the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def build(
+    pack_path: str = None,
+    index_path: str = None,
+    preset: int = DEFAULT_PRESET,
+) -> dict:
+    """
+    Runs the reference executable on every registered case and saves the
+    outputs to the pack. Cases whose executable and input haven't changed
+    since the last build are not run again.
+
+    Returns the index, with "cases" (each case's "digest" and
+    "fingerprint") and "blobs" (where each digest's compressed output is in
+    the pack, as "offset", "length", and uncompressed "size").
+
+    preset -    lzma compression level, from 0 to 9
+    """
+    pack_path = pack_path or GOLDEN_PACK
+    index_path = index_path or GOLDEN_INDEX
+    previous = _load_index(index_path)
+    try:
+        previous_pack = _open_pack(pack_path)
+    except FileNotFoundError:
+        previous_pack, previous = b"", {}
+
+    cases, blobs = {}, {}
+    directory = os.path.dirname(os.path.abspath(pack_path))
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as pack:
+        for name, case in reference._cases.items():
+            if not os.path.isfile(case.executable):
+                common.ta_print(
+                    f"Can't build the golden output for {name}: "
+                    f"{case.executable} doesn't exist"
+                )
+                continue
+
+            fingerprint = case.fingerprint()
+            cached = previous.get("cases", {}).get(name)
+            if cached and cached["fingerprint"] == fingerprint:
+                digest = cached["digest"]
+                if digest not in blobs:
+                    # Copying the compressed output from the old pack
+                    blob = previous["blobs"][digest]
+                    start = blob["offset"]
+                    data = previous_pack[start : start + blob["length"]]
+                    blobs[digest] = dict(blob, offset=pack.tell())
+                    pack.write(data)
+                cases[name] = {"digest": digest, "fingerprint": fingerprint}
+                continue
+
+            run = driver_running.run_program(
+                case.executable,
+                input_file=case.input_file,
+                txt_contents=case.txt_contents,
+                timeout=reference.CALIBRATION_TIMEOUT,
+                large_output=True,
+                hang_grace=None,
+                user="root",
+            )
+            if run.timed_out:
+                common.ta_print(
+                    f"Can't build the golden output for {name}: the "
+                    f"reference took over {reference.CALIBRATION_TIMEOUT} "
+                    "seconds"
+                )
+                run.output.close()
+                continue
+
+            # Hashing first, so an output that's already in the pack isn't
+            # compressed again
+            hasher = hashlib.sha256()
+            for chunk in run.output.chunks():
+                hasher.update(chunk)
+            digest = hasher.hexdigest()
+            if digest not in blobs:
+                compressor = lzma.LZMACompressor(preset=preset)
+                offset = pack.tell()
+                for chunk in run.output.chunks():
+                    pack.write(compressor.compress(chunk))
+                pack.write(compressor.flush())
+                blobs[digest] = {
+                    "offset": offset,
+                    "length": pack.tell() - offset,
+                    "size": len(run.output),
+                }
+            run.output.close()
+            cases[name] = {"digest": digest, "fingerprint": fingerprint}
+
+    if isinstance(previous_pack, mmap.mmap):
+        previous_pack.close()
+    os.replace(pack.name, pack_path)
+    index = {"cases": cases, "blobs": blobs}
+    with open(index_path, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    # Only root can read them, like the rest of the tests directory
+    os.chmod(pack_path, 0o600)
+    os.chmod(index_path, 0o600)
+    return index
+
+
+def _blob(name: str) -> dict:
+    global _index
+
+    if _index is None:
+        _index = _load_index(GOLDEN_INDEX)
+    case = _index.get("cases", {}).get(name)
+    if case is None:
+        raise KeyError(
+            f"There's no golden output for {name}. Register it with "
+            "utils.reference.register_case and run "
+            "utils/runnables/build_golden.py"
+        )
+    return dict(_index["blobs"][case["digest"]], digest=case["digest"])
+
+
+def _compressed(blob: dict):
+    global _pack
+
+    if _pack is None:
+        _pack = _open_pack(GOLDEN_PACK)
+    return _pack[blob["offset"] : blob["offset"] + blob["length"]]
+
+
+def expected_output(name: str) -> str:
+    """
+    Returns the reference solution's output for the registered case. Raises
+    a KeyError if the case has no golden output.
+
+    e.g. run = utils.run_program("./studentMain.out", txt_contents=text)
+         expected = utils.golden.expected_output("2.1")
+    """
+    if name not in _outputs:
+        data = lzma.decompress(_compressed(_blob(name)))
+        _outputs[name] = data.decode("utf-8", errors="replace")
+    return _outputs[name]
+
+
+def digest(name: str) -> str:
+    """
+    Returns the "sha256:..." hash of the case's golden output, without
+    decompressing it. It can be given to utils.check_file to check that a
+    file matches the output exactly.
+    """
+    return file_checking.HASH_PREFIX + _blob(name)["digest"]
+
+
+def expected_path(name: str) -> str:
+    """
+    Decompresses the case's golden output to a file only root can read, and
+    returns its path. Use it with utils.check_file for outputs too large to
+    hold in memory.
+    """
+    if name not in _paths:
+        decompressor = lzma.LZMADecompressor()
+        compressed = _compressed(_blob(name))
+        descriptor, path = tempfile.mkstemp(prefix="golden-")
+        with os.fdopen(descriptor, "wb") as f:
+            for start in range(0, len(compressed), file_checking.CHUNK_SIZE):
+                f.write(
+                    decompressor.decompress(
+                        compressed[start : start + file_checking.CHUNK_SIZE]
+                    )
+                )
+        _paths[name] = path
+    return _paths[name]
@@ -0,0 +1,184 @@
+"""
+This file contains functions for compiling and running Java submissions
+without paying for the JVM's startup on every test case.
+
+All of the student's and the drivers' sources are compiled with a single
+javac call and packed into one jar. The program is then run once to record
+the classes it loads in a class data sharing (AppCDS) archive, and every
+run after that maps the archive instead of loading and verifying those
+classes again. Runs go through run_program, so they return the usual
+Submission.
+
+Needs a JDK (13 or newer for the archive) with java and javac on the PATH.
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+import utils.common as common
+import utils.driver_running as driver_running
+
+# Given to every run. The serial collector starts fastest and is plenty for
+# small programs, and logging is off so warnings about the archive can't
+# end up in the program's output
+JVM_FLAGS = ("-XX:+UseSerialGC", "-Xshare:auto", "-Xlog:disable")
+# Longest the run that records the archive can take
+ARCHIVE_TIMEOUT = 30
+
+
+class JavaProgram:
+    """
+    A compiled Java program that can be run many times
+
+    compilation - the Compilation from javac, with its errors and duration
+    jar - path of the jar holding every compiled class, or None if
+          compiling failed
+    main_class - the class with main, e.g. "Main" or "driver.TestDriver"
+    archive - path of the class data sharing archive, or None if there
+              isn't one
+    """
+
+    compilation: driver_running.Compilation
+    jar: str
+    main_class: str
+    archive: str
+
+    def __init__(
+        self,
+        compilation: driver_running.Compilation,
+        jar: str,
+        main_class: str,
+        archive: str = None,
+    ):
+        self.compilation = compilation
+        self.jar = jar
+        self.main_class = main_class
+        self.archive = archive
+
+    def command(self, args: list[str] = (), archive_flag: str = None):
+        """
+        Returns the arguments given to java to run the program
+        """
+        if archive_flag is None and self.archive is not None:
+            archive_flag = f"-XX:SharedArchiveFile={self.archive}"
+        flags = list(JVM_FLAGS)
+        if archive_flag is not None:
+            flags.append(archive_flag)
+        return flags + ["-cp", self.jar, self.main_class] + list(args)
+
+    def create_archive(self, txt_contents: str = None) -> bool:
+        """
+        Runs the program once, as the student, and saves the classes it
+        loaded to an archive next to the jar. Later runs use it. Returns
+        whether the archive was made.
+
+        txt_contents -  Input for this run. Classes that are only loaded for
+                        other inputs are loaded as usual when they're needed
+        """
+        archive = os.path.splitext(self.jar)[0] + ".jsa"
+        driver_running.run_program(
+            shutil.which("java"),
+            txt_contents="" if txt_contents is None else txt_contents,
+            timeout=ARCHIVE_TIMEOUT,
+            hang_grace=None,
+            args=self.command(
+                archive_flag=f"-XX:ArchiveClassesAtExit={archive}"
+            ),
+        )
+        if os.path.isfile(archive):
+            self.archive = archive
+            return True
+        common.ta_print(f"Couldn't create the class data archive {archive}")
+        return False
+
+    def run(
+        self,
+        input_file: str = None,
+        txt_contents: str = None,
+        timeout: float = 5,
+        large_output: bool = False,
+        measure_memory: bool = False,
+        hang_grace: float = None,
+        args: list[str] = (),
+    ) -> driver_running.Submission:
+        """
+        Runs the program as the student and returns the Submission. Takes the
+        same arguments as run_program, plus args for the program's command
+        line arguments.
+
+        Stuck programs aren't stopped early by default (hang_grace=None),
+        since the JVM's own threads wait on locks with timeouts, which looks
+        the same as a deadlock.
+        """
+        return driver_running.run_program(
+            shutil.which("java"),
+            input_file=input_file,
+            txt_contents=txt_contents,
+            timeout=timeout,
+            large_output=large_output,
+            measure_memory=measure_memory,
+            hang_grace=hang_grace,
+            args=self.command(args),
+        )
+
+
+def _write_jar(classes_dir: str, jar: str) -> None:
+    # A jar is a zip of the class files, which is much faster to write here
+    # than to start the jar tool (another JVM)
+    with zipfile.ZipFile(jar, "w", zipfile.ZIP_DEFLATED) as archive:
+        for root, _, files in os.walk(classes_dir):
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                archive.write(path, os.path.relpath(path, classes_dir))
+    os.chmod(jar, 0o644)
+
+
+def compile_java(
+    sources: list[str],
+    main_class: str,
+    jar_name: str = None,
+    flags: list[str] = (),
+    archive_input: str = "",
+) -> JavaProgram:
+    """
+    Compiles all the sources with one javac call and returns the
+    JavaProgram. If it compiled, the program is run once to create its
+    class data sharing archive.
+
+    sources -   Paths of every .java file, the student's and the drivers'
+                e.g. ["Main.java", "StudentCode.java"]
+    main_class -    Name of the class with main, e.g. "Main"
+    jar_name -  Name of the jar created in the working directory. Default is
+                the main class's name followed by .jar
+    flags - Extra arguments for javac, e.g. ["--release", "17"]
+    archive_input - Input for the run that creates the archive, or None to
+                    not create one
+    """
+    jar = os.path.join(common.WORK_DIR, jar_name or main_class + ".jar")
+    # Removing the last build, so it isn't run if this one fails
+    for old in (jar, os.path.splitext(jar)[0] + ".jsa"):
+        if os.path.isfile(old):
+            os.remove(old)
+
+    classes_dir = tempfile.mkdtemp(prefix="classes-")
+    try:
+        compilation = driver_running.compile_program(
+            ["javac", "-d", classes_dir] + list(flags) + list(sources),
+            os.path.basename(jar),
+            use_precompiled=False,
+        )
+        # javac doesn't write any classes if there were errors, while
+        # warnings are also in compilation.errors
+        compiled = any(files for _, _, files in os.walk(classes_dir))
+        if compiled:
+            _write_jar(classes_dir, jar)
+    finally:
+        shutil.rmtree(classes_dir, ignore_errors=True)
+
+    if not os.path.isfile(jar):
+        return JavaProgram(compilation, None, main_class)
+    program = JavaProgram(compilation, jar, main_class)
+    if archive_input is not None:
+        program.create_archive(archive_input)
+    return program
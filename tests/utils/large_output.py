@@ -0,0 +1,176 @@
+"""
+This file contains a class for holding a program's output without keeping all
+of it in memory.
+
+Small outputs are read into memory, but once an output grows past
+MEMORY_THRESHOLD bytes it is left in a temporary file and searched through a
+memory map. Only the parts that are asked for are decoded to text.
+"""
+
+import mmap
+import re
+
+# Outputs larger than this many bytes are kept on disk
+MEMORY_THRESHOLD = 1024 * 1024
+
+# How many bytes are scanned at a time when counting lines
+CHUNK_SIZE = 1024 * 1024
+
+
+class LargeOutput:
+    """
+    The full output of a program that can be searched like a string.
+
+    All offsets (from find, len, slicing, etc.) are in bytes of the UTF-8
+    encoded output. Invalid UTF-8 is replaced with "�" when decoded.
+
+    Supported:
+        "phrase" in output
+        output.find("phrase", start)
+        output[start:end]       (returns a str)
+        output.lines()          (yields each line as a str)
+        output.finditer(r"regex")
+        len(output)
+    """
+
+    def __init__(self, data, file=None, end: int = None):
+        # data is either bytes or an mmap of file
+        self._data = data
+        self._file = file
+        self._end = len(data) if end is None else end
+
+    @classmethod
+    def from_file(
+        cls, file, threshold: int = MEMORY_THRESHOLD, cut_at: bytes = None
+    ):
+        """
+        Creates a LargeOutput from an open binary file or a file path.
+        If the file is smaller than threshold bytes, it is read into memory
+        and closed, otherwise it is memory mapped.
+
+        cut_at - If given, only the output before the first occurrence of
+                 these bytes is kept
+        """
+        if isinstance(file, str):
+            file = open(file, "rb")
+
+        file.seek(0, 2)
+        size = file.tell()
+        if size <= threshold:
+            file.seek(0)
+            data = file.read()
+            file.close()
+        else:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        end = -1 if cut_at is None else data.find(cut_at)
+        return cls(
+            data,
+            file if isinstance(data, mmap.mmap) else None,
+            None if end == -1 else end,
+        )
+
+    def _encode(self, text):
+        return text.encode("utf-8") if isinstance(text, str) else text
+
+    def __len__(self) -> int:
+        return self._end
+
+    def __contains__(self, phrase) -> bool:
+        return self.find(phrase) != -1
+
+    def __getitem__(self, key) -> str:
+        if isinstance(key, int):
+            key = slice(key, key + 1 if key != -1 else None)
+        start, stop, step = key.indices(self._end)
+        return self._data[start:stop:step].decode("utf-8", errors="replace")
+
+    def __str__(self) -> str:
+        return self[:]
+
+    def __repr__(self) -> str:
+        return f"<LargeOutput of {self._end} bytes>"
+
+    def find(self, phrase, start: int = 0, end: int = None) -> int:
+        """
+        Returns the lowest byte offset where phrase is found, or -1
+        """
+        end = self._end if end is None else min(end, self._end)
+        return self._data.find(self._encode(phrase), start, end)
+
+    def count(self, phrase, start: int = 0, end: int = None) -> int:
+        """
+        Returns how many times phrase appears without overlapping
+        """
+        phrase = self._encode(phrase)
+        end = self._end if end is None else min(end, self._end)
+        total = 0
+        loc = self._data.find(phrase, start, end)
+        while loc != -1 and phrase:
+            total += 1
+            loc = self._data.find(phrase, loc + len(phrase), end)
+        return total
+
+    def line_number(self, offset: int) -> int:
+        """
+        Returns the 1-based line number that the byte offset is on
+        """
+        newlines = 0
+        for start in range(0, min(offset, self._end), CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, offset, self._end)
+            newlines += self._data[start:stop].count(b"\n")
+        return newlines + 1
+
+    def line_spans(self):
+        """
+        Yields the (start, stop) byte offsets of each line, without its
+        newline
+        """
+        start = 0
+        while start < self._end:
+            stop = self._data.find(b"\n", start, self._end)
+            if stop == -1:
+                stop = self._end
+            yield start, stop
+            start = stop + 1
+
+    def lines(self):
+        """
+        Yields each line of the output as a string without its newline
+        """
+        for start, stop in self.line_spans():
+            yield self._data[start:stop].decode("utf-8", errors="replace")
+
+    def chunks(self, size: int = CHUNK_SIZE):
+        """
+        Yields the raw bytes of the output, at most size bytes at a time
+        """
+        for start in range(0, self._end, size):
+            yield bytes(self._data[start : min(start + size, self._end)])
+
+    def finditer(self, pattern, flags=0):
+        """
+        Yields a match object for every match of the regular expression.
+        The matches are on bytes, so use match.group().decode() to get text
+        """
+        if isinstance(pattern, str):
+            pattern = pattern.encode("utf-8")
+        regex = re.compile(pattern, flags)
+        return regex.finditer(self._data, 0, self._end)
+
+    def search(self, pattern, flags=0):
+        """
+        Returns the first match of the regular expression or None
+        """
+        return next(self.finditer(pattern, flags), None)
+
+    def close(self) -> None:
+        """
+        Releases the memory map and temporary file, if there are any
+        """
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file is not None:
+            self._file.close()
+        self._data = b""
+        self._end = 0
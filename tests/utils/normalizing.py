@@ -0,0 +1,331 @@
+"""
+This file contains a pipeline for cleaning up a program's output before it's
+checked, e.g. removing color codes and prompts, collapsing whitespace, and
+ignoring case.
+
+Instead of a chain of .replace(), .lower(), and re.sub() calls that each copy
+the whole output, the output is passed through every stage one line at a
+time, and the cleaned lines are joined once. The result remembers which line
+of the original output each of its lines came from, so hints can quote what
+the student actually printed.
+
+A LargeOutput is cleaned the same way, but its cleaned lines are written to a
+temporary file as they're made, so only one line is in memory at a time.
+
+e.g.
+normalize = utils.normalizing.Pipeline(
+    utils.normalizing.strip_ansi,
+    utils.normalizing.drop_prompts("Enter a number: "),
+    utils.normalizing.collapse_whitespace,
+    utils.normalizing.casefold,
+)
+msg = utils.check_phrases(expected, run.output, hint_level=2,
+                          normalize=normalize)
+"""
+
+import bisect
+import itertools
+import mmap
+import re
+import struct
+import tempfile
+from utils.large_output import MEMORY_THRESHOLD, LargeOutput
+
+# Color and cursor escape codes, e.g. "\x1b[31m"
+ANSI_PATTERN = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|[@-Z\\-_])")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+# Stages. Each one takes a line (without its newline) and returns the
+# cleaned line, or None to leave the line out
+
+
+def strip_ansi(line: str) -> str:
+    """
+    Removes terminal color and cursor codes
+    """
+    return ANSI_PATTERN.sub("", line) if "\x1b" in line else line
+
+
+def collapse_whitespace(line: str) -> str:
+    """
+    Turns every run of whitespace into one space and removes whitespace at
+    the start and end of the line
+    """
+    return WHITESPACE_PATTERN.sub(" ", line).strip()
+
+
+def strip_trailing_whitespace(line: str) -> str:
+    """
+    Removes whitespace at the end of the line, including a \\r
+    """
+    return line.rstrip()
+
+
+def casefold(line: str) -> str:
+    """
+    Ignores case (a stronger lower())
+    """
+    return line.casefold()
+
+
+def drop_blank_lines(line: str) -> str:
+    """
+    Leaves out lines that are empty or only whitespace
+    """
+    return line if line.strip() else None
+
+
+def drop_prompts(*prompts: str):
+    """
+    Returns a stage that removes the prompts from the start of each line,
+    e.g. drop_prompts("Enter a number: "). Programs usually print a prompt
+    without a newline, so it ends up in front of the next thing printed.
+    Lines that were only prompts are left out.
+    """
+
+    def stage(line: str) -> str:
+        removed = True
+        dropped_any = False
+        while removed:
+            removed = False
+            for prompt in prompts:
+                if prompt and line.startswith(prompt):
+                    line = line[len(prompt) :]
+                    removed = dropped_any = True
+        if dropped_any and not line.strip():
+            return None
+        return line
+
+    return stage
+
+
+def _line_spans(output):
+    """
+    Yields the (start, stop, text) of each line in a string or LargeOutput,
+    without the newline
+    """
+    if isinstance(output, str):
+        start = 0
+        while start < len(output):
+            stop = output.find("\n", start)
+            if stop == -1:
+                stop = len(output)
+            yield start, stop, output[start:stop]
+            start = stop + 1
+    else:
+        for start, stop in output.line_spans():
+            yield start, stop, output[start:stop]
+
+
+class NormalizedOutput(str):
+    """
+    The cleaned output of a string. It can be used like any other string
+    (e.g. with check_phrases or parse_numbers), and every line ends with a
+    newline.
+
+    original - the output before it was cleaned
+    """
+
+    original: object
+
+    def __new__(cls, lines: list[str], original, spans: list[tuple]):
+        self = super().__new__(cls, "".join(line + "\n" for line in lines))
+        self.original = original
+        # Where each cleaned line starts in this string, and where the line
+        # it came from starts and ends in the original
+        self._starts = list(
+            itertools.accumulate((len(line) + 1 for line in lines), initial=0)
+        )
+        self._spans = spans
+        return self
+
+    def _line_index(self, position: int) -> int:
+        # Index of the cleaned line that the position is in
+        return bisect.bisect_right(self._starts, position) - 1
+
+    def line_number(self, position: int) -> int:
+        """
+        Returns the 1-based line of the original output that the position in
+        the cleaned text came from
+        """
+        if not self._spans:
+            return 1
+        start = self._spans[
+            min(self._line_index(position), len(self._spans) - 1)
+        ][0]
+        return self.original.count("\n", 0, start) + 1
+
+    def original_text(self, start: int = 0, end: int = None) -> str:
+        """
+        Returns the original lines that the cleaned text from start to end
+        came from, e.g. to show the student what they printed
+        """
+        end = len(self) if end is None else end
+        # Starting right after a line doesn't include that line
+        if start < end and self[start] == "\n":
+            start += 1
+        if end <= start or len(self._spans) == 0:
+            return ""
+        first = min(self._line_index(start), len(self._spans) - 1)
+        last = min(self._line_index(end - 1), len(self._spans) - 1)
+        return str(self.original[self._spans[first][0] : self._spans[last][1]])
+
+
+# Each cleaned line's start, and the start and end of the line it came from
+_SPAN = struct.Struct("qqq")
+
+
+def _open_data(file):
+    # The file's contents, memory mapped if they're big
+    file.flush()
+    size = file.seek(0, 2)
+    if size == 0:
+        return b""
+    if size <= MEMORY_THRESHOLD:
+        file.seek(0)
+        return file.read()
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class NormalizedLargeOutput(LargeOutput):
+    """
+    The cleaned output of a LargeOutput. It's a LargeOutput itself (offsets
+    are in bytes), kept in a temporary file when it's big, and every line
+    ends with a newline. Call close() when done with it.
+
+    original - the LargeOutput before it was cleaned
+    """
+
+    original: LargeOutput
+
+    def __init__(self, data_file, spans_file, original: LargeOutput):
+        data = _open_data(data_file)
+        super().__init__(data, data_file)
+        self.original = original
+        self._spans_file = spans_file
+        self._spans_data = _open_data(spans_file)
+        spans = memoryview(self._spans_data).cast("q")
+        self._views = [spans, spans[0::3], spans[1::3], spans[2::3]]
+        (
+            _,
+            self._starts,
+            self._original_starts,
+            self._original_stops,
+        ) = self._views
+
+    def _line_index(self, position: int) -> int:
+        # Index of the cleaned line that the position is in
+        return bisect.bisect_right(self._starts, position) - 1
+
+    def line_number(self, position: int) -> int:
+        """
+        Returns the 1-based line of the original output that the byte offset
+        in the cleaned output came from
+        """
+        if not self._starts:
+            return 1
+        index = min(self._line_index(position), len(self._starts) - 1)
+        return self.original.line_number(self._original_starts[index])
+
+    def original_text(self, start: int = 0, end: int = None) -> str:
+        """
+        Returns the original lines that the cleaned output from start to end
+        (byte offsets) came from, e.g. to show the student what they printed
+        """
+        end = len(self) if end is None else end
+        # Starting right after a line doesn't include that line
+        if start < end and self[start] == "\n":
+            start += 1
+        if end <= start or len(self._starts) == 0:
+            return ""
+        last_line = len(self._starts) - 1
+        first = min(self._line_index(start), last_line)
+        last = min(self._line_index(end - 1), last_line)
+        return self.original[
+            self._original_starts[first] : self._original_stops[last]
+        ]
+
+    def close(self) -> None:
+        """
+        Releases the memory maps and temporary files
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._starts = self._original_starts = self._original_stops = ()
+        if isinstance(self._spans_data, mmap.mmap):
+            self._spans_data.close()
+        self._spans_file.close()
+        super().close()
+
+
+class Pipeline:
+    """
+    Cleans up output by passing each line through the stages in order
+
+    stages - functions that take a line and return the cleaned line or None
+    """
+
+    stages: tuple
+
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def normalize_line(self, line: str) -> str:
+        """
+        Returns the cleaned line, or None if it should be left out
+        """
+        for stage in self.stages:
+            line = stage(line)
+            if line is None:
+                return None
+        return line
+
+    def lines(self, lines):
+        """
+        Takes any iterable of lines (e.g. an open file) and yields
+        (index of the original line, original line, cleaned line) for each
+        line that isn't left out, one at a time
+        """
+        for index, original in enumerate(lines):
+            original = original.rstrip("\n")
+            line = self.normalize_line(original)
+            if line is not None:
+                yield index, original, line
+
+    def apply(self, text: str) -> str:
+        """
+        Returns the cleaned text as a plain string, without a newline added
+        at the end, e.g. for cleaning the expected phrases
+        """
+        return "\n".join(line for _, _, line in self.lines(text.split("\n")))
+
+    def __call__(self, output):
+        """
+        Returns the cleaned output of a string (as a NormalizedOutput) or
+        LargeOutput (as a NormalizedLargeOutput, which should be closed)
+        """
+        if not isinstance(output, str):
+            return self._normalize_large(output)
+        lines, spans = [], []
+        for start, stop, text in _line_spans(output):
+            line = self.normalize_line(text)
+            if line is not None:
+                lines.append(line)
+                spans.append((start, stop))
+        return NormalizedOutput(lines, output, spans)
+
+    def _normalize_large(self, output: LargeOutput) -> NormalizedLargeOutput:
+        # Each cleaned line is written out as soon as it's made
+        data_file = tempfile.TemporaryFile()
+        spans_file = tempfile.TemporaryFile()
+        position = 0
+        for start, stop, text in _line_spans(output):
+            line = self.normalize_line(text)
+            if line is not None:
+                encoded = line.encode("utf-8") + b"\n"
+                data_file.write(encoded)
+                spans_file.write(_SPAN.pack(position, start, stop))
+                position += len(encoded)
+        return NormalizedLargeOutput(data_file, spans_file, output)
@@ -0,0 +1,151 @@
+"""
+This file contains functions for checking numbers printed by the student's
+code against expected values.
+
+The numbers are pulled out of the output in one pass and compared with NumPy,
+so even large matrices can be checked quickly and with a tolerance for
+floating point error.
+"""
+
+import re
+import numpy as np
+
+# Matches integers, decimals, scientific notation, nan, and inf
+# Numbers that are part of a word (e.g. the 2 in "x2") are ignored
+NUMBER_PATTERN = re.compile(
+    r"(?<![A-Za-z_0-9.])[-+]?"
+    r"(?:(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|nan|inf(?:inity)?)"
+    r"(?![A-Za-z_0-9])",
+    re.IGNORECASE,
+)
+
+
+def parse_numbers(text: str, shape: tuple = None) -> np.ndarray:
+    """
+    Returns all the numbers found in the text as a NumPy array of floats
+
+    text -  string to pull the numbers from (usually the student's output)
+    shape - The shape the numbers should be put into, e.g. (3, 3) for a
+            3x3 matrix. If None, then a 1D array is returned.
+            Raises a ValueError if the amount of numbers doesn't fit the shape
+    """
+    try:
+        # Fast path for output that is only numbers separated by whitespace,
+        # which is the usual case for printed vectors and matrices
+        numbers = np.array(text.split(), dtype=np.float64)
+    except ValueError:
+        # There are words or punctuation mixed in with the numbers
+        numbers = np.array(NUMBER_PATTERN.findall(text), dtype=np.float64)
+    if shape is not None:
+        numbers = numbers.reshape(shape)
+    return numbers
+
+
+def numbers_mismatched(
+    expected, actual, rtol=1e-6, atol=1e-9, equal_nan=True
+) -> np.ndarray:
+    """
+    Compares two arrays of numbers element by element and returns the
+    locations of the numbers that don't match. Use `check_numbers` if you want
+    built-in error messages and hints.
+
+    expected -  array-like of the expected numbers
+    actual -    array-like of the numbers given by the student
+                Must have the same shape as expected
+    rtol -      relative tolerance (see numpy.isclose)
+    atol -      absolute tolerance (see numpy.isclose)
+    equal_nan - Whether nan should be treated as equal to nan
+
+    returns an array with one row per mismatch containing its index
+    e.g. [[0, 2], [1, 1]] means (0, 2) and (1, 1) did not match
+    """
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    close = np.isclose(
+        actual, expected, rtol=rtol, atol=atol, equal_nan=equal_nan
+    )
+    return np.argwhere(~close)
+
+
+def check_numbers(
+    expected,
+    mother_string: str,
+    rtol=1e-6,
+    atol=1e-9,
+    equal_nan=True,
+    hint_level=1,
+    max_reported=5,
+) -> str:
+    """
+    Checks that the numbers in the output match the expected numbers
+
+    :param expected         array-like of the numbers that should be in the
+                            mother_string. Its shape is used to arrange the
+                            numbers found (e.g. a list of lists for a matrix)
+
+    :param mother_string    The string that is expected to contain only the
+                            expected numbers (usually the student's output or
+                            a section of it)
+
+    :param rtol, atol       The relative and absolute tolerances used when
+                            comparing (see numpy.isclose)
+
+    :param equal_nan        Whether nan should be treated as equal to nan
+
+    :param hint_level       How much of a hint should be given in the error
+                            message
+                            0 = Only the word "fail" will be returned if
+                                something doesn't match
+                            1 = Will tell the number of values that were
+                                wrong out of how many were expected
+                            2 = Will also give the locations and the student's
+                                values for the first few mismatches
+                            3 = Will also give the expected values for those
+                                mismatches
+                                WARNING - will reveal the expected answer
+
+    :param max_reported     The most mismatches to list at hint level 2 or 3
+
+    :returns                An empty string if all the numbers match, and an
+                            error message otherwise.
+                            This error message should be raised as an
+                            AssertionError in your unit testing script if
+                            it's not empty
+    """
+
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = parse_numbers(mother_string)
+
+    if actual.size != expected.size:
+        msg = "Fail\n\n"
+        if hint_level >= 1:
+            msg += (
+                f"Expected {expected.size} numbers, but found {actual.size}."
+                " Reference the sample output and double check the"
+                " directions."
+            )
+        return msg
+
+    actual = actual.reshape(expected.shape)
+    mismatches = numbers_mismatched(expected, actual, rtol, atol, equal_nan)
+
+    # Everything matched
+    if len(mismatches) == 0:
+        return ""
+
+    msg = "Fail\n\n"
+    if hint_level >= 1:
+        msg += (
+            f"{len(mismatches)} out of the {expected.size} numbers were"
+            " wrong."
+        )
+    if hint_level >= 2:
+        msg += "\n\nThe first mismatches were at:\n"
+        for location in mismatches[:max_reported]:
+            index = tuple(int(i) for i in location)
+            msg += f"  {index}: you gave {actual[index]:g}"
+            if hint_level >= 3:
+                msg += f", expected {expected[index]:g}"
+            msg += "\n"
+
+    return msg
@@ -4,16 +4,77 @@ This file contains functions to parse and use entities from C and C++ files
 
 from clang.cindex import Cursor, CursorKind, Index, TranslationUnit
 
-
-def parse_file(input_filename: str) -> TranslationUnit:
+# Kinds of cursors that hold a function's code
+FUNCTION_KINDS = (
+    CursorKind.FUNCTION_DECL,
+    CursorKind.CXX_METHOD,
+    CursorKind.CONSTRUCTOR,
+    CursorKind.DESTRUCTOR,
+    CursorKind.FUNCTION_TEMPLATE,
+)
+# Kinds of cursors that can have functions inside of them
+CONTAINER_KINDS = (
+    CursorKind.NAMESPACE,
+    CursorKind.CLASS_DECL,
+    CursorKind.STRUCT_DECL,
+    CursorKind.CLASS_TEMPLATE,
+)
+
+
+def parse_file(input_filename: str, args: list[str] = None) -> TranslationUnit:
     """
     Return the TranslationUnit for the given file
+
+    args - Extra compiler arguments, e.g. ["-x", "c++"]
     """
 
     # init Index to parse file
     index = Index.create()
 
-    return index.parse(input_filename)
+    return index.parse(input_filename, args=args)
+
+
+def function_definitions(cursor: Cursor, file_name: str):
+    """
+    Yields the cursor of every function defined in the file, including
+    methods inside classes and namespaces
+    """
+    for child in cursor.get_children():
+        # Skipping what was included from other files
+        location = child.location.file
+        if location is None or location.name != file_name:
+            continue
+        if child.kind in FUNCTION_KINDS and child.is_definition():
+            yield child
+        elif child.kind in CONTAINER_KINDS:
+            yield from function_definitions(child, file_name)
+
+
+def qualified_name(cursor: Cursor) -> str:
+    """
+    Returns the function's name with its classes and namespaces,
+    e.g. "List::push_back"
+    """
+    names = [cursor.spelling]
+    parent = cursor.semantic_parent
+    while parent is not None and parent.kind in CONTAINER_KINDS:
+        names.append(parent.spelling)
+        parent = parent.semantic_parent
+    return "::".join(reversed(names))
+
+
+def defined_functions(
+    input_filename: str, args: list[str] = None
+) -> list[str]:
+    """
+    Returns the qualified names of the functions defined in the file,
+    e.g. ["main", "List::push_back"]
+    """
+    unit = parse_file(input_filename, args)
+    return [
+        qualified_name(cursor)
+        for cursor in function_definitions(unit.cursor, input_filename)
+    ]
 
 
 def find_entities(
@@ -118,7 +179,9 @@ def get_direct_include_offsets(tu: TranslationUnit) -> tuple[int, ...]:
     )
 
 
-def get_global_ranges(node: Cursor) -> list[tuple[int, int, str]]:
+def get_global_ranges(
+    node: Cursor, file_contents: str = ""
+) -> list[tuple[int, int, str]]:
     """
     Get the ranges for required "globals" (global variables and
     namespace declaration/directives)
@@ -138,14 +201,19 @@ def get_global_ranges(node: Cursor) -> list[tuple[int, int, str]]:
             found_entities.append(child)
 
     # store entity ranges for found requested entities
-    entity_ranges = map(get_cursor_range, found_entities)
+    entity_ranges = [
+        get_cursor_range(entity, file_contents) for entity in found_entities
+    ]
 
     # return ranges sorted by start position
     return sorted(entity_ranges, key=lambda x: x[0])
 
 
 def get_function_ranges(
-    cursor: Cursor, include_calls: bool, *function_names: str
+    cursor: Cursor,
+    include_calls: bool,
+    *function_names: str,
+    file_contents: str = ""
 ) -> list[tuple[int, int]]:
     """
     Get the ranges for supplied functions
@@ -158,7 +226,10 @@ def get_function_ranges(
     )
 
     # store entity ranges for found requested functions
-    function_ranges = map(get_cursor_range, found_functions)
+    function_ranges = [
+        get_cursor_range(function, file_contents)
+        for function in found_functions
+    ]
 
     # return ranges sorted by start position
     return sorted(function_ranges, key=lambda x: x[0])
@@ -176,8 +247,13 @@ def extract_functions(
     """
 
     unit = parse_file(input_filename)
+    with open(input_filename, "r") as input_file:
+        file_contents = input_file.read()
     function_ranges = get_function_ranges(
-        unit.cursor, include_calls, *function_names
+        unit.cursor,
+        include_calls,
+        *function_names,
+        file_contents=file_contents
     )
 
     contents = []
@@ -188,7 +264,7 @@ def extract_functions(
                 input_file.seek(offset)
                 contents.append("#include " + input_file.readline().strip())
 
-        for offset, length in get_global_ranges(unit.cursor):
+        for offset, length in get_global_ranges(unit.cursor, file_contents):
             input_file.seek(offset)
             contents.append(input_file.read(length) + ";")
 
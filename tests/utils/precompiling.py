@@ -0,0 +1,213 @@
+"""
+This file contains functions for compiling the drivers and commonly used
+headers once when the autograder's docker image is built, and for using the
+results when compiling during testing
+
+Drivers that can't be compiled on their own (e.g. because they include one of
+the student's headers) are skipped and compiled as usual during testing.
+"""
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import utils.common as common
+
+MANIFEST_NAME = "manifest.json"
+HEADER_NAME = "precompiled.h"
+COMMON_HEADERS = ["<iostream>", "<vector>", "<string>"]
+CPP_EXTENSIONS = (".cpp", ".cc", ".cxx", ".C")
+C_EXTENSIONS = (".c",)
+CPP_COMPILERS = ("g++", "c++")
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _codegen_flags(compilation_args: list[str]) -> list[str]:
+    """
+    Returns the flags that change how code is compiled, so objects are only
+    reused when they were built the same way. Warning flags, linker flags,
+    and the output file are ignored.
+    """
+    flags = []
+    skip_next = False
+    for arg in compilation_args[1:]:
+        if skip_next:
+            skip_next = False
+        elif arg == "-o":
+            skip_next = True
+        elif arg.startswith("-") and not arg.startswith(
+            ("-W", "-l", "-L", "-o")
+        ):
+            flags.append(arg)
+    return flags
+
+
+def precompile_drivers(
+    drivers_dir: str = None,
+    output_dir: str = None,
+    flags: list[str] = None,
+    headers: list[str] = None,
+) -> list[str]:
+    """
+    Compiles every C/C++ driver into an object file and builds a precompiled
+    header for the common standard library headers. Meant to be run by
+    setup.sh when the image is built.
+
+    drivers_dir -   Directory containing the drivers.
+                    Default is the tests/drivers directory
+    output_dir -    Where the objects and precompiled header are stored.
+                    Default is common.PRECOMPILED_DIR
+    flags -         Extra compilation flags, e.g. ["-std=c++17"]. Objects
+                    are only used during testing when the same flags are
+                    given to compile_and_run
+    headers -       Headers to precompile. Default is COMMON_HEADERS
+
+    returns the names of the drivers that were precompiled
+    """
+    drivers_dir = os.path.abspath(
+        drivers_dir or os.path.join(common.TESTS_DIR, "drivers")
+    )
+    output_dir = output_dir or common.PRECOMPILED_DIR
+    flags = flags or []
+    headers = headers or COMMON_HEADERS
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Only root can read the objects, so the student can't get the drivers
+    os.chmod(output_dir, 0o700)
+
+    manifest = {"flags": flags, "header": None, "drivers": {}}
+
+    header_path = os.path.join(output_dir, HEADER_NAME)
+    with open(header_path, "w") as f:
+        f.write("".join(f"#include {header}\n" for header in headers))
+    header = subprocess.run(
+        ["g++", "-x", "c++-header", *flags, header_path]
+        + ["-o", header_path + ".gch"],
+        stderr=subprocess.PIPE,
+    )
+    if header.returncode == 0:
+        manifest["header"] = header_path
+    else:
+        print("Could not precompile headers:", header.stderr.decode("utf-8"))
+
+    for driver in sorted(os.listdir(drivers_dir)):
+        driver_path = os.path.join(drivers_dir, driver)
+        if driver.endswith(CPP_EXTENSIONS):
+            compiler = "g++"
+        elif driver.endswith(C_EXTENSIONS):
+            compiler = "gcc"
+        else:
+            continue
+
+        object_path = os.path.join(
+            output_dir, os.path.splitext(driver)[0] + ".o"
+        )
+        compiled = subprocess.run(
+            [compiler, "-c", *flags, driver_path, "-o", object_path],
+            cwd=drivers_dir,
+            stderr=subprocess.PIPE,
+        )
+        if compiled.returncode != 0:
+            # Usually because it needs the student's files to compile
+            print(f"Skipping {driver}, it will be compiled during testing")
+            continue
+
+        manifest["drivers"][driver] = {
+            "object": object_path,
+            "sha256": _file_hash(driver_path),
+        }
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    for file in os.listdir(output_dir):
+        os.chmod(os.path.join(output_dir, file), 0o600)
+
+    return list(manifest["drivers"])
+
+
+def _included_headers(path: str) -> set[str]:
+    """
+    Returns the <...> headers the source file includes itself, e.g.
+    {"<vector>"}
+    """
+    try:
+        with open(path, "r", errors="replace") as f:
+            source = f.read()
+    except OSError:
+        return set()
+    return {
+        f"<{name}>"
+        for name in re.findall(r"^\s*#\s*include\s*<([^>]+)>", source, re.M)
+    }
+
+
+def load_manifest(output_dir: str = None) -> dict:
+    """
+    Returns the manifest written by precompile_drivers, or None if the
+    drivers were not precompiled
+    """
+    output_dir = output_dir or common.PRECOMPILED_DIR
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, PermissionError, json.JSONDecodeError):
+        return None
+
+
+def use_precompiled(compilation_args: list[str]) -> list[str]:
+    """
+    Returns a copy of the compilation arguments that links against any
+    precompiled driver objects and includes the precompiled header.
+    The arguments are returned unchanged if nothing precompiled applies.
+
+    The header is only included when every source being compiled already
+    includes all of its headers, so code that forgot an #include still fails
+    to compile like it would with the student's own makefile.
+
+    compilation_args -  List of strings to use to compile
+                        e.g. ["g++", "exampleDriver.cpp", "studentFuncs.cpp",
+                              "-o", "exampleDriver.out"]
+    """
+    manifest = load_manifest()
+    if (
+        manifest is None
+        or len(compilation_args) == 0
+        or _codegen_flags(compilation_args) != manifest["flags"]
+    ):
+        return list(compilation_args)
+
+    new_args = [compilation_args[0]]
+    sources = []
+    for arg in compilation_args[1:]:
+        driver = manifest["drivers"].get(os.path.basename(arg))
+        if (
+            driver is not None
+            and "-c" not in compilation_args
+            and os.path.isfile(arg)
+            and _file_hash(arg) == driver["sha256"]
+        ):
+            # The driver hasn't changed since it was precompiled
+            new_args.append(driver["object"])
+            continue
+        if arg.endswith(CPP_EXTENSIONS + C_EXTENSIONS):
+            sources.append(arg)
+        new_args.append(arg)
+
+    # The precompiled header only works when every remaining source is C++
+    if (
+        manifest["header"] is not None
+        and len(sources) > 0
+        and all(source.endswith(CPP_EXTENSIONS) for source in sources)
+        and os.path.basename(compilation_args[0]) in CPP_COMPILERS
+    ):
+        headers = _included_headers(manifest["header"])
+        if all(headers <= _included_headers(source) for source in sources):
+            new_args[1:1] = ["-include", manifest["header"]]
+
+    return new_args
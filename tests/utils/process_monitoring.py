@@ -0,0 +1,359 @@
+"""
+This file contains functions for telling when a running program is stuck,
+e.g. waiting for input that will never come or deadlocked on a lock, instead
+of busy computing something.
+
+It looks at what the program's processes and threads are doing through
+/proc/<pid>/task/<tid>/stat, wchan, and syscall. A program is stuck when
+none of its threads are running, none of them are just sleeping for a while
+(e.g. sleep() or usleep()), and it hasn't used any CPU time for a grace
+period. Only works on Linux. Elsewhere, and when /proc can't be read,
+programs are never considered stuck.
+
+It also has functions for cleaning up after a program. Every program is
+started in its own session, and when it exits or is stopped, everything left
+in its process group is killed too, e.g. processes it forked or a make job
+left running in the background. sweep_user_processes finds the ones that got
+away, by starting their own session, from the processes' owner.
+"""
+
+import os
+import platform
+import pwd
+import signal
+import time
+
+# Seconds a program must be stuck before HangDetector reports it
+DEFAULT_GRACE = 1.0
+# How often, in seconds, a running program is checked on
+POLL_INTERVAL = 0.02
+# Most times sweep_user_processes looks again for processes that were forked
+# while it was killing the others
+SWEEP_PASSES = 5
+
+# Processes sweep_user_processes leaves alone, e.g. the Python server that
+# runs students' scripts for the whole session
+protected_pids = set()
+# How many runs in this process timed out or were stopped for being stuck,
+# so run_tests.py can record which tests had one (and not cache them)
+timed_out_runs = 0
+
+# System call numbers, which differ between architectures
+_SYSCALLS = {
+    "x86_64": {
+        "read": {0, 19, 17, 295},  # read, readv, pread64, preadv
+        "wait_for_events": {7, 23, 232, 270, 271, 281},  # poll, select, ...
+        "sleep": {35, 230},  # nanosleep, clock_nanosleep
+        "pause": {34},  # pause
+        "lock": {202},  # futex
+        "wait_for_child": {61, 247},  # wait4, waitid
+    },
+    "aarch64": {
+        "read": {63, 65, 67, 69},
+        "wait_for_events": {22, 72, 73},
+        "sleep": {101, 115},
+        "pause": set(),
+        "lock": {98},
+        "wait_for_child": {260, 95},
+    },
+}
+_CALLS = _SYSCALLS.get(platform.machine(), {})
+
+# Process states from /proc/<pid>/stat
+_BUSY_STATES = "RDW"  # Running, waiting on the disk, paging
+_STOPPED_STATES = "Tt"
+_EXITING_STATES = "ZXx"
+
+
+def _read(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _stat_fields(path: str) -> list[str]:
+    # The program's name is in parentheses and can contain spaces, so the
+    # fields are read from after the last parenthesis
+    # Index 0 is the state, 11 is utime and 12 is stime
+    return _read(path).rsplit(")", 1)[1].split()
+
+
+def process_tree(pid: int) -> list[int]:
+    """
+    Returns the pid and the pids of all its descendants
+    """
+    pids = [pid]
+    for parent in pids:
+        try:
+            for tid in os.listdir(f"/proc/{parent}/task"):
+                children = _read(f"/proc/{parent}/task/{tid}/children")
+                pids.extend(int(child) for child in children.split())
+        except OSError:
+            # The process exited
+            continue
+    return pids
+
+
+def cpu_ticks(pids: list[int]) -> int:
+    """
+    Returns the total CPU time (in clock ticks) used by the processes
+    """
+    total = 0
+    for pid in pids:
+        try:
+            fields = _stat_fields(f"/proc/{pid}/stat")
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total
+
+
+def _describe_thread(task_dir: str) -> str:
+    """
+    Returns "busy" if the thread is making progress, "ignore" if it is
+    waiting on something else in the program, or why it is stuck
+    """
+    state = _stat_fields(task_dir + "/stat")[0]
+    if state in _BUSY_STATES:
+        return "busy"
+    if state in _EXITING_STATES:
+        return "ignore"
+    if state in _STOPPED_STATES:
+        return "the program was stopped"
+
+    syscall = _read(task_dir + "/syscall").split()
+    if not syscall or syscall[0] == "running":
+        return "busy"
+    number = int(syscall[0])
+    if number == -1:
+        # Blocked, but not in a system call (e.g. a page fault)
+        return "busy"
+    first_argument = int(syscall[1], 16) if len(syscall) > 1 else None
+
+    if number in _CALLS.get("sleep", ()):
+        # Sleeping for a set time will end on its own
+        return "busy"
+    if number in _CALLS.get("wait_for_child", ()):
+        # Its children are checked separately
+        return "ignore"
+    if number in _CALLS.get("read", ()):
+        if first_argument == 0:
+            return "the program was waiting for input that was never given"
+        return "the program was waiting to read from a file or pipe"
+    if number in _CALLS.get("wait_for_events", ()):
+        return "the program was waiting for input or events"
+    if number in _CALLS.get("pause", ()):
+        return "the program was waiting for a signal"
+    if number in _CALLS.get("lock", ()):
+        return "the program was waiting on a lock (possibly a deadlock)"
+
+    wchan = _read(task_dir + "/wchan").strip() or "unknown"
+    return f"the program was blocked (in {wchan})"
+
+
+def hang_reason(pid: int) -> str:
+    """
+    Returns why the process and its descendants are stuck, or None if any of
+    their threads could still make progress
+    """
+    reasons = []
+    for process in process_tree(pid):
+        try:
+            tids = os.listdir(f"/proc/{process}/task")
+        except OSError:
+            continue
+        for tid in tids:
+            try:
+                reason = _describe_thread(f"/proc/{process}/task/{tid}")
+            except FileNotFoundError:
+                # The thread exited
+                continue
+            except (OSError, ValueError, IndexError):
+                # Can't tell what it's doing (e.g. not allowed to read it)
+                return None
+            if reason == "busy":
+                return None
+            if reason != "ignore":
+                reasons.append(reason)
+    return reasons[0] if reasons else None
+
+
+class HangDetector:
+    """
+    Watches a running process and reports when it has been stuck, without
+    using any CPU time, for longer than the grace period
+
+    pid - the process to watch (its descendants are watched too)
+    grace - seconds it must be stuck for before it counts as hung
+    """
+
+    pid: int
+    grace: float
+
+    def __init__(self, pid: int, grace: float = DEFAULT_GRACE):
+        self.pid = pid
+        self.grace = grace
+        self._ticks = None
+        self._stuck_since = None
+
+    def check(self) -> str:
+        """
+        Returns why the process is hung, or None if it isn't (yet)
+        """
+        now = time.monotonic()
+        reason = hang_reason(self.pid)
+        ticks = cpu_ticks(process_tree(self.pid))
+
+        if reason is None or ticks != self._ticks:
+            self._ticks = ticks
+            self._stuck_since = None if reason is None else now
+            return None
+        if self._stuck_since is None:
+            self._stuck_since = now
+        if now - self._stuck_since >= self.grace:
+            return reason
+        return None
+
+
+def has_exited(pid: int) -> bool:
+    """
+    Returns whether the child process has exited, without reaping it, so its
+    pid (and process group) can't be reused until it's waited for
+    """
+    flags = os.WEXITED | os.WNOHANG | os.WNOWAIT
+    return os.waitid(os.P_PID, pid, flags) is not None
+
+
+def kill_group(pid: int) -> None:
+    """
+    Kills every process in the process group led by pid
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def output_exceeded(files, max_bytes: int) -> bool:
+    """
+    Returns whether any of the files a program's output goes to has grown
+    to max_bytes (None is no limit)
+    """
+    return max_bytes is not None and any(
+        os.fstat(file.fileno()).st_size >= max_bytes for file in files
+    )
+
+
+def wait_and_kill_group(
+    process, timeout: float = None, output_files=(), max_output: int = None
+) -> bool:
+    """
+    Waits for a process started with start_new_session=True to finish, or
+    for the timeout to pass. Then kills anything still in its process group
+    and reaps it. Returns whether it timed out, which is also counted in
+    timed_out_runs.
+
+    output_files - the files its output goes to. It's stopped early if one
+                   grows to max_output bytes
+    """
+    global timed_out_runs
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    timed_out = False
+    while not has_exited(process.pid):
+        if deadline is not None and time.monotonic() >= deadline:
+            timed_out = True
+            timed_out_runs += 1
+            break
+        if output_exceeded(output_files, max_output):
+            break
+        time.sleep(POLL_INTERVAL)
+    kill_group(process.pid)
+    process.wait()
+    return timed_out
+
+
+def _environment_has(pid: int, variable: bytes) -> bool:
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            return variable in f.read().split(b"\0")
+    except OSError:
+        return False
+
+
+def _status_fields(pid: int) -> dict[str, str]:
+    lines = _read(f"/proc/{pid}/status").splitlines()
+    return dict(line.split(":\t", 1) for line in lines if ":\t" in line)
+
+
+def _exiting(status: dict[str, str]) -> bool:
+    # Processes that already exited are only waiting to be reaped, and ones
+    # that were just killed (e.g. with their group) may not have exited yet
+    if status.get("State", "R")[0] in _EXITING_STATES:
+        return True
+    kill_bit = 1 << (signal.SIGKILL - 1)
+    return any(
+        int(status.get(pending, "0"), 16) & kill_bit
+        for pending in ("SigPnd", "ShdPnd")
+    )
+
+
+def user_processes(user: str = "student", environment: str = None) -> list:
+    """
+    Returns the pids of the user's running processes, except protected_pids
+
+    environment - Only include processes with this "NAME=value" in their
+                  environment, e.g. to leave out processes of other
+                  submissions that batch_grade.py is grading at the same time
+    """
+    try:
+        uid = pwd.getpwnam(user).pw_uid
+    except KeyError:
+        return []
+    variable = None if environment is None else environment.encode()
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) in protected_pids:
+            continue
+        try:
+            status = _status_fields(int(entry))
+        except OSError:
+            continue
+        if int(status["Uid"].split()[1]) != uid or _exiting(status):
+            continue
+        if variable is None or _environment_has(int(entry), variable):
+            pids.append(int(entry))
+    return pids
+
+
+def _describe_process(pid: int) -> str:
+    try:
+        command = _read(f"/proc/{pid}/cmdline").replace("\0", " ").strip()
+    except OSError:
+        command = ""
+    return f"{pid} ({command or '?'})"
+
+
+def sweep_user_processes(
+    user: str = "student", environment: str = None
+) -> list[str]:
+    """
+    Kills every process the user still has running, e.g. ones a program
+    started in the background that outlived it, so they can't slow down the
+    next tests. Returns a "pid (command)" for each one that was killed.
+
+    environment - See user_processes
+    """
+    killed = []
+    for _ in range(SWEEP_PASSES):
+        pids = user_processes(user, environment)
+        if not pids:
+            break
+        killed.extend(_describe_process(pid) for pid in pids)
+        # Stopping them all first, so they can't fork while being killed
+        for signal_number in (signal.SIGSTOP, signal.SIGKILL):
+            for pid in pids:
+                try:
+                    os.kill(pid, signal_number)
+                except ProcessLookupError:
+                    pass
+    return killed
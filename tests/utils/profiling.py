@@ -0,0 +1,427 @@
+"""
+This file contains functions for measuring how much memory and how many
+instructions a student's program uses, and scoring it against a reference
+solution.
+
+The peak memory of any run can be measured with
+run_program(..., measure_memory=True). For a closer look at the heap,
+measure_heap runs the program under valgrind's massif tool.
+
+Timing a program is noisy on shared machines, so count_instructions runs it
+under valgrind's callgrind tool instead, which counts the instructions each
+function ran. The same program and input give the same counts on every run.
+Both need valgrind to be installed (see setup.sh).
+"""
+
+import os
+import shutil
+import tempfile
+import utils.common as common
+import utils.driver_running as driver_running
+
+
+class HeapProfile:
+    """
+    peak_heap_bytes - most bytes the program had allocated at once
+    peak_extra_bytes - allocator overhead (headers, alignment) at that time
+    snapshots - how many snapshots massif took
+    timed_out - True if the program was stopped before finishing
+    """
+
+    peak_heap_bytes: int
+    peak_extra_bytes: int
+    snapshots: int
+    timed_out: bool
+
+    def __init__(
+        self,
+        peak_heap_bytes: int,
+        peak_extra_bytes: int,
+        snapshots: int,
+        timed_out: bool,
+    ):
+        self.peak_heap_bytes = peak_heap_bytes
+        self.peak_extra_bytes = peak_extra_bytes
+        self.snapshots = snapshots
+        self.timed_out = timed_out
+
+    @property
+    def peak_kb(self) -> float:
+        """
+        The peak heap use including overhead in kilobytes, so it can be
+        compared with Submission.peak_memory_kb and used with memory_score
+        """
+        return (self.peak_heap_bytes + self.peak_extra_bytes) / 1024
+
+
+def _parse_massif(path: str) -> tuple[int, int, int]:
+    """
+    Returns the peak heap bytes, the extra bytes at that peak, and the
+    number of snapshots from a massif output file
+    """
+    peak_heap, peak_extra, snapshots = 0, 0, 0
+    heap = 0
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("mem_heap_B="):
+                heap = int(line.split("=")[1])
+            elif line.startswith("mem_heap_extra_B="):
+                extra = int(line.split("=")[1])
+                snapshots += 1
+                if heap + extra > peak_heap + peak_extra:
+                    peak_heap, peak_extra = heap, extra
+    return peak_heap, peak_extra, snapshots
+
+
+def measure_heap(
+    executable: str, txt_contents: str = None, timeout: float = 30
+) -> HeapProfile:
+    """
+    Runs the executable as the student user under valgrind massif and
+    returns its HeapProfile, or None if massif didn't produce a profile
+    (e.g. valgrind isn't installed)
+
+    Programs run 20-50 times slower under valgrind, so use a small input.
+
+    executable -    Name or path of the executable, e.g. "Program.out"
+    txt_contents -  The user input, separated by newlines
+    timeout -   How many seconds the program can run under valgrind
+    """
+    valgrind = shutil.which("valgrind")
+    if valgrind is None:
+        common.ta_print(
+            "valgrind couldn't be run, so the heap wasn't measured"
+        )
+        return None
+    if "/" not in executable:
+        executable = "./" + executable
+
+    # The student user has to be able to write the profile
+    descriptor, out_file = tempfile.mkstemp(
+        prefix="massif-", suffix=".out", dir=common.WORK_DIR
+    )
+    os.close(descriptor)
+    os.chmod(out_file, 0o666)
+
+    # Run like any other program, in its own session, so anything it forks
+    # is killed with it at the timeout
+    try:
+        run = driver_running.run_program(
+            valgrind,
+            txt_contents=txt_contents,
+            timeout=timeout,
+            hang_grace=None,
+            args=[
+                "--tool=massif",
+                "--massif-out-file=" + out_file,
+                executable,
+            ],
+        )
+        peak_heap, peak_extra, snapshots = _parse_massif(out_file)
+    finally:
+        os.remove(out_file)
+
+    if snapshots == 0:
+        return None
+    return HeapProfile(peak_heap, peak_extra, snapshots, run.timed_out)
+
+
+class FunctionCost:
+    """
+    name - the function's name as callgrind reports it, e.g. "add(int, int)"
+    self_instructions - instructions run in the function itself
+    inclusive_instructions - instructions run in the function and the
+                             functions it called
+    calls - how many times it was called
+    """
+
+    name: str
+    self_instructions: int
+    inclusive_instructions: int
+    calls: int
+
+    def __init__(
+        self,
+        name: str,
+        self_instructions: int = 0,
+        inclusive_instructions: int = 0,
+        calls: int = 0,
+    ):
+        self.name = name
+        self.self_instructions = self_instructions
+        self.inclusive_instructions = inclusive_instructions
+        self.calls = calls
+
+
+def _base_name(name: str) -> str:
+    # "List::push_back(int const&)" -> "List::push_back"
+    return name.split("(", 1)[0].strip()
+
+
+class InstructionProfile:
+    """
+    total - instructions the whole program ran, including the C++ runtime
+            and libraries
+    functions - dict of each function's name to its FunctionCost
+    timed_out - True if the program was stopped before finishing, so the
+                counts are only for part of the run
+    """
+
+    total: int
+    functions: dict[str, FunctionCost]
+    timed_out: bool
+
+    def __init__(
+        self, total: int, functions: dict[str, FunctionCost], timed_out: bool
+    ):
+        self.total = total
+        self.functions = functions
+        self.timed_out = timed_out
+
+    def function_instructions(self, name: str) -> int:
+        """
+        Returns the inclusive instructions of every function with this name
+        (e.g. "insertion_sort" or "List::push_back"), adding up overloads.
+        A function that calls itself is only counted once per outer call.
+        """
+        return sum(
+            cost.inclusive_instructions
+            for function, cost in self.functions.items()
+            if _base_name(function) == name
+        )
+
+    def student_functions(
+        self, source_files: list[str], args: list[str] = None
+    ) -> dict[str, int]:
+        """
+        Returns the inclusive instructions of each function defined in the
+        student's source files (found with utils.parsing), by name. Functions
+        that were never called aren't included.
+
+        source_files - e.g. ["studentFuncs.cpp", "List.cpp"]
+        args - Extra compiler arguments for parsing, e.g. ["-x", "c++"]
+        """
+        # Imported here so only this needs libclang
+        import utils.parsing as parsing
+
+        names = {}
+        for path in source_files:
+            for name in parsing.defined_functions(path, args):
+                names[name] = None
+        costs = {name: self.function_instructions(name) for name in names}
+        return {name: cost for name, cost in costs.items() if cost}
+
+
+def _callgrind_name(value: str, names: dict) -> str:
+    # Names can be compressed to "(id) name" the first time and "(id)" after
+    value = value.strip()
+    if not value.startswith("("):
+        return value
+    key, _, name = value.partition(")")
+    if name.strip():
+        names[key] = name.strip()
+    return names.get(key, value)
+
+
+def _parse_callgrind(path: str) -> tuple[int, dict[str, FunctionCost]]:
+    """
+    Returns the total instructions and each function's FunctionCost from a
+    callgrind output file
+    """
+    total = None
+    functions = {}
+    names = {}
+    function = callee = None
+    call_count = None
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            if line.startswith("fn="):
+                name = _callgrind_name(line[3:], names)
+                function = functions.setdefault(name, FunctionCost(name))
+            elif line.startswith("cfn="):
+                name = _callgrind_name(line[4:], names)
+                callee = functions.setdefault(name, FunctionCost(name))
+            elif line.startswith("calls="):
+                call_count = int(line[6:].split()[0])
+            elif line[:1].isdigit() or line[:1] in "+-*":
+                fields = line.split()
+                cost = int(fields[1]) if len(fields) > 1 else 0
+                if function is None:
+                    continue
+                if call_count is not None:
+                    # The line after calls= is the inclusive cost of the call
+                    callee.calls += call_count
+                    if callee is not function:
+                        function.inclusive_instructions += cost
+                    call_count = None
+                else:
+                    function.self_instructions += cost
+                    function.inclusive_instructions += cost
+            elif line.startswith(("totals:", "summary:")):
+                total = int(line.split()[1])
+    if total is None:
+        total = sum(cost.self_instructions for cost in functions.values())
+    return total, functions
+
+
+def count_instructions(
+    executable: str,
+    txt_contents: str = None,
+    input_file: str = None,
+    timeout: float = 60,
+    args: list[str] = (),
+    user: str = "student",
+) -> InstructionProfile:
+    """
+    Runs the executable under valgrind callgrind and returns its
+    InstructionProfile, or None if callgrind didn't produce a profile (e.g.
+    valgrind isn't installed)
+
+    Programs run 50-100 times slower under callgrind, so use a small input.
+
+    executable -    Name or path of the executable, e.g. "Program.out"
+    txt_contents -  The user input, separated by newlines
+    input_file -    Path of a file with the user input
+    timeout -   How many seconds the program can run under callgrind
+    args -  Command line arguments given to the program
+    user -  The user to run it as. Use "root" for the reference solution if
+            the student can't read it
+    """
+    valgrind = shutil.which("valgrind")
+    if valgrind is None:
+        common.ta_print(
+            "valgrind couldn't be run, so instructions weren't counted"
+        )
+        return None
+    if "/" not in executable:
+        executable = "./" + executable
+
+    # The user running the program has to be able to write the profile
+    descriptor, out_file = tempfile.mkstemp(
+        prefix="callgrind-", suffix=".out", dir=common.WORK_DIR
+    )
+    os.close(descriptor)
+    os.chmod(out_file, 0o666)
+
+    try:
+        run = driver_running.run_program(
+            valgrind,
+            input_file=input_file,
+            txt_contents=txt_contents,
+            timeout=timeout,
+            hang_grace=None,
+            user=user,
+            args=[
+                "--tool=callgrind",
+                "--callgrind-out-file=" + out_file,
+                "--compress-strings=no",
+                "--compress-pos=no",
+                executable,
+            ]
+            + list(args),
+        )
+        total, functions = _parse_callgrind(out_file)
+    finally:
+        os.remove(out_file)
+
+    if not functions:
+        return None
+    return InstructionProfile(total, functions, run.timed_out)
+
+
+def _ratio_score(
+    ratio: float,
+    points: float,
+    full_credit_ratio: float,
+    no_credit_ratio: float,
+) -> float:
+    """
+    Returns the points earned for using ratio times the reference's amount
+    """
+    if ratio <= full_credit_ratio:
+        fraction = 1.0
+    elif ratio >= no_credit_ratio:
+        fraction = 0.0
+    else:
+        fraction = (no_credit_ratio - ratio) / (
+            no_credit_ratio - full_credit_ratio
+        )
+    return round(points * fraction, 2)
+
+
+def memory_score(
+    student_kb: float,
+    reference_kb: float,
+    points: float,
+    full_credit_ratio: float = 1.5,
+    no_credit_ratio: float = 4.0,
+) -> float:
+    """
+    Returns how many of the points a program earns for its memory use,
+    compared to the reference solution's. Give the result to set_score in
+    a @partial_credit test. The details are sent to ta_print.
+
+    Using up to full_credit_ratio times the reference's memory earns all the
+    points, and using no_credit_ratio times or more earns none. In between,
+    the score goes down linearly.
+
+    student_kb -    The student's peak memory, e.g. submission.peak_memory_kb.
+                    None (the program timed out or was stopped for being
+                    stuck, so it wasn't measured) earns no points
+    reference_kb -  The reference solution's peak memory for the same input
+    points -    The most points the test can give
+    """
+    if student_kb is None:
+        common.ta_print(
+            "Memory wasn't measured, since the program timed out or was "
+            "stopped for being stuck -> 0/" + str(points)
+        )
+        return 0
+    if reference_kb is None or reference_kb <= 0:
+        common.ta_print(
+            f"Memory couldn't be compared: student {student_kb} KB, but "
+            f"the reference solution's memory is {reference_kb} KB"
+        )
+        return 0
+
+    ratio = student_kb / reference_kb
+    score = _ratio_score(ratio, points, full_credit_ratio, no_credit_ratio)
+    common.ta_print(
+        f"Memory: student {student_kb:.0f} KB, reference {reference_kb:.0f} KB"
+        f" ({ratio:.2f}x) -> {score}/{points}"
+    )
+    return score
+
+
+def instruction_score(
+    student_instructions: int,
+    reference_instructions: int,
+    points: float,
+    full_credit_ratio: float = 1.5,
+    no_credit_ratio: float = 4.0,
+) -> float:
+    """
+    Returns how many of the points a program earns for the instructions it
+    ran, compared to the reference solution's, like memory_score. Since the
+    counts don't change between runs, neither does the score.
+
+    student_instructions -  e.g. profile.total, or
+                            profile.function_instructions("sort")
+    reference_instructions -    The reference's count for the same input
+    points -    The most points the test can give
+    """
+    if not student_instructions or not reference_instructions:
+        common.ta_print(
+            "Instructions couldn't be compared:",
+            f"student {student_instructions}, "
+            f"reference {reference_instructions}",
+        )
+        return 0
+
+    ratio = student_instructions / reference_instructions
+    score = _ratio_score(ratio, points, full_credit_ratio, no_credit_ratio)
+    common.ta_print(
+        f"Instructions: student {student_instructions:,}, reference "
+        f"{reference_instructions:,} ({ratio:.2f}x) -> {score}/{points}"
+    )
+    return score
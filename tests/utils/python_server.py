@@ -0,0 +1,329 @@
+"""
+This file contains a faster way to run students' Python programs many times.
+
+Starting Python and importing modules like numpy or pandas can take longer
+than the student's program itself. A PythonServer starts one Python process
+as the student, imports the common modules once, and then forks a copy of
+itself for each run. Each copy gets its own stdin, stdout, and stderr, runs
+in its own session with resource limits, and runs the student's script as
+__main__. Runs only cost a fork instead of starting Python again.
+
+Only works on Linux.
+"""
+
+import atexit
+import json
+import math
+import select
+import socket
+import subprocess
+import tempfile
+import time
+import utils.common as common
+import utils.driver_running as driver_running
+import utils.process_monitoring as process_monitoring
+
+# Modules imported once by the server, so runs don't have to import them.
+# Modules that aren't installed are skipped
+DEFAULT_PRELOAD = ("numpy", "pandas")
+# Longest the server can take to start and import its modules
+STARTUP_TIMEOUT = 60
+
+# Runs in the server, as the student. Waits for run requests on the socket
+# given in argv[1], and forks a child to run each one.
+_SERVER = """
+import json, os, random, resource, runpy, socket, sys, traceback
+
+def run(request, fds):
+    code = 1
+    try:
+        os.setsid()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        for name, value in request["limits"].items():
+            resource.setrlimit(getattr(resource, name), (value, value))
+        os.chdir(request["cwd"])
+        script = request["script"]
+        sys.argv = [script] + request["args"]
+        sys.path[0] = os.path.dirname(os.path.abspath(script))
+        # Forked children would all get the same random numbers otherwise
+        random.seed()
+        if "numpy" in sys.modules:
+            sys.modules["numpy"].random.seed()
+        runpy.run_path(script, run_name="__main__")
+        code = 0
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            code = error.code or 0
+        else:
+            print(error.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code & 0xFF)
+
+connection = socket.socket(fileno=int(sys.argv[1]))
+failed = []
+for name in sys.argv[2:]:
+    try:
+        __import__(name)
+    except Exception:
+        failed.append(name)
+connection.send(json.dumps({"failed": failed}).encode())
+
+while True:
+    try:
+        message, fds, _, _ = socket.recv_fds(connection, 65536, 3)
+    except OSError:
+        break
+    if not message:
+        break
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        connection.close()
+        run(json.loads(message), fds)
+    for fd in fds:
+        os.close(fd)
+    connection.send(json.dumps({"pid": pid}).encode())
+    # Killing anything the script left running before the run is reaped
+    os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    try:
+        os.killpg(pid, 9)
+    except ProcessLookupError:
+        pass
+    _, status, usage = os.wait4(pid, 0)
+    result = {"status": status, "cpu_time": usage.ru_utime + usage.ru_stime}
+    connection.send(json.dumps(result).encode())
+"""
+
+
+class PythonServer:
+    """
+    A Python process that runs students' Python scripts by forking
+
+    preload - names of the modules to import once, before any runs
+    user - the user the server and the scripts run as
+    python - path of the Python to run. It must be able to import the
+             preloaded modules and the student must be allowed to run it
+    """
+
+    preload: tuple[str]
+    user: str
+    python: str
+
+    def __init__(
+        self,
+        preload: tuple[str] = DEFAULT_PRELOAD,
+        user: str = "student",
+        python: str = None,
+    ):
+        self.preload = tuple(preload)
+        self.user = user
+        self.python = python or driver_running._LAUNCHER_PYTHON
+        self._process = None
+        self._connection = None
+
+    def start(self) -> None:
+        """
+        Starts the server and waits until it has imported its modules.
+        run starts it automatically if it isn't running.
+        """
+        self.close()
+        # Each message is kept separate, so none of them need delimiters
+        self._connection, server_end = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET
+        )
+        self._process = subprocess.Popen(
+            [self.python, "-c", _SERVER, str(server_end.fileno())]
+            + list(self.preload),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            user=self.user,
+            start_new_session=True,
+            pass_fds=(server_end.fileno(),),
+        )
+        server_end.close()
+        process_monitoring.protected_pids.add(self._process.pid)
+
+        ready = self._receive(STARTUP_TIMEOUT)
+        if ready is None:
+            self.close()
+            raise RuntimeError("The Python server didn't start")
+        if ready["failed"]:
+            common.ta_print(
+                "The Python server couldn't import "
+                + ", ".join(ready["failed"])
+            )
+
+    def close(self) -> None:
+        """
+        Stops the server. Runs that already finished aren't affected.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._process is not None:
+            process_monitoring.kill_group(self._process.pid)
+            self._process.wait()
+            process_monitoring.protected_pids.discard(self._process.pid)
+            self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _receive(self, timeout: float = None) -> dict:
+        """
+        Returns the next message from the server, or None if it closed or
+        nothing came within the timeout
+        """
+        ready, _, _ = select.select([self._connection], [], [], timeout)
+        if not ready:
+            return None
+        message = self._connection.recv(65536)
+        return json.loads(message) if message else None
+
+    def run(
+        self,
+        script: str,
+        input_file: str = None,
+        txt_contents: str = None,
+        timeout: float = 5,
+        large_output: bool = False,
+        hang_grace: float = process_monitoring.DEFAULT_GRACE,
+        args: list[str] = (),
+        memory_limit_mb: int = None,
+    ) -> driver_running.Submission:
+        """
+        Runs the Python script and returns the same Submission as
+        run_program. Its errors are what the script wrote to stderr, e.g. a
+        traceback.
+
+        script - path of the Python file to run, e.g. "main.py"
+        args -  command line arguments given to the script
+        memory_limit_mb -   Most memory (address space) the script can use,
+                            in MB, including what the preloaded modules use.
+                            None is no limit
+
+        The rest of the arguments are the same as run_program's. The
+        script's CPU time is also limited to about the timeout.
+        """
+        if self._process is None or self._process.poll() is not None:
+            self.start()
+
+        if input_file:
+            with open(input_file, "r") as f:
+                txt_contents = f.read()
+        stdin_file = tempfile.TemporaryFile()
+        if txt_contents is not None:
+            stdin_file.write(txt_contents.encode("utf-8"))
+            stdin_file.seek(0)
+        stdout_file = tempfile.TemporaryFile()
+        stderr_file = tempfile.TemporaryFile()
+
+        limits = {"RLIMIT_FSIZE": common.MAX_OUTPUT_BYTES}
+        if timeout is not None:
+            # Stops a busy script even if the server can't be reached
+            limits["RLIMIT_CPU"] = math.ceil(timeout) + 1
+        if memory_limit_mb is not None:
+            limits["RLIMIT_AS"] = memory_limit_mb * 1024 * 1024
+        request = {
+            "script": script,
+            "args": list(args),
+            "cwd": common.WORK_DIR,
+            "limits": limits,
+        }
+
+        socket.send_fds(
+            self._connection,
+            [json.dumps(request).encode()],
+            [stdin_file.fileno(), stdout_file.fileno(), stderr_file.fileno()],
+        )
+        stdin_file.close()
+        started = self._receive(STARTUP_TIMEOUT)
+        if started is None:
+            self.close()
+            raise RuntimeError("The Python server stopped")
+        pid = started["pid"]
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        detector = None
+        if hang_grace is not None:
+            detector = process_monitoring.HangDetector(pid, hang_grace)
+        timed_out, hang_reason = False, None
+        finished = self._receive(driver_running.POLL_INTERVAL)
+        while finished is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                timed_out = True
+            elif detector is not None:
+                hang_reason = detector.check()
+                timed_out = hang_reason is not None
+            if timed_out:
+                process_monitoring.kill_group(pid)
+                finished = self._receive()
+                break
+            finished = self._receive(driver_running.POLL_INTERVAL)
+        if finished is None:
+            self.close()
+            raise RuntimeError("The Python server stopped")
+        if timed_out:
+            process_monitoring.timed_out_runs += 1
+
+        with stdout_file, stderr_file:
+            common.check_output_size(stdout_file, stderr_file)
+            try:
+                output = common.read_output(stdout_file, large_output)
+                errors = common.read_output(stderr_file)
+            except UnicodeDecodeError:
+                raise AssertionError(
+                    "Could not decode your output to utf-8.\n"
+                    "Make sure you don't output any invalid characters."
+                )
+        return driver_running.Submission(
+            output, errors, timed_out, finished["cpu_time"], None, hang_reason
+        )
+
+
+_server = None
+
+
+def start_server(
+    preload: tuple[str] = DEFAULT_PRELOAD, python: str = None
+) -> PythonServer:
+    """
+    Starts the server that run_python uses, importing the preload modules.
+    Call this before the first run_python to preload other modules. It's
+    stopped when the autograder exits.
+    """
+    global _server
+
+    if _server is not None:
+        _server.close()
+    else:
+        atexit.register(lambda: _server.close())
+    _server = PythonServer(preload, python=python)
+    _server.start()
+    return _server
+
+
+def run_python(script: str, **kwargs) -> driver_running.Submission:
+    """
+    Runs the student's Python script as the student on the session's
+    server, starting it the first time. Takes the same arguments as
+    PythonServer.run.
+
+    e.g. run = utils.run_python("main.py", txt_contents="1\\n2\\n")
+    """
+    if _server is None:
+        start_server()
+    return _server.run(script, **kwargs)
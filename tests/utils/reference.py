@@ -0,0 +1,229 @@
+"""
+This file contains functions for deriving timeouts from how long the
+instructor's reference solution takes on each input, instead of guessing.
+
+Register each input in test.py with register_case, then use timeout_for to
+get its timeout. The reference solution is run on every registered input
+once, when the docker image is built (see setup.sh), and the timeouts are
+saved in calibration.json in the tests directory. If there's no calibration
+for an input, timeout_for returns the default instead.
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import utils.common as common
+import utils.driver_running as driver_running
+
+# Where the reference solution's executable is expected, unless a case says
+# otherwise. The reference directory is only readable by root.
+REFERENCE_EXECUTABLE = os.path.join(
+    common.TESTS_DIR, "reference", "reference.out"
+)
+CALIBRATION_FILE = os.path.join(common.TESTS_DIR, "calibration.json")
+
+# A case's timeout is the reference's CPU time times this, but at least
+# DEFAULT_FLOOR seconds
+DEFAULT_MULTIPLE = 5.0
+DEFAULT_FLOOR = 1.0
+# The reference is run this many times per case and the slowest is used
+DEFAULT_RUNS = 3
+# Longest the reference can take on one input while calibrating
+CALIBRATION_TIMEOUT = 60
+
+_cases = {}
+_calibration = None
+
+
+class Case:
+    """
+    name - what the case is called in calibration.json, e.g. "2.1"
+    txt_contents - the input given to the program, or None
+    input_file - a file to read the input from, or None
+    executable - path of the reference executable to run
+    """
+
+    name: str
+    txt_contents: str
+    input_file: str
+    executable: str
+
+    def __init__(
+        self,
+        name: str,
+        txt_contents: str = None,
+        input_file: str = None,
+        executable: str = None,
+    ):
+        self.name = name
+        self.txt_contents = txt_contents
+        self.input_file = input_file
+        self.executable = executable or REFERENCE_EXECUTABLE
+
+    def fingerprint(self) -> str:
+        """
+        Returns a hash of the reference executable and the input, so the
+        calibration is redone when either changes
+        """
+        digest = hashlib.sha256()
+        with open(self.executable, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        digest.update(b"\0" + (self.txt_contents or "").encode("utf-8"))
+        if self.input_file is not None:
+            with open(self.input_file, "rb") as f:
+                digest.update(b"\0" + f.read())
+        return digest.hexdigest()
+
+
+def register_case(
+    name: str,
+    txt_contents: str = None,
+    input_file: str = None,
+    executable: str = None,
+) -> Case:
+    """
+    Registers an input to calibrate a timeout for. Call this at the top
+    level of test.py (outside the test functions) so the calibration can
+    find it.
+
+    name -  Name used to get the timeout later, e.g. the test's number
+    txt_contents -  The input, separated by newlines
+    input_file -    Path of a file containing the input
+    executable -    Path of the reference executable. Default is
+                    REFERENCE_EXECUTABLE
+    """
+    case = Case(name, txt_contents, input_file, executable)
+    _cases[name] = case
+    return case
+
+
+def load_cases(test_file: str) -> dict:
+    """
+    Imports the test file so its register_case calls run, and returns the
+    registered cases. It's imported from a temporary working directory,
+    since the test classes can move files into the working directory while
+    they're being defined.
+    """
+    work_dir = tempfile.mkdtemp(prefix="cases-")
+    previous_dir = os.getcwd()
+    common.WORK_DIR = work_dir
+    os.chdir(work_dir)
+    try:
+        spec = importlib.util.spec_from_file_location("test", test_file)
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    finally:
+        os.chdir(previous_dir)
+        common.WORK_DIR = common.SOURCE_DIR
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return _cases
+
+
+def _load(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def calibrate(
+    multiple: float = DEFAULT_MULTIPLE,
+    floor: float = DEFAULT_FLOOR,
+    runs: int = DEFAULT_RUNS,
+    path: str = None,
+) -> dict:
+    """
+    Runs the reference executable on every registered case and saves each
+    case's timeout to calibration.json. Cases whose executable and input
+    haven't changed since the last calibration are not run again.
+
+    Returns the calibration, a dict from each case's name to its
+    "cpu_time", "timeout", and "fingerprint".
+
+    multiple -  The timeout is the reference's CPU time times this
+    floor - Shortest timeout in seconds, since very fast programs can be
+            slowed down by anything else running
+    runs -  How many times the reference is run on each case
+    """
+    global _calibration
+
+    path = path or CALIBRATION_FILE
+    previous = _load(path)
+    same_settings = (
+        previous.get("multiple") == multiple and previous.get("floor") == floor
+    )
+    cases = {}
+
+    for name, case in _cases.items():
+        if not os.path.isfile(case.executable):
+            common.ta_print(
+                f"Can't calibrate {name}: {case.executable} doesn't exist"
+            )
+            continue
+
+        fingerprint = case.fingerprint()
+        cached = previous.get("cases", {}).get(name)
+        if cached and same_settings and cached["fingerprint"] == fingerprint:
+            cases[name] = cached
+            continue
+
+        cpu_times = []
+        for _ in range(runs):
+            run = driver_running.run_program(
+                case.executable,
+                input_file=case.input_file,
+                txt_contents=case.txt_contents,
+                timeout=CALIBRATION_TIMEOUT,
+                hang_grace=None,
+                user="root",
+            )
+            if run.timed_out:
+                break
+            cpu_times.append(run.cpu_time)
+
+        if len(cpu_times) < runs:
+            common.ta_print(
+                f"Can't calibrate {name}: the reference took over "
+                f"{CALIBRATION_TIMEOUT} seconds"
+            )
+            continue
+
+        cpu_time = max(cpu_times)
+        cases[name] = {
+            "cpu_time": cpu_time,
+            "timeout": round(max(floor, cpu_time * multiple), 3),
+            "fingerprint": fingerprint,
+        }
+
+    _calibration = {"multiple": multiple, "floor": floor, "cases": cases}
+    with open(path, "w") as f:
+        json.dump(_calibration, f, indent=2, sort_keys=True)
+    # Only root can read it, like the rest of the tests directory
+    os.chmod(path, 0o600)
+    return cases
+
+
+def timeout_for(name: str, default: float = 5) -> float:
+    """
+    Returns the calibrated timeout in seconds for the registered case, or
+    default if it hasn't been calibrated (e.g. there's no reference)
+
+    e.g. utils.run_program("./main.out", txt_contents=text,
+                           timeout=utils.reference.timeout_for("2.1"))
+    """
+    global _calibration
+
+    if _calibration is None:
+        _calibration = _load(CALIBRATION_FILE)
+
+    entry = _calibration.get("cases", {}).get(name)
+    if entry is None:
+        common.ta_print(
+            f"No calibrated timeout for {name}, using {default} seconds"
+        )
+        return default
+    return entry["timeout"]
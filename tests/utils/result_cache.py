@@ -0,0 +1,263 @@
+"""
+This file contains a cache of test results, so regrading a submission only
+runs the test classes that changed.
+
+Each test class's results are stored under a key made from hashing:
+
+* every file in the submission directory
+* the class's source, its base classes' sources, the setup class's
+  source, and the rest of its test file (helper functions, constants), but
+  not the other test classes
+* everything else in the tests directory, e.g. the drivers, io_files, utils,
+  and the golden outputs, and run_tests.py
+
+If none of those changed since the class last ran, run_tests.py reuses its
+results instead of compiling and running anything. The cache is a directory
+with one JSON file per key, so several graders can share it.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import unittest
+import utils.common as common
+
+# Where results are cached. batch_grade.py keeps one for the whole batch.
+# Otherwise results are only cached if this directory was shipped with the
+# autograder. Set it to "" to turn caching off
+CACHE_DIR = os.environ.get(
+    "AUTOGRADER_RESULT_CACHE", os.path.join(common.TESTS_DIR, "result_cache")
+)
+# Files in the tests directory that change between runs or are hashed per
+# test class instead
+_SKIPPED_NAMES = {
+    "__pycache__",
+    "ta_print.txt",
+    "test_history.json",
+    os.path.basename(CACHE_DIR),
+}
+
+
+def _hash_tree(hasher, directory: str, skip=lambda path: False) -> None:
+    """
+    Adds the names and contents of every file in the directory to the hash
+    """
+    for root, directories, files in os.walk(directory):
+        directories[:] = sorted(
+            name
+            for name in directories
+            if name not in _SKIPPED_NAMES
+            and not skip(os.path.join(root, name))
+        )
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name in _SKIPPED_NAMES or skip(path):
+                continue
+            hasher.update(os.path.relpath(path, directory).encode() + b"\0")
+            file_hasher = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    file_hasher.update(chunk)
+            hasher.update(file_hasher.digest())
+
+
+def _shared_digest(test_files: set[str]) -> bytes:
+    """
+    Hashes the submission, run_tests.py, and the tests directory without
+    the test files
+    """
+    hasher = hashlib.sha256()
+    _hash_tree(hasher, common.SUBMISSION_DIR)
+    hasher.update(b"\0tests\0")
+    _hash_tree(hasher, common.TESTS_DIR, lambda path: path in test_files)
+    run_tests = os.path.join(common.SOURCE_DIR, "run_tests.py")
+    if os.path.isfile(run_tests):
+        with open(run_tests, "rb") as f:
+            hasher.update(hashlib.sha256(f.read()).digest())
+    return hasher.digest()
+
+
+def class_source(test_class: type) -> str:
+    """
+    Returns the test file's source without the test classes in it that the
+    class doesn't extend, followed by the source of the test classes it
+    extends from other files, or None if the source can't be found
+    """
+    module = inspect.getmodule(test_class)
+    try:
+        source = inspect.getsource(module)
+        for _, other in inspect.getmembers(module, inspect.isclass):
+            if (
+                other not in test_class.__mro__
+                and issubclass(other, unittest.TestCase)
+                and other.__module__ == module.__name__
+            ):
+                source = source.replace(inspect.getsource(other), "")
+        for base in test_class.__mro__:
+            if (
+                issubclass(base, unittest.TestCase)
+                and base.__module__ != module.__name__
+                and base.__module__.split(".")[0] != "unittest"
+            ):
+                source += "\0" + inspect.getsource(base)
+    except (OSError, TypeError):
+        return None
+    return source
+
+
+def enabled() -> bool:
+    """
+    Returns whether results are cached: when batch_grade.py gives a cache
+    directory, or one was shipped in the tests directory
+    """
+    return bool(CACHE_DIR) and (
+        "AUTOGRADER_RESULT_CACHE" in os.environ or os.path.isdir(CACHE_DIR)
+    )
+
+
+def _class_id(test: unittest.TestCase) -> str:
+    return f"{test.__class__.__module__}.{test.__class__.__qualname__}"
+
+
+class ResultCache:
+    """
+    Test results stored by the key of their test class
+
+    directory - where the results are stored, one file per key
+    keys - dict of each test class's id (e.g. "test.Test02Example") to its
+           key, or None if the class can't be cached
+    """
+
+    directory: str
+    keys: dict[str, str]
+
+    def __init__(self, directory: str, keys: dict[str, str]):
+        self.directory = directory
+        self.keys = keys
+
+    @classmethod
+    def for_tests(
+        cls, tests: list[unittest.TestCase], setup_class_name: str
+    ) -> "ResultCache":
+        """
+        Returns the cache with the keys of the tests' classes
+
+        setup_class_name - name of the class every other class depends on
+        """
+        classes = {}
+        for test in tests:
+            classes.setdefault(_class_id(test), test.__class__)
+        test_files = {
+            os.path.abspath(inspect.getfile(test_class))
+            for test_class in classes.values()
+        }
+        shared = _shared_digest(test_files)
+
+        setup_source = "".join(
+            class_source(test_class) or ""
+            for test_class in classes.values()
+            if test_class.__name__ == setup_class_name
+        )
+        keys = {}
+        for class_id, test_class in classes.items():
+            source = class_source(test_class)
+            if source is None:
+                keys[class_id] = None
+                continue
+            hasher = hashlib.sha256(shared)
+            hasher.update(class_id.encode() + b"\0")
+            hasher.update(setup_source.encode() + b"\0")
+            hasher.update(source.encode())
+            keys[class_id] = hasher.hexdigest()
+        return cls(CACHE_DIR, keys)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def load(self, class_id: str, test_ids: list[str]) -> dict[str, dict]:
+        """
+        Returns the class's cached results by test id, or None if they
+        aren't cached for exactly these tests
+        """
+        key = self.keys.get(class_id)
+        if key is None:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                results = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if set(results) != set(test_ids):
+            return None
+        for result in results.values():
+            result.setdefault("extra_data", {})["cached"] = True
+        return results
+
+    def save(self, class_id: str, results: dict[str, dict]) -> None:
+        """
+        Stores the class's results (by test id). Classes that had a program
+        time out aren't stored, since that depends on how busy the machine
+        was.
+        """
+        key = self.keys.get(class_id)
+        if key is None or any(
+            result.get("extra_data", {}).get("timed_out")
+            for result in results.values()
+        ):
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        # Written to a temporary file first, so a reader never sees half
+        descriptor, path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        os.replace(path, self._path(key))
+
+    def save_results(self, results: list[tuple[str, dict]]) -> None:
+        """
+        Stores the (test id, result) pairs from a run, grouped by class
+        """
+        by_class = {}
+        for test_id, result in results:
+            class_id = test_id.rsplit(".", 1)[0]
+            by_class.setdefault(class_id, {})[test_id] = result
+        for class_id, class_results in by_class.items():
+            self.save(class_id, class_results)
+
+
+def split_cached(
+    tests: list[unittest.TestCase], cache: ResultCache, setup_class_name: str
+) -> tuple[list[unittest.TestCase], list[tuple[str, dict]]]:
+    """
+    Returns the tests that have to run and the (test id, result) of the
+    ones whose cached results can be used. The setup class only uses its
+    cached results if every other class does too, since the others need
+    what it compiles.
+    """
+    by_class = {}
+    for test in tests:
+        by_class.setdefault(_class_id(test), []).append(test)
+
+    cached = {}
+    for class_id, class_tests in by_class.items():
+        results = cache.load(class_id, [test.id() for test in class_tests])
+        if results is not None:
+            cached[class_id] = results
+
+    setup_ids = {
+        class_id
+        for class_id, class_tests in by_class.items()
+        if class_tests[0].__class__.__name__ == setup_class_name
+    }
+    if any(class_id not in cached for class_id in by_class.keys() - setup_ids):
+        for class_id in setup_ids:
+            cached.pop(class_id, None)
+
+    to_run = [test for test in tests if _class_id(test) not in cached]
+    results = [
+        (test_id, result)
+        for class_results in cached.values()
+        for test_id, result in class_results.items()
+    ]
+    return to_run, results
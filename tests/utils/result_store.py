@@ -0,0 +1,283 @@
+"""
+This file contains a small column-oriented store for the results of many
+graded submissions, and functions for summarizing them with numpy, e.g. each
+test's pass rate, the distribution of scores, and the slowest tests.
+
+batch_grade.py appends every submission's results to it. Each column is its
+own file of fixed-size binary values, so appending a submission only adds a
+few bytes to each, and loading thousands of submissions is one np.fromfile
+per column. Submission names and test numbers are stored as indexes into
+names.json, which also records how many rows have been fully written.
+"""
+
+import fcntl
+import json
+import os
+import time
+import numpy as np
+
+# Column names and the numpy type each one is stored as
+COLUMNS = {
+    "submission": np.int32,
+    "test": np.int32,
+    "score": np.float32,
+    "max_score": np.float32,
+    "duration": np.float32,
+    "timed_out": np.bool_,
+    "output_size": np.int64,
+    "graded_at": np.float64,
+}
+NAMES_FILE = "names.json"
+LOCK_FILE = ".lock"
+
+
+class ResultTable:
+    """
+    Every stored test result, one array per column with a row per result
+
+    submissions - submission names, indexed by the submission column
+    tests - test numbers (or names), indexed by the test column
+    columns - dict of each column's name to its array
+    """
+
+    submissions: list[str]
+    tests: list[str]
+    columns: dict[str, np.ndarray]
+
+    def __init__(
+        self,
+        submissions: list[str],
+        tests: list[str],
+        columns: dict[str, np.ndarray],
+    ):
+        self.submissions = submissions
+        self.tests = tests
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["test"])
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    def latest(self):
+        """
+        Returns a table with only the most recent result of each test for
+        each submission, e.g. after a submission was regraded
+        """
+        key = self["submission"].astype(np.int64) * len(self.tests)
+        key += self["test"]
+        # Sorting by key and then time, so the last row of each key is newest
+        order = np.lexsort((self["graded_at"], key))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = key[order][1:] != key[order][:-1]
+        rows = order[last]
+        return ResultTable(
+            self.submissions,
+            self.tests,
+            {name: values[rows] for name, values in self.columns.items()},
+        )
+
+
+def _lock(store_dir: str):
+    lock = open(os.path.join(store_dir, LOCK_FILE), "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def _load_names(store_dir: str) -> dict:
+    try:
+        with open(os.path.join(store_dir, NAMES_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"submissions": [], "tests": []}
+
+
+def _save_names(store_dir: str, names: dict) -> None:
+    # Replacing the file, so the committed row count is never half written
+    path = os.path.join(store_dir, NAMES_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(names, f)
+    os.replace(path + ".tmp", path)
+
+
+def _column_path(store_dir: str, name: str) -> str:
+    return os.path.join(store_dir, name + ".bin")
+
+
+def _committed_rows(store_dir: str, names: dict) -> int:
+    """
+    Returns how many rows every column has fully written. Rows past it are
+    from an append that was cut short.
+    """
+    if "rows" in names:
+        return names["rows"]
+    # Stores written before the count was recorded
+    return min(
+        (
+            os.path.getsize(_column_path(store_dir, name))
+            // np.dtype(dtype).itemsize
+            if os.path.isfile(_column_path(store_dir, name))
+            else 0
+        )
+        for name, dtype in COLUMNS.items()
+    )
+
+
+def _index(names: list[str], name: str) -> int:
+    # The lists are short (one entry per test or submission), and this only
+    # runs when appending
+    if name not in names:
+        names.append(name)
+    return names.index(name)
+
+
+def append_results(store_dir: str, submission: str, results: dict) -> int:
+    """
+    Appends the tests in a submission's results.json to the store, creating
+    the store if it doesn't exist. Several processes can append at once.
+    Returns how many results were added.
+
+    store_dir - Directory the store's files are in
+    submission - Name of the submission
+    results - The contents of the submission's results.json
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    tests = results.get("tests", [])
+    with _lock(store_dir):
+        names = _load_names(store_dir)
+        committed = _committed_rows(store_dir, names)
+        submission_index = _index(names["submissions"], submission)
+        rows = {name: [] for name in COLUMNS}
+        graded_at = time.time()
+        for test in tests:
+            extra_data = test.get("extra_data", {})
+            rows["submission"].append(submission_index)
+            rows["test"].append(
+                _index(names["tests"], test.get("number") or test["name"])
+            )
+            rows["score"].append(test.get("score", 0))
+            rows["max_score"].append(test.get("max_score", 0))
+            rows["duration"].append(extra_data.get("duration", np.nan))
+            rows["timed_out"].append(extra_data.get("timed_out", False))
+            rows["output_size"].append(
+                extra_data.get("output_size", len(test.get("output", "")))
+            )
+            rows["graded_at"].append(graded_at)
+
+        # Any rows an earlier append didn't commit are dropped first, so
+        # the columns stay aligned
+        for name, dtype in COLUMNS.items():
+            descriptor = os.open(
+                _column_path(store_dir, name), os.O_RDWR | os.O_CREAT, 0o644
+            )
+            with os.fdopen(descriptor, "r+b") as f:
+                f.truncate(committed * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.asarray(rows[name], dtype=dtype).tobytes())
+        # The rows only count once every column has them
+        names["rows"] = committed + len(tests)
+        _save_names(store_dir, names)
+    return len(tests)
+
+
+def load(store_dir: str, latest: bool = True) -> ResultTable:
+    """
+    Loads every result in the store
+
+    latest - Only keep the newest result of each test for each submission
+    """
+    with _lock(store_dir):
+        names = _load_names(store_dir)
+        rows = _committed_rows(store_dir, names)
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            path = _column_path(store_dir, name)
+            # Rows an append didn't commit are left out
+            columns[name] = (
+                np.fromfile(path, dtype=dtype, count=rows)
+                if rows > 0
+                else np.empty(0, dtype=dtype)
+            )
+    table = ResultTable(names["submissions"], names["tests"], columns)
+    return table.latest() if latest else table
+
+
+def pass_rates(table: ResultTable) -> list[tuple[str, float, int]]:
+    """
+    Returns (test, fraction of submissions that got full points, number of
+    submissions) for each test, lowest pass rate first
+    """
+    count = np.bincount(table["test"], minlength=len(table.tests))
+    passed = np.bincount(
+        table["test"],
+        weights=table["score"] >= table["max_score"],
+        minlength=len(table.tests),
+    )
+    rates = np.divide(passed, count, out=np.zeros(len(count)), where=count > 0)
+    tests = [
+        index for index in np.argsort(rates, kind="stable") if count[index]
+    ]
+    return [(table.tests[i], float(rates[i]), int(count[i])) for i in tests]
+
+
+def submission_scores(table: ResultTable) -> dict[str, float]:
+    """
+    Returns each submission's total score
+    """
+    totals = np.bincount(
+        table["submission"],
+        weights=table["score"],
+        minlength=len(table.submissions),
+    )
+    present = np.bincount(
+        table["submission"], minlength=len(table.submissions)
+    )
+    return {
+        table.submissions[i]: float(totals[i]) for i in np.flatnonzero(present)
+    }
+
+
+def score_distribution(
+    table: ResultTable, bins: int = 10
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns a histogram of the submissions' total scores, as numpy's
+    (counts, bin_edges)
+    """
+    scores = np.fromiter(submission_scores(table).values(), dtype=float)
+    return np.histogram(scores, bins=bins)
+
+
+def slowest_tests(
+    table: ResultTable, top: int = 10
+) -> list[tuple[str, float, float, float]]:
+    """
+    Returns (test, mean seconds, longest seconds, fraction of runs that
+    timed out) for the top tests with the longest mean duration
+    """
+    durations = table["duration"]
+    known = ~np.isnan(durations)
+    tests = table["test"][known]
+    count = np.bincount(tests, minlength=len(table.tests))
+    total = np.bincount(
+        tests, weights=durations[known], minlength=len(table.tests)
+    )
+    longest = np.zeros(len(table.tests))
+    np.maximum.at(longest, tests, durations[known])
+    timed_out = np.bincount(
+        tests,
+        weights=table["timed_out"][known],
+        minlength=len(table.tests),
+    )
+    means = np.divide(total, count, out=np.zeros(len(count)), where=count > 0)
+    order = [i for i in np.argsort(-means, kind="stable") if count[i]][:top]
+    return [
+        (
+            table.tests[i],
+            float(means[i]),
+            float(longest[i]),
+            float(timed_out[i] / count[i]),
+        )
+        for i in order
+    ]
@@ -0,0 +1,37 @@
+import utils.common as common
+import utils.golden as golden
+import utils.reference as reference
+import argparse
+import os
+
+
+def main(test_file, preset):
+    reference.load_cases(test_file)
+    index = golden.build(preset=preset)
+    stored = sum(blob["length"] for blob in index["blobs"].values())
+    original = sum(blob["size"] for blob in index["blobs"].values())
+    print(
+        f"Saved {len(index['cases'])} golden outputs "
+        f"({len(index['blobs'])} unique, {original} bytes compressed to "
+        f"{stored}) to {golden.GOLDEN_PACK}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the reference solution on every case registered "
+        "with utils.reference.register_case and save its outputs"
+    )
+    parser.add_argument(
+        "--test-file",
+        default=os.path.join(common.TESTS_DIR, "test.py"),
+        help="File that registers the cases",
+    )
+    parser.add_argument(
+        "--preset",
+        type=int,
+        default=golden.DEFAULT_PRESET,
+        help="lzma compression level, from 0 to 9",
+    )
+    args = parser.parse_args()
+    main(args.test_file, args.preset)
@@ -0,0 +1,47 @@
+import utils.common as common
+import utils.reference as reference
+import argparse
+import os
+
+
+def main(test_file, multiple, floor, runs):
+    reference.load_cases(test_file)
+    cases = reference.calibrate(multiple, floor, runs)
+    for name, case in cases.items():
+        print(
+            f"{name}: reference took {case['cpu_time']:.3f}s of CPU time, "
+            f"timeout is {case['timeout']}s"
+        )
+    print(f"Saved {len(cases)} timeouts to {reference.CALIBRATION_FILE}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the reference solution on every case registered "
+        "with utils.reference.register_case and save their timeouts"
+    )
+    parser.add_argument(
+        "--test-file",
+        default=os.path.join(common.TESTS_DIR, "test.py"),
+        help="File that registers the cases",
+    )
+    parser.add_argument(
+        "--multiple",
+        type=float,
+        default=reference.DEFAULT_MULTIPLE,
+        help="Timeout is the reference's CPU time times this",
+    )
+    parser.add_argument(
+        "--floor",
+        type=float,
+        default=reference.DEFAULT_FLOOR,
+        help="Shortest timeout in seconds",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=reference.DEFAULT_RUNS,
+        help="How many times the reference is run on each case",
+    )
+    args = parser.parse_args()
+    main(args.test_file, args.multiple, args.floor, args.runs)
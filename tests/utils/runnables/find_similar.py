@@ -0,0 +1,53 @@
+import utils.similarity as similarity
+import argparse
+import os
+
+
+def main(export_dir, base_dir, threshold, output, top):
+    submission_dirs = {
+        name: os.path.join(export_dir, name)
+        for name in sorted(os.listdir(export_dir))
+        if os.path.isdir(os.path.join(export_dir, name))
+    }
+    matches = similarity.similarity_report(
+        submission_dirs, base_dir, threshold
+    )
+    pairs = similarity.group_by_pair(matches)
+    for first, second, pair_matches in pairs[:top]:
+        print(f"{first} and {second}: {len(pair_matches)} similar functions")
+        for match in pair_matches:
+            print(
+                f"    {match.similarity:.2f}  {match.first.location()}  "
+                f"{match.second.location()}"
+            )
+    if output:
+        similarity.write_csv(matches, output)
+    print(
+        f"{len(pairs)} pairs of {len(submission_dirs)} submissions have "
+        "similar functions"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find similar functions across a directory with one "
+        "folder per submission (e.g. a Gradescope export)"
+    )
+    parser.add_argument("export_dir", help="Directory of submissions")
+    parser.add_argument(
+        "--base", default=None, help="Directory of starter code to ignore"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=similarity.DEFAULT_THRESHOLD,
+        help="Lowest similarity to report, from 0 to 1",
+    )
+    parser.add_argument(
+        "--output", default=None, help="Also write the matches to this CSV"
+    )
+    parser.add_argument(
+        "--top", type=int, default=20, help="How many pairs to print"
+    )
+    args = parser.parse_args()
+    main(args.export_dir, args.base, args.threshold, args.output, args.top)
@@ -0,0 +1,84 @@
+import argparse
+import os
+import subprocess
+import sys
+
+TESTS_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+# What run_tests.py and test.py import before any test runs
+DEFAULT_MODULES = [
+    "utils",
+    "gradescope_utils.autograder_utils.json_test_runner",
+    "gradescope_utils.autograder_utils.decorators",
+]
+
+
+def measure(modules, runs):
+    """
+    Imports the modules in a fresh Python with -X importtime and returns the
+    fastest run as a dict of module name to cumulative microseconds
+    """
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c"]
+            + ["import " + ", ".join(modules)],
+            cwd=TESTS_DIR,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            _, cumulative, name = line.split("|")
+            times[name.strip()] = int(cumulative)
+        if best is None or sum(times[m] for m in modules) < sum(
+            best[m] for m in modules
+        ):
+            best = times
+    return best
+
+
+def main(modules, runs, budget_ms, top):
+    times = measure(modules, runs)
+    total_ms = sum(times[module] for module in modules) / 1000
+
+    print("Slowest imports (cumulative):")
+    for name, microseconds in sorted(
+        times.items(), key=lambda item: item[1], reverse=True
+    )[:top]:
+        print(f"{microseconds / 1000:8.1f} ms  {name}")
+    print(f"\nTotal: {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+
+    if total_ms > budget_ms:
+        sys.exit("Importing took longer than the budget")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report how long importing the autograder's modules "
+        "takes before any test runs, and fail if it's over a budget"
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=DEFAULT_MODULES,
+        help="Modules to import (default: what run_tests.py and test.py "
+        "import)",
+    )
+    parser.add_argument(
+        "--budget", type=float, default=100, help="Budget in milliseconds"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Fastest of this many runs"
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="How many imports to list"
+    )
+    args = parser.parse_args()
+    main(args.modules, args.runs, args.budget, args.top)
@@ -0,0 +1,16 @@
+import utils.precompiling as precompiling
+import argparse
+
+
+def main(flags):
+    compiled = precompiling.precompile_drivers(flags=flags)
+    print("Precompiled drivers: " + (" ".join(compiled) or "none"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompile the drivers and common headers. Any extra "
+        "arguments (e.g. -std=c++17) are used as compilation flags"
+    )
+    _, flags = parser.parse_known_args()
+    main(flags)
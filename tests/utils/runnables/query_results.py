@@ -0,0 +1,52 @@
+import utils.result_store as result_store
+import argparse
+
+# Longest bar in the score histogram
+BAR_WIDTH = 50
+
+
+def main(store_dir, top, include_old):
+    table = result_store.load(store_dir, latest=not include_old)
+    print(
+        f"{len(table)} results from {len(table.submissions)} submissions "
+        f"and {len(table.tests)} tests\n"
+    )
+
+    print("Pass rates (lowest first):")
+    for test, rate, count in result_store.pass_rates(table)[:top]:
+        print(f"    {test:>8}  {rate:6.1%} of {count}")
+
+    print("\nSlowest tests:")
+    for test, mean, longest, timed_out in result_store.slowest_tests(
+        table, top
+    ):
+        print(
+            f"    {test:>8}  mean {mean:.2f}s, longest {longest:.2f}s, "
+            f"{timed_out:.1%} timed out"
+        )
+
+    print("\nScore distribution:")
+    counts, edges = result_store.score_distribution(table)
+    scale = BAR_WIDTH / max(counts.max(), 1)
+    for count, low, high in zip(counts, edges, edges[1:]):
+        bar = "#" * round(count * scale)
+        print(f"    {low:7.1f} - {high:7.1f}  {count:5d}  {bar}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Summarize the results stored by batch_grade.py"
+    )
+    parser.add_argument(
+        "store_dir", help="The results_store directory in the output"
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="How many tests to list"
+    )
+    parser.add_argument(
+        "--include-old",
+        action="store_true",
+        help="Include results from before submissions were regraded",
+    )
+    args = parser.parse_args()
+    main(args.store_dir, args.top, args.include_old)
@@ -1,5 +1,5 @@
 """
-This file contains functions for setting up the source directory and
+This file contains functions for setting up the working directory and
 checking that the student submitted the correct files
 """
 
@@ -15,10 +15,11 @@ def move_drivers_to_source():
     # Copying all the files from the drivers folder into
     # the source directory, so we can use them to test the
     # student's code later
-    # When the autograder is used, the cwd (i.e. the ".") is the
-    # source directory (/autograder/source/)
-    if os.path.isdir("tests/drivers") and len(os.listdir("tests/drivers")) > 0:
-        os.system("cp -r tests/drivers/* .")
+    # When the autograder is used, the working directory is the
+    # source directory (/autograder/source/), unless utils.workspace moved it
+    drivers_dir = os.path.join(common.TESTS_DIR, "drivers")
+    if os.path.isdir(drivers_dir) and len(os.listdir(drivers_dir)) > 0:
+        os.system(f'cp -r "{drivers_dir}"/* "{common.WORK_DIR}"')
 
 
 def move_io_files_to_source():
@@ -28,17 +29,18 @@ def move_io_files_to_source():
     """
     # Moving files from the io_files folder into the source directory and
     # giving each file read permissions to the student user
-    if (
-        os.path.isdir("tests/io_files")
-        and len(os.listdir("tests/io_files")) > 0
-    ):
-        os.system("cp -r tests/io_files/* .")
+    io_files_dir = os.path.join(common.TESTS_DIR, "io_files")
+    if not os.path.isdir(io_files_dir):
+        return
+
+    if len(os.listdir(io_files_dir)) > 0:
+        os.system(f'cp -r "{io_files_dir}"/* "{common.WORK_DIR}"')
 
     # Getting list of file names in the io_files folder
-    io_files = os.listdir("tests/io_files")
+    io_files = os.listdir(io_files_dir)
     # Giving read permissions to the student user
     for file in io_files:
-        os.chmod(file, 0o644)
+        os.chmod(os.path.join(common.WORK_DIR, file), 0o644)
 
 
 def check_and_get_files(
@@ -64,7 +66,7 @@ def check_and_get_files(
                 or file in optional_files
                 or not files_must_be_expected
             ):
-                shutil.copy(os.path.join(root, file), common.SOURCE_DIR)
+                shutil.copy(os.path.join(root, file), common.WORK_DIR)
 
     # Everything onwards is checking that the correct files were given
     # and rasing an exception if they were not
@@ -0,0 +1,356 @@
+"""
+This file contains functions for finding similar code across a batch of
+submissions, as a first pass when checking for plagiarism.
+
+Each function in a submission's C/C++ files is turned into a list of tokens
+with libclang, with every identifier and literal replaced by a placeholder,
+so renaming variables or changing constants doesn't hide a copy. The tokens
+are fingerprinted with winnowing (the same idea MOSS uses), and each
+function's fingerprints get a MinHash signature. Functions whose signatures
+land in the same locality-sensitive hashing bucket are the only ones
+compared, so a whole class doesn't need every pair of submissions compared.
+
+Everything runs offline. Matches are only a signal: look at the reported
+functions before deciding anything.
+"""
+
+import csv
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from clang.cindex import TokenKind
+import utils.common as common
+import utils.parsing as parsing
+
+C_EXTENSIONS = (".c",)
+CPP_EXTENSIONS = (".cpp", ".cc", ".cxx", ".h", ".hpp", ".hh")
+
+# Number of tokens in each fingerprinted k-gram
+K = 5
+# Winnowing window size. Any copied run of K + WINDOW - 1 tokens shares at
+# least one fingerprint
+WINDOW = 4
+# Functions with fewer tokens than this are ignored, since short functions
+# (getters, setters) look the same in everyone's code
+MIN_TOKENS = 40
+# MinHash signature length is BANDS * ROWS. More bands finds pairs with lower
+# similarity, but checks more pairs
+BANDS = 16
+ROWS = 4
+# Pairs of functions with at least this Jaccard similarity are reported
+DEFAULT_THRESHOLD = 0.5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+class Function:
+    """
+    submission - name of the submission the function is from
+    file - path of the file relative to the submission
+    name - the function's name
+    start_line, end_line - lines the function is on
+    token_count - number of tokens in the function
+    fingerprints - set of winnowed k-gram hashes
+    """
+
+    submission: str
+    file: str
+    name: str
+    start_line: int
+    end_line: int
+    token_count: int
+    fingerprints: set[int]
+
+    def __init__(
+        self,
+        submission: str,
+        file: str,
+        name: str,
+        start_line: int,
+        end_line: int,
+        token_count: int,
+        fingerprints: set[int],
+    ):
+        self.submission = submission
+        self.file = file
+        self.name = name
+        self.start_line = start_line
+        self.end_line = end_line
+        self.token_count = token_count
+        self.fingerprints = fingerprints
+
+    def location(self) -> str:
+        return f"{self.file}:{self.start_line}-{self.end_line} ({self.name})"
+
+
+class Match:
+    """
+    first, second - the two similar functions, from different submissions
+    similarity - Jaccard similarity of their fingerprints, from 0 to 1
+    """
+
+    first: Function
+    second: Function
+    similarity: float
+
+    def __init__(self, first: Function, second: Function, similarity: float):
+        self.first = first
+        self.second = second
+        self.similarity = similarity
+
+
+def normalized_tokens(cursor) -> list[str]:
+    """
+    Returns the cursor's tokens with identifiers replaced by "ID" and
+    literals by "LIT". Comments are left out.
+    """
+    tokens = []
+    for token in cursor.get_tokens():
+        if token.kind == TokenKind.IDENTIFIER:
+            tokens.append("ID")
+        elif token.kind == TokenKind.LITERAL:
+            tokens.append("LIT")
+        elif token.kind != TokenKind.COMMENT:
+            tokens.append(token.spelling)
+    return tokens
+
+
+def _hash(text: str) -> int:
+    # Python's hash() changes between processes, so a stable hash is used
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def winnow(tokens: list[str], k: int = K, window: int = WINDOW) -> set[int]:
+    """
+    Returns the winnowed fingerprints of the tokens: the smallest hash of
+    the k-grams in every window of consecutive k-grams
+    """
+    hashes = [
+        _hash(" ".join(tokens[i : i + k])) for i in range(len(tokens) - k + 1)
+    ]
+    if len(hashes) <= window:
+        return set(hashes)
+    return {
+        min(hashes[i : i + window]) for i in range(len(hashes) - window + 1)
+    }
+
+
+def _parse_args(path: str) -> list[str]:
+    # Skipping the system headers makes parsing many times faster. Function
+    # bodies are still found and tokenized without them.
+    language = "c" if path.endswith(C_EXTENSIONS) else "c++"
+    return ["-x", language, "-nostdinc", "-nostdinc++"]
+
+
+def find_functions(
+    path: str, submission: str = "", relative_path: str = None
+) -> list[Function]:
+    """
+    Returns the fingerprinted functions defined in a C or C++ file
+    """
+    unit = parsing.parse_file(path, _parse_args(path))
+    functions = []
+    for cursor in parsing.function_definitions(unit.cursor, path):
+        tokens = normalized_tokens(cursor)
+        if len(tokens) < MIN_TOKENS:
+            continue
+        functions.append(
+            Function(
+                submission,
+                relative_path or path,
+                cursor.spelling,
+                cursor.extent.start.line,
+                cursor.extent.end.line,
+                len(tokens),
+                winnow(tokens),
+            )
+        )
+    return functions
+
+
+def load_submission(directory: str, name: str = None) -> list[Function]:
+    """
+    Returns the fingerprinted functions in every C and C++ file of a
+    submission directory (including its subdirectories)
+    """
+    name = name or os.path.basename(os.path.normpath(directory))
+    functions = []
+    for root, _, files in os.walk(directory):
+        for file in sorted(files):
+            if not file.endswith(C_EXTENSIONS + CPP_EXTENSIONS):
+                continue
+            path = os.path.join(root, file)
+            functions.extend(
+                find_functions(path, name, os.path.relpath(path, directory))
+            )
+    return functions
+
+
+def minhash_signatures(
+    functions: list[Function], permutations: int = BANDS * ROWS, seed=0
+) -> np.ndarray:
+    """
+    Returns a (functions, permutations) array of MinHash signatures. The
+    fraction of equal values in two rows estimates the Jaccard similarity
+    of the two functions' fingerprints.
+    """
+    generator = np.random.default_rng(seed)
+    a = generator.integers(1, _MERSENNE_PRIME, permutations, dtype=np.uint64)
+    b = generator.integers(0, _MERSENNE_PRIME, permutations, dtype=np.uint64)
+
+    signatures = np.full(
+        (len(functions), permutations), np.iinfo(np.uint64).max, np.uint64
+    )
+    for row, function in enumerate(functions):
+        if not function.fingerprints:
+            continue
+        fingerprints = np.fromiter(
+            function.fingerprints, np.uint64, len(function.fingerprints)
+        )
+        # Universal hashing, wrapping around at 2^64. The low bits of a
+        # product are poorly mixed, so the high 32 bits are used.
+        hashed = (a[:, None] * fingerprints[None, :] + b[:, None]) >> 32
+        signatures[row] = hashed.min(axis=1)
+    return signatures
+
+
+def candidate_pairs(
+    functions: list[Function],
+    signatures: np.ndarray,
+    bands: int = BANDS,
+    rows: int = ROWS,
+) -> set[tuple[int, int]]:
+    """
+    Returns the index pairs of functions from different submissions whose
+    signatures are equal in at least one band
+    """
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        band_values = signatures[:, band * rows : (band + 1) * rows]
+        for index, values in enumerate(band_values):
+            buckets.setdefault(values.tobytes(), []).append(index)
+        for bucket in buckets.values():
+            for i, first in enumerate(bucket):
+                for second in bucket[i + 1 :]:
+                    if (
+                        functions[first].submission
+                        != functions[second].submission
+                    ):
+                        pairs.add((first, second))
+    return pairs
+
+
+def jaccard(first: set, second: set) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def find_similar(
+    functions: list[Function],
+    threshold: float = DEFAULT_THRESHOLD,
+    bands: int = BANDS,
+    rows: int = ROWS,
+) -> list[Match]:
+    """
+    Returns the pairs of functions from different submissions that are at
+    least threshold similar, most similar first
+    """
+    signatures = minhash_signatures(functions, bands * rows)
+    matches = []
+    for first, second in candidate_pairs(functions, signatures, bands, rows):
+        similarity = jaccard(
+            functions[first].fingerprints, functions[second].fingerprints
+        )
+        if similarity >= threshold:
+            matches.append(
+                Match(functions[first], functions[second], similarity)
+            )
+    matches.sort(key=lambda match: match.similarity, reverse=True)
+    return matches
+
+
+def similarity_report(
+    submission_dirs: dict[str, str],
+    base_dir: str = None,
+    threshold: float = DEFAULT_THRESHOLD,
+    max_workers: int = None,
+) -> list[Match]:
+    """
+    Finds similar functions across many submissions and returns the matches,
+    most similar first
+
+    submission_dirs -   Dict of each submission's name to its directory
+    base_dir -  Directory of starter code given to every student. Code that
+                matches it isn't counted as similar
+    threshold - Lowest Jaccard similarity that's reported
+    max_workers -   How many files are parsed at once. Default is the number
+                    of available cores
+    """
+    names = list(submission_dirs)
+    with ProcessPoolExecutor(
+        max_workers=max_workers or common.available_cores()
+    ) as executor:
+        loaded = executor.map(
+            load_submission, [submission_dirs[name] for name in names], names
+        )
+        functions = [function for result in loaded for function in result]
+
+    if base_dir is not None:
+        base_fingerprints = set()
+        for function in load_submission(base_dir, "base"):
+            base_fingerprints |= function.fingerprints
+        for function in functions:
+            function.fingerprints -= base_fingerprints
+
+    return find_similar(functions, threshold)
+
+
+def group_by_pair(matches: list[Match]) -> list[tuple[str, str, list[Match]]]:
+    """
+    Groups the matches by the pair of submissions they're from. Returns
+    (submission_a, submission_b, matches) tuples, with the pairs sharing the
+    most similar functions first
+    """
+    pairs = {}
+    for match in matches:
+        key = tuple(sorted((match.first.submission, match.second.submission)))
+        pairs.setdefault(key, []).append(match)
+    return sorted(
+        ((a, b, pair_matches) for (a, b), pair_matches in pairs.items()),
+        key=lambda pair: (
+            len(pair[2]),
+            max(match.similarity for match in pair[2]),
+        ),
+        reverse=True,
+    )
+
+
+def write_csv(matches: list[Match], path: str) -> None:
+    """
+    Writes one row per match to a CSV file
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "similarity",
+                "submission_a",
+                "function_a",
+                "submission_b",
+                "function_b",
+            ]
+        )
+        for match in matches:
+            writer.writerow(
+                [
+                    round(match.similarity, 3),
+                    match.first.submission,
+                    match.first.location(),
+                    match.second.submission,
+                    match.second.location(),
+                ]
+            )
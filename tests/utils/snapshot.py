@@ -0,0 +1,279 @@
+"""
+This file contains functions for giving each test class its own copy of the
+working directory as it was after setup, so a test that changes files (e.g.
+the student's program writing output.txt) can't affect the tests after it.
+
+The working directory is saved once with capture, at the end of Test01Setup.
+Each test class that extends SnapshotTestCase then runs in a fresh view of
+it, made without copying the files' contents where the system allows:
+
+* With overlayfs (which needs root and permission to mount), the view is a
+  new writable layer mounted over the snapshot, so making one takes the same
+  time no matter how many files there are.
+* Otherwise every file in the view is reflinked to the snapshot's
+  (copy-on-write, on filesystems like btrfs and XFS), or copied if that
+  isn't supported. Files are never hard linked, since the tests run as root
+  and writing to a shared file would change the snapshot too.
+
+Views are separate directories, so test classes running in separate
+processes can each use their own at the same time.
+"""
+
+import atexit
+import errno
+import fcntl
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+import utils.common as common
+
+# ioctl that makes a file share another file's data until one is changed
+FICLONE = 0x40049409
+
+_snapshot = None
+
+
+def _copy_file(source: str, destination: str) -> None:
+    """
+    Copies the file, sharing its data with a reflink if the filesystem can
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError as error:
+            if error.errno not in (
+                errno.EOPNOTSUPP,
+                errno.EXDEV,
+                errno.EINVAL,
+                errno.ENOTTY,
+            ):
+                raise
+            shutil.copyfileobj(src, dst)
+    shutil.copystat(source, destination)
+
+
+def _copy_owner(source_stat: os.stat_result, destination: str) -> None:
+    os.chown(
+        destination,
+        source_stat.st_uid,
+        source_stat.st_gid,
+        follow_symlinks=False,
+    )
+
+
+def _save(source: str, destination: str) -> None:
+    """
+    Copies the file with its owner, sharing its data if the filesystem can
+    """
+    _copy_file(source, destination)
+    _copy_owner(os.stat(source), destination)
+
+
+def _replicate(
+    source: str, destination: str, link, exclude: tuple[str] = ()
+) -> None:
+    """
+    Recreates the source directory's tree at destination, with the same
+    permissions and owners, leaving out the top level names in exclude.
+    Each file is made by link(source, destination).
+    """
+    os.mkdir(destination)
+    for root, directories, files in os.walk(source):
+        if root == source:
+            directories[:] = [d for d in directories if d not in exclude]
+            files = [f for f in files if f not in exclude]
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+        for name in directories:
+            path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            else:
+                os.mkdir(target)
+            _copy_owner(os.lstat(path), target)
+        for name in files:
+            path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+                _copy_owner(os.lstat(path), target)
+            else:
+                link(path, target)
+    # Directory permissions are set last, so read-only ones can be filled
+    for root, directories, _ in os.walk(source):
+        if root == source:
+            directories[:] = [d for d in directories if d not in exclude]
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+        for name in directories + ["."]:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                os.chmod(
+                    os.path.join(target_root, name),
+                    stat.S_IMODE(os.stat(path).st_mode),
+                )
+    _copy_owner(os.stat(source), destination)
+
+
+class Snapshot:
+    """
+    A saved copy of the working directory that fresh views can be made from
+
+    path - the directory holding the saved files, inside a directory only
+           root can read
+    base - the working directory that was saved, which is used again when
+           a view is left
+    method - how views are made, "overlay" or "link" (every file reflinked,
+             or copied when the filesystem can't)
+    """
+
+    path: str
+    base: str
+    method: str
+
+    def __init__(self, path: str, base: str, method: str = None):
+        self.path = path
+        self.base = base
+        self.method = method
+        self._view = None
+        self._layer = None
+
+    def _mount_overlay(self, view: str) -> bool:
+        self._layer = tempfile.mkdtemp(dir=os.path.dirname(self.path))
+        upper = os.path.join(self._layer, "upper")
+        work = os.path.join(self._layer, "work")
+        os.mkdir(upper)
+        os.mkdir(work)
+        # The top of the view has the upper directory's permissions
+        shutil.copystat(self.path, upper)
+        _copy_owner(os.stat(self.path), upper)
+        os.mkdir(view)
+        try:
+            mounted = subprocess.run(
+                ["mount", "-t", "overlay", "overlay", "-o"]
+                + [f"lowerdir={self.path},upperdir={upper},workdir={work}"]
+                + [view],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            mounted = None
+        if mounted is not None and mounted.returncode == 0:
+            return True
+        os.rmdir(view)
+        shutil.rmtree(self._layer, ignore_errors=True)
+        self._layer = None
+        return False
+
+    def restore(self) -> str:
+        """
+        Replaces the current view (if any) with a fresh one, makes it the
+        working directory, and returns its path
+        """
+        self.leave()
+        # Next to the saved working directory, so the student can reach it
+        # and its files can be reflinked to the snapshot's
+        view = tempfile.mkdtemp(prefix="view-", dir=os.path.dirname(self.base))
+        os.rmdir(view)
+
+        if self.method in (None, "overlay") and self._mount_overlay(view):
+            self.method = "overlay"
+        else:
+            self.method = "link"
+            _replicate(self.path, view, _save)
+
+        self._view = view
+        os.chdir(view)
+        common.WORK_DIR = view
+        return view
+
+    def leave(self) -> None:
+        """
+        Deletes the current view and goes back to the saved working
+        directory
+        """
+        if self._view is None:
+            return
+        os.chdir(self.base)
+        common.WORK_DIR = self.base
+        if self._layer is not None:
+            subprocess.run(["umount", self._view], stderr=subprocess.DEVNULL)
+            os.rmdir(self._view)
+            shutil.rmtree(self._layer, ignore_errors=True)
+            self._layer = None
+        else:
+            shutil.rmtree(self._view, ignore_errors=True)
+        self._view = None
+
+    def delete(self) -> None:
+        """
+        Leaves the current view and deletes the snapshot
+        """
+        self.leave()
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+
+
+def capture(exclude: tuple[str] = ("tests",)) -> Snapshot:
+    """
+    Saves the working directory as it is now and returns the Snapshot. Call
+    this at the end of Test01Setup, after the student's code is compiled.
+    Otherwise it's called the first time a SnapshotTestCase runs. Only the
+    first call does anything.
+
+    exclude - names of files and directories at the top of the working
+              directory that aren't saved. The tests directory is only
+              readable by root and isn't needed in the views
+    """
+    global _snapshot
+
+    if _snapshot is not None:
+        return _snapshot
+
+    base = common.WORK_DIR
+    # Next to the working directory, so its files can be reflinked. Only
+    # root can get into the directory it's in (mkdtemp's default), since
+    # the student only needs the views
+    container = tempfile.mkdtemp(prefix="snapshot-", dir=os.path.dirname(base))
+    path = os.path.join(container, "files")
+    _replicate(base, path, _save, exclude)
+    _snapshot = Snapshot(path, base)
+    atexit.register(_snapshot.delete)
+    return _snapshot
+
+
+def restore() -> str:
+    """
+    Makes a fresh view of the snapshot the working directory, capturing the
+    snapshot first if it hasn't been, and returns its path
+    """
+    return capture().restore()
+
+
+def leave() -> None:
+    """
+    Deletes the current view and goes back to the saved working directory
+    """
+    if _snapshot is not None:
+        _snapshot.leave()
+
+
+class SnapshotTestCase(unittest.TestCase):
+    """
+    Test classes that extend this instead of unittest.TestCase run in their
+    own view of the working directory as it was after Test01Setup. Files
+    the tests create or change are gone when the class finishes.
+
+    e.g. class Test04UsingFileExample(utils.SnapshotTestCase):
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        restore()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        leave()
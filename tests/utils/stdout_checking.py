@@ -4,9 +4,21 @@ student's code against expected output.
 
 Some of these functions will help with sequential order and giving
 helpful error messages without giving away the answers.
+
+Phrases can also be matched approximately, allowing a few typos (edits).
+The search uses Myers' bit-parallel algorithm, which tracks the edit
+distance of the whole phrase with a few integer operations per character of
+output. Only the parts of the output that contain an exact piece of the
+phrase are searched: with at most k edits, one of k + 1 pieces of the phrase
+must be unchanged, and those pieces are found with str.find. Short phrases
+allow fewer edits, so the pieces are never too short to find quickly.
 """
 
-import copy
+import heapq
+
+# Pieces shorter than this match too often to be worth finding first, so a
+# phrase allows at most len(phrase) // MIN_PIECE_LENGTH - 1 edits
+MIN_PIECE_LENGTH = 3
 
 
 def phrases_out_of_order(expected_phrases, mother_string) -> list:
@@ -16,22 +28,204 @@ def phrases_out_of_order(expected_phrases, mother_string) -> list:
     built-in error messages and hints.
 
     expected_phrases : list of substrings to search for in output
-    mother_string : string that could contain all of the expected_phrases
+    mother_string : string that could contain all of the expected_phrases,
+                    or a LargeOutput
 
     returns the indexes of the phrases not found
     """
     not_found = []
+    start = 0
     for i, phrase in enumerate(expected_phrases):
         # Getting the first location of the string
-        loc = mother_string.find(phrase)
+        loc = mother_string.find(phrase, start)
         if loc == -1:
             not_found.append(i)
         else:
-            # Removing the phrase and everything before it
-            mother_string = mother_string[loc + len(phrase) :]
+            # Ignoring the phrase and everything before it from now on
+            start = loc + _phrase_length(phrase, mother_string)
     return not_found
 
 
+def _section(mother_string, start: int = 0, end: int = None) -> str:
+    """
+    Returns the part of mother_string from start to end. For normalized
+    output, the lines the student actually printed are returned instead.
+    """
+    if hasattr(mother_string, "original_text"):
+        return mother_string.original_text(start, end)
+    return mother_string[start:end]
+
+
+def _phrase_length(phrase: str, mother_string) -> int:
+    """
+    Returns the length of the phrase in the units used by mother_string's
+    offsets, which are bytes when it's a LargeOutput
+    """
+    if isinstance(mother_string, str):
+        return len(phrase)
+    return len(phrase.encode("utf-8"))
+
+
+def _myers_search(pattern: str, text: str, max_edits: int):
+    """
+    Returns (end, edits) for the first place in text where pattern matches
+    with at most max_edits edits, where end is the index just after the
+    match, or None. Past the first place, the match is extended while that
+    lowers the edits.
+    """
+    length = len(pattern)
+    mask = (1 << length) - 1
+    high = 1 << (length - 1)
+    # Bit i of a character's mask is set if pattern[i] is that character
+    masks = {}
+    for i, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << i)
+
+    # Bit vectors of the +1 and -1 vertical differences of the last column
+    plus, minus = mask, 0
+    score = length
+    best = None
+    for j, char in enumerate(text):
+        equal = masks.get(char, 0)
+        vertical = equal | minus
+        horizontal = (((equal & plus) + plus) ^ plus) | equal
+        horizontal_plus = minus | (~(horizontal | plus) & mask)
+        horizontal_minus = plus & horizontal
+        if horizontal_plus & high:
+            score += 1
+        elif horizontal_minus & high:
+            score -= 1
+        horizontal_plus = (horizontal_plus << 1) & mask
+        horizontal_minus = (horizontal_minus << 1) & mask
+        plus = horizontal_minus | (~(vertical | horizontal_plus) & mask)
+        minus = horizontal_plus & vertical
+
+        if best is not None:
+            if score >= best[1]:
+                return best
+            best = (j + 1, score)
+        elif score <= max_edits:
+            best = (j + 1, score)
+            if score == 0:
+                return best
+    return best
+
+
+def _match_start(pattern: str, text: str, end: int, edits: int) -> int:
+    """
+    Returns where the match of pattern that ends at end starts in text
+    """
+    # Edit distances between the end of the pattern and the text before
+    # end, with the text reversed so every match starts at the same place
+    window = text[max(0, end - len(pattern) - edits) : end][::-1]
+    reversed_pattern = pattern[::-1]
+    previous = list(range(len(window) + 1))
+    for i, char in enumerate(reversed_pattern, 1):
+        current = [i]
+        for j, text_char in enumerate(window, 1):
+            current.append(
+                min(
+                    previous[j - 1] + (char != text_char),
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                )
+            )
+        previous = current
+    # The match with the fewest edits that's closest to the pattern's length
+    fewest = min(previous)
+    length = min(
+        (j for j, cost in enumerate(previous) if cost == fewest),
+        key=lambda j: abs(j - len(pattern)),
+    )
+    return end - length
+
+
+def _candidate_windows(
+    phrase: str, mother_string, max_edits: int, start: int, end: int
+):
+    """
+    Yields (window_start, window_end) ranges of mother_string, in order,
+    that contain every possible match of the phrase after start
+    """
+    length = _phrase_length(phrase, mother_string)
+    piece_length = len(phrase) // (max_edits + 1)
+
+    def occurrences(offset: int, piece: str):
+        loc = mother_string.find(piece, start)
+        while loc != -1:
+            yield loc - offset
+            loc = mother_string.find(piece, loc + 1)
+
+    pieces = [
+        occurrences(
+            _phrase_length(phrase[: i * piece_length], mother_string),
+            phrase[i * piece_length : (i + 1) * piece_length],
+        )
+        for i in range(max_edits + 1)
+    ]
+    window = None
+    for phrase_start in heapq.merge(*pieces):
+        low = max(start, phrase_start - max_edits)
+        high = min(end, phrase_start + length + max_edits)
+        if window is not None and low <= window[1]:
+            window = (window[0], max(window[1], high))
+            continue
+        if window is not None:
+            yield window
+        window = (low, high)
+    if window is not None:
+        yield window
+
+
+def find_approximate(
+    phrase: str, mother_string, max_edits: int, start: int = 0
+) -> tuple[int, int, int]:
+    """
+    Finds the first place after start where the phrase appears with at most
+    max_edits edits (characters inserted, removed, or changed)
+
+    mother_string - string to search, or a LargeOutput
+
+    Every edit needs MIN_PIECE_LENGTH more characters of phrase (e.g. an 8
+    character phrase allows 1 edit), so short phrases don't match almost
+    anything and can still be found quickly.
+
+    returns (location, length, edits) in mother_string's offsets, or None
+    """
+    max_edits = min(max_edits, len(phrase) // MIN_PIECE_LENGTH - 1)
+    if not phrase:
+        return None
+    if max_edits <= 0:
+        loc = mother_string.find(phrase, start)
+        if loc == -1:
+            return None
+        return loc, _phrase_length(phrase, mother_string), 0
+    end = len(mother_string)
+    for window_start, window_end in _candidate_windows(
+        phrase, mother_string, max_edits, start, end
+    ):
+        text = mother_string[window_start:window_end]
+        match = _myers_search(phrase, text, max_edits)
+        if match is None:
+            continue
+        match_end, edits = match
+        match_start = _match_start(phrase, text, match_end, edits)
+        loc = window_start + _phrase_length(text[:match_start], mother_string)
+        return (
+            loc,
+            _phrase_length(text[match_start:match_end], mother_string),
+            edits,
+        )
+    return None
+
+
+def _line_number(mother_string, loc: int) -> int:
+    # LargeOutput and NormalizedOutput know their own line numbers
+    if hasattr(mother_string, "line_number"):
+        return mother_string.line_number(loc)
+    return mother_string.count("\n", 0, loc) + 1
+
+
 class Phrase:
     """
     A class to store information about a phrase that was expected to be found
@@ -42,6 +236,15 @@ class Phrase:
         self.found = False
         self.loc = loc
 
+        # Set when the phrase was only found with typos, when approximate
+        # matching is used: how many edits it took, the 1-based line it's
+        # on, and what was printed there instead
+        self.edits = None
+        self.line = None
+        self.actual = None
+        # Length of what was found in the mother_string
+        self.length = 0
+
         # The part of the mother_string that should have contained this
         # It's the section between the two closest expected phrases that
         # were found
@@ -50,7 +253,7 @@ class Phrase:
 
 
 def phrases_out_of_order_hint(
-    expected_phrases: list[str], mother_string: str
+    expected_phrases: list[str], mother_string: str, max_edits: int = 0
 ) -> list[Phrase]:
     """
     Checking for each of these expected_phrases to be found within the
@@ -58,6 +261,10 @@ def phrases_out_of_order_hint(
     the mother_string are ignored for future searches. As a result,
     if the first expected phrase is found at the end of the mother_string only,
     then there is no chance that the other phrases will be found.
+
+    If max_edits is more than 0, phrases that aren't found exactly are
+    searched for again allowing up to that many edits. Those still count as
+    not found, but their edits, line, and what was printed instead are set.
     :returns    A list of Phrase objects that were not found
     """
 
@@ -66,53 +273,62 @@ def phrases_out_of_order_hint(
     # Step 1 -- Try to find each phrase such that one cannot be found at an
     # earlier index than the previous phrases
 
-    cropped_string = copy.deepcopy(mother_string)
+    start = 0
     for i, phrase in enumerate(phrases):
-        loc = cropped_string.find(phrase.expected)
+        loc = mother_string.find(phrase.expected, start)
         if loc != -1:
-            phrase.loc = len(mother_string) - len(cropped_string) + loc
+            phrase.loc = loc
             phrase.found = True
-            cropped_string = cropped_string[loc + len(phrase.expected) :]
+            phrase.length = _phrase_length(phrase.expected, mother_string)
+            start = loc + phrase.length
+        elif max_edits > 0:
+            match = find_approximate(
+                phrase.expected, mother_string, max_edits, start
+            )
+            if match is not None:
+                phrase.loc, phrase.length, phrase.edits = match
+                phrase.line = _line_number(mother_string, phrase.loc)
+                phrase.actual = _section(
+                    mother_string, phrase.loc, phrase.loc + phrase.length
+                )
+                start = phrase.loc + phrase.length
 
     # Step 2 -- For the ones that were not found, find the part of the
     # mother_string that should have contained it
     for i, phrase in enumerate(phrases):
-        if not phrase.found:
+        if phrase.loc == -1:
             left_found = None
             right_found = None
             for j in range(i - 1, -1, -1):
-                if phrases[j].found:
+                if phrases[j].loc != -1:
                     left_found = j
                     break
             for j in range(i + 1, len(phrases)):
-                if phrases[j].found:
+                if phrases[j].loc != -1:
                     right_found = j
                     break
 
-            if left_found is not None and right_found is not None:
-                phrase.probable_part = mother_string[
-                    phrases[left_found].loc
-                    + len(phrases[left_found].expected) : phrases[
-                        right_found
-                    ].loc
-                ]
-            elif left_found is not None:
-                phrase.probable_part = mother_string[
-                    phrases[left_found].loc
-                    + len(phrases[left_found].expected) :
-                ]
-            elif right_found is not None:
-                phrase.probable_part = mother_string[
-                    : phrases[right_found].loc
-                ]
-            else:
-                phrase.probable_part = mother_string
+            left_end = None
+            if left_found is not None:
+                left_end = phrases[left_found].loc + phrases[left_found].length
+
+            right_start = None
+            if right_found is not None:
+                right_start = phrases[right_found].loc
+
+            phrase.probable_part = _section(
+                mother_string, left_end or 0, right_start
+            )
 
     return [p for p in phrases if not p.found]
 
 
 def check_phrases(
-    expected_phrases: list[str], mother_string: str, hint_level=1
+    expected_phrases: list[str],
+    mother_string: str,
+    hint_level=1,
+    normalize=None,
+    max_edits: int = 0,
 ) -> str:
     """
     Checks if all the expected phrases are in the output in the correct order
@@ -121,7 +337,8 @@ def check_phrases(
                             mother_string in the correct order
 
     :param mother_string    The string that is expected to contain all the
-                            expected_phrases (usually the student's output)
+                            expected_phrases (usually the student's output).
+                            Can also be a LargeOutput
 
     :param hint_level       How much of a hint should be given in the error
                             message
@@ -138,6 +355,17 @@ def check_phrases(
                                 WARNING - will reveal what the testcase is
                                 checking for exactly
 
+    :param normalize        A utils.normalizing.Pipeline to clean up both the
+                            mother_string and the expected_phrases with
+                            before comparing them. The hints still show what
+                            the student actually printed
+
+    :param max_edits        If more than 0, phrases that aren't in the output
+                            are searched for again allowing this many typos
+                            (characters inserted, removed, or changed). They
+                            still fail, but the hints point at the line with
+                            the typo instead of a whole section
+
     :returns                An empty string if all the expected_phrases are
                             found, and an error message otherwise.
                             This error message should be raised as an
@@ -145,23 +373,52 @@ def check_phrases(
                             it's not empty
     """
 
-    missed_phrases = phrases_out_of_order_hint(expected_phrases, mother_string)
+    if normalize is not None:
+        cleaned = [normalize.apply(phrase) for phrase in expected_phrases]
+        originals = dict(zip(cleaned, expected_phrases))
+        normalized = normalize(mother_string)
+        try:
+            missed_phrases = phrases_out_of_order_hint(
+                cleaned, normalized, max_edits
+            )
+        finally:
+            # A cleaned LargeOutput is kept in a temporary file
+            if not isinstance(normalized, str):
+                normalized.close()
+        # Showing the phrases as they were given
+        for phrase in missed_phrases:
+            phrase.expected = originals[phrase.expected]
+    else:
+        missed_phrases = phrases_out_of_order_hint(
+            expected_phrases, mother_string, max_edits
+        )
 
     # Everything was found
     if len(missed_phrases) == 0:
         return ""
 
+    close_phrases = [p for p in missed_phrases if p.edits is not None]
+    unfound_phrases = [p for p in missed_phrases if p.edits is None]
+
     msg = "Fail\n\n"
     if hint_level >= 1:
         msg += missing_phrases_msg(len(missed_phrases), len(expected_phrases))
+        if close_phrases:
+            msg += f" {len(close_phrases)} of them were found with typos."
         msg += "\n\n"
-    if hint_level >= 2:
+    if hint_level >= 2 and close_phrases:
+        msg += "These parts of your output have typos:\n"
+        for p in close_phrases:
+            msg += f"\nFound with {_edits_text(p.edits)} at line {p.line}:\n"
+            msg += p.actual + "\n"
+        msg += "\n"
+    if hint_level >= 2 and unfound_phrases:
         msg += "The following sections of your output did not contain an "
         msg += "expected phrase and are likely the cause for the issue:\n"
         used_probable_parts = []
-        for i, p in enumerate(missed_phrases):
-            if len(missed_phrases) > 0:
-                pp = missed_phrases[i].probable_part
+        for i, p in enumerate(unfound_phrases):
+            if len(unfound_phrases) > 0:
+                pp = unfound_phrases[i].probable_part
                 if pp not in used_probable_parts:
                     used_probable_parts.append(pp)
                     msg += (
@@ -175,11 +432,19 @@ def check_phrases(
         msg += "\n\nHere are the expected phrases that were not found:\n"
         for i, p in enumerate(missed_phrases):
             msg += f"\n=========Phrase {i}=========\n" + p.expected
+            if p.edits is not None:
+                msg += (
+                    f"\n(found with {_edits_text(p.edits)} at line {p.line})"
+                )
             msg += f"\n=======End Phrase {i}=======\n"
 
     return msg
 
 
+def _edits_text(edits: int) -> str:
+    return "1 edit" if edits == 1 else f"{edits} edits"
+
+
 def missing_phrases_msg(num_missing: int, num_expected: int) -> str:
     output = f"{num_missing} out of the {num_expected} phrases weren't found. "
     output += "Reference the sample output and double check the directions."
@@ -0,0 +1,175 @@
+"""
+This file contains functions for moving the autograder's working directory
+into RAM (a tmpfs) so compiling and running the student's code doesn't wait
+on the disk.
+
+If no tmpfs can be found or mounted, everything stays in the source directory
+on disk, so tests work the same either way. Only the files a test asks to keep
+are copied back to the source directory at the end.
+"""
+
+import atexit
+import os
+import shutil
+import subprocess
+import tempfile
+import utils.common as common
+
+# Directories that are usually RAM-backed
+TMPFS_CANDIDATES = ["/dev/shm", "/run/shm", "/tmp"]
+# Where a tmpfs is mounted if none of the candidates are usable
+# The process id is added so batch grading workers don't share one
+MOUNT_POINT = "/autograder/tmpfs"
+MOUNT_SIZE = "512m"
+# Don't use a tmpfs with less free space than this
+MIN_FREE_BYTES = 32 * 1024 * 1024
+
+_kept_files = []
+_temp_dir = None
+_previous_tmpdir = None
+_mount_point = None
+
+
+def _tmpfs_mount_points() -> set[str]:
+    try:
+        with open("/proc/mounts", "r") as f:
+            return {
+                line.split()[1] for line in f if line.split()[2] == "tmpfs"
+            }
+    except (FileNotFoundError, IndexError):
+        return set()
+
+
+def _has_space(path: str, min_free_bytes: int) -> bool:
+    stats = os.statvfs(path)
+    return stats.f_bavail * stats.f_frsize >= min_free_bytes
+
+
+def find_tmpfs(min_free_bytes: int = MIN_FREE_BYTES) -> str:
+    """
+    Returns a writable tmpfs directory with enough free space, mounting one
+    if possible, or None if there isn't one
+    """
+    global _mount_point
+
+    mount_points = _tmpfs_mount_points()
+    for candidate in TMPFS_CANDIDATES:
+        if (
+            candidate in mount_points
+            and os.access(candidate, os.W_OK)
+            and _has_space(candidate, min_free_bytes)
+        ):
+            return candidate
+
+    # Mounting only works as root with the right capabilities
+    mount_point = f"{MOUNT_POINT}-{os.getpid()}"
+    try:
+        os.makedirs(mount_point, exist_ok=True)
+        mounted = subprocess.run(
+            ["mount", "-t", "tmpfs", "-o", f"size={MOUNT_SIZE}"]
+            + ["tmpfs", mount_point],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+    if mounted.returncode != 0:
+        os.rmdir(mount_point)
+        return None
+    _mount_point = mount_point
+    return mount_point
+
+
+def enter(prefer_tmpfs=True, min_free_bytes: int = MIN_FREE_BYTES) -> str:
+    """
+    Moves the working directory into a tmpfs and returns its path. Call this
+    at the start of the setup test class, before the drivers and io_files
+    are moved.
+
+    The new directory gets the same permissions as the source directory, so
+    the student user can create files in it, and the compiler's temporary
+    files are also kept in the tmpfs. The files are deleted when the tests
+    finish, except for the ones given to `keep`.
+
+    prefer_tmpfs -  If False, the source directory on disk is used
+    min_free_bytes - A tmpfs with less free space than this isn't used
+
+    If no tmpfs is usable, the source directory is returned unchanged.
+    """
+    global _temp_dir, _previous_tmpdir
+
+    if common.WORK_DIR != common.SOURCE_DIR:
+        # Already entered
+        return common.WORK_DIR
+
+    base = find_tmpfs(min_free_bytes) if prefer_tmpfs else None
+    if base is None:
+        return common.WORK_DIR
+
+    work_dir = tempfile.mkdtemp(prefix="autograder-", dir=base)
+    # Same as `chmod go=rwx` on the source directory in setup.sh
+    os.chmod(work_dir, 0o777)
+
+    # A separate directory for temporary files that only root can access
+    _temp_dir = tempfile.mkdtemp(prefix="autograder-tmp-", dir=base)
+    _previous_tmpdir = os.environ.get("TMPDIR")
+    os.environ["TMPDIR"] = _temp_dir
+    tempfile.tempdir = _temp_dir
+
+    os.chdir(work_dir)
+    common.WORK_DIR = work_dir
+    atexit.register(leave)
+    return work_dir
+
+
+def keep(*paths: str) -> None:
+    """
+    Marks files in the working directory to be copied back to the source
+    directory when the tests finish (e.g. "output.txt")
+    """
+    _kept_files.extend(paths)
+
+
+def sync() -> None:
+    """
+    Copies the files given to `keep` back to the source directory
+    """
+    if common.WORK_DIR == common.SOURCE_DIR:
+        return
+
+    for path in _kept_files:
+        source_path = os.path.join(common.WORK_DIR, path)
+        if os.path.isfile(source_path):
+            destination = os.path.join(common.SOURCE_DIR, path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy2(source_path, destination)
+
+
+def leave() -> None:
+    """
+    Syncs the kept files, moves back to the source directory, and deletes the
+    tmpfs directory. Called automatically when the tests finish.
+    """
+    global _temp_dir, _mount_point
+
+    if common.WORK_DIR == common.SOURCE_DIR:
+        return
+
+    sync()
+    os.chdir(common.SOURCE_DIR)
+    shutil.rmtree(common.WORK_DIR, ignore_errors=True)
+    common.WORK_DIR = common.SOURCE_DIR
+
+    if _temp_dir is not None:
+        shutil.rmtree(_temp_dir, ignore_errors=True)
+        _temp_dir = None
+        tempfile.tempdir = None
+        if _previous_tmpdir is None:
+            os.environ.pop("TMPDIR", None)
+        else:
+            os.environ["TMPDIR"] = _previous_tmpdir
+
+    if _mount_point is not None:
+        subprocess.run(["umount", _mount_point], stderr=subprocess.DEVNULL)
+        os.rmdir(_mount_point)
+        _mount_point = None